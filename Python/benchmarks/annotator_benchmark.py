@@ -0,0 +1,261 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Micro-benchmarks for the capture path of the Python annotator.
+Run it from this folder: python annotator_benchmark.py
+'''
+from __future__ import with_statement
+import os
+import sys
+import timeit
+import tempfile
+from cStringIO import StringIO
+import simplejson as json
+
+THIS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(THIS_FOLDER, '..'))
+sys.path.insert(0, os.path.join(THIS_FOLDER, '..', 'tests'))
+
+import MyFunctions
+from bug_reproducer_assistant import annotator
+from bug_reproducer_assistant import serialization
+from bug_reproducer_assistant.annotator import AnnotatorThread
+
+CALLS = 100000
+
+##
+# @param func Function without parameters to measure.
+# @param number Times to call it.
+# @return Microseconds per call (best of 3 runs).
+def _microsecondsPerCall(func, number = CALLS):
+    '''
+    Measure a function, in microseconds per call.
+    '''
+    timer = timeit.Timer(func)
+    return min(timer.repeat(3, number)) * 1000000.0 / number
+
+##
+# @param title Benchmark title.
+# @param results List of (description, value, units) tuples.
+def _report(title, results):
+    '''
+    Print a benchmark results.
+    '''
+    print title
+    for description, value, units in results:
+        print '    %-45s %10.3f %s' % (description, value, units)
+
+def benchmarkEventRecords():
+    '''
+    Compare the dict events used before (one key per AnnotatorThread.QueueInfo index)
+    with the tuple records: size, build time and decode time.
+    '''
+    QI = AnnotatorThread.QueueInfo
+    MT = QI.MessageTypes
+    obj, callSite, args, kargs = MyFunctions, object(), (4, 5), {}
+    #Dict keys as in the previous layout
+    MESSAGE_TYPE, INDEX_OBJ, INDEX_CALL_SITE, INDEX_FUNC_CALL, INDEX_ANNOTATION_ID, INDEX_ARGS, INDEX_KARGS, INDEX_THREW, INDEX_RETURNED_OBJ, INDEX_THREAD_ID, INDEX_SEQUENCE = range(11)
+
+    def dictEvent():
+        item = {}
+        item[MESSAGE_TYPE] = MT.ENTER_FUNCTION
+        item[INDEX_OBJ] = obj
+        item[INDEX_ANNOTATION_ID] = 1234
+        item[INDEX_CALL_SITE] = callSite
+        item[INDEX_ARGS] = args
+        item[INDEX_KARGS] = kargs
+        item[INDEX_THREAD_ID] = 1
+        item[INDEX_SEQUENCE] = 0
+        return item
+
+    def tupleEvent():
+        return (MT.ENTER_FUNCTION, 1, 0, 1234, obj, callSite, args, kargs)
+
+    dictItem = dictEvent()
+    tupleItem = tupleEvent()
+
+    def decodeDict():
+        return (dictItem[MESSAGE_TYPE], dictItem[INDEX_THREAD_ID], dictItem[INDEX_SEQUENCE], dictItem[INDEX_ANNOTATION_ID],
+                dictItem[INDEX_OBJ], dictItem[INDEX_CALL_SITE], dictItem[INDEX_ARGS], dictItem[INDEX_KARGS])
+
+    def decodeTuple():
+        _, threadId, sequence, annotationId, obj, callSite, args, kargs = tupleItem
+        return threadId
+
+    _report('Event records (ENTER_FUNCTION)', [
+        ('dict size', sys.getsizeof(dictItem), 'bytes'),
+        ('tuple size', sys.getsizeof(tupleItem), 'bytes'),
+        ('dict build', _microsecondsPerCall(dictEvent), 'us/event'),
+        ('tuple build', _microsecondsPerCall(tupleEvent), 'us/event'),
+        ('dict decode', _microsecondsPerCall(decodeDict), 'us/event'),
+        ('tuple decode', _microsecondsPerCall(decodeTuple), 'us/event'),
+    ])
+
+##
+# @param annotate Callback that receives the Annotator, to annotate the functions.
+# @param codeToRun Function without parameters to measure.
+# @param number Times to call it.
+# @param annotatorOptions Options for ProgramExecutionDumper.
+# @return Microseconds per call, including the time for AnnotatorThread to process the events.
+def _annotatedMicrosecondsPerCall(annotate, codeToRun, number = CALLS, **annotatorOptions):
+    '''
+    Measure an annotated function, in microseconds per call.
+    '''
+    a = annotator.annotatorInstance()
+    a.resetForNewAnnotations()
+    annotate(a)
+    dumpFileName = os.path.join(tempfile.gettempdir(), 'annotator_benchmark.json')
+    timer = timeit.default_timer
+    with annotator.ProgramExecutionDumper(dumpFileName, preserveOldDumpFiles = False, **annotatorOptions):
+        start = timer()
+        for _ in xrange(number):
+            codeToRun()
+        producerTime = timer() - start
+    return producerTime * 1000000.0 / number
+
+def benchmarkAnnotatedCall():
+    '''
+    Cost of an annotated call, compared with the plain call.
+    '''
+    def annotate(a):
+        a.annotate(MyFunctions, 'add')
+    def codeToRun():
+        MyFunctions.add(4, 5)
+    number = CALLS / 10
+    _report('Annotated call: MyFunctions.add(4, 5)', [
+        ('plain call', _microsecondsPerCall(codeToRun, number), 'us/call'),
+        ('annotated call (shared queue)', _annotatedMicrosecondsPerCall(annotate, codeToRun, number), 'us/call'),
+        ('annotated call (thread buffers)', _annotatedMicrosecondsPerCall(annotate, codeToRun, number, eventBufferSize = 256), 'us/call'),
+    ])
+
+def benchmarkLargeContainers():
+    '''
+    Cost for AnnotatorThread to declare a large list argument: the first time (the list is walked),
+    and when the same list is passed again (the list is compared with its snapshot).
+    '''
+    LIST_SIZE = 100000
+    aProgramExecution = annotator.ProgramExecution( annotator.ProgramExecution.Languages.PYTHON )
+    annotatorThread = AnnotatorThread(aProgramExecution, None)
+    bigList = range(LIST_SIZE)
+    timer = timeit.default_timer
+    start = timer()
+    annotatorThread._declareObjectAndParents(bigList, False)
+    firstTime = timer() - start
+    def declareAgain():
+        annotatorThread._declareObjectAndParents(bigList, False)
+    _report('Declare a %d-element list' % LIST_SIZE, [
+        ('first declaration', firstTime * 1000.0, 'ms'),
+        ('same list again', _microsecondsPerCall(declareAgain, 100) / 1000.0, 'ms'),
+    ])
+
+def benchmarkCaptureEngines():
+    '''
+    Cost of an annotated call for each CaptureEngine, and the cost the profiler engine adds to a call that's not annotated.
+    '''
+    def annotate(a):
+        a.annotate(MyFunctions, 'add')
+        a.annotate(MyFunctions.ClassWithConstructor, 'getX')
+    def callFunction():
+        MyFunctions.add(4, 5)
+    instance = MyFunctions.ClassWithConstructor(1, 2)
+    def callMethod():
+        instance.getX()
+    def callNotAnnotated():
+        MyFunctions.subtract(4, 5)
+    number = CALLS / 10
+    results = []
+    for engineName, captureEngine in (('wrappers', annotator.CaptureEngine.WRAPPERS), ('profiler', annotator.CaptureEngine.PROFILER)):
+        results.append(('function, %s' % engineName, _annotatedMicrosecondsPerCall(annotate, callFunction, number, captureEngine = captureEngine), 'us/call'))
+        results.append(('method, %s' % engineName, _annotatedMicrosecondsPerCall(annotate, callMethod, number, captureEngine = captureEngine), 'us/call'))
+        results.append(('function not annotated, %s' % engineName, _annotatedMicrosecondsPerCall(annotate, callNotAnnotated, number, captureEngine = captureEngine), 'us/call'))
+    results.append(('function not annotated, plain', _microsecondsPerCall(callNotAnnotated, number), 'us/call'))
+    _report('Capture engines', results)
+
+##
+# @param aList A list.
+def consume(aList):
+    '''
+    Annotated function for benchmarkCapturePolicies().
+    '''
+    pass
+
+def benchmarkCapturePolicies():
+    '''
+    Cost of an annotated call with a list argument, for each CapturePolicy:
+    the same list passed again and again, and a list changed before every call.
+    '''
+    thisModule = sys.modules[__name__]
+    def annotate(a):
+        a.annotate(thisModule, 'consume')
+    results = []
+    for listSize in (10, 1000):
+        sameList = range(listSize)
+        def callWithSameList():
+            thisModule.consume(sameList)
+        changingList = range(listSize)
+        def callWithChangingList():
+            changingList[0] += 1
+            thisModule.consume(changingList)
+        number = CALLS / 100
+        for policyName, capturePolicy in (('reference', annotator.CapturePolicy.REFERENCE), ('snapshot', annotator.CapturePolicy.SNAPSHOT)):
+            results.append(('%d-element list, same, %s' % (listSize, policyName), _annotatedMicrosecondsPerCall(annotate, callWithSameList, number, capturePolicy = capturePolicy), 'us/call'))
+            results.append(('%d-element list, changing, %s' % (listSize, policyName), _annotatedMicrosecondsPerCall(annotate, callWithChangingList, number, capturePolicy = capturePolicy), 'us/call'))
+    _report('Capture policies (calling thread cost)', results)
+
+def benchmarkJsonEncoding():
+    '''
+    Encoding throughput of asJsonString() (compact, with the C speedups, if simplejson has them),
+    compared with the indented encoding it used before; and the whole database dump, compact and pretty-printed.
+    '''
+    indent = serialization.CallGraphSerializer.JSON.INDENT
+    def indentedJsonString(obj):
+        io = StringIO()
+        json.dump(obj, io, sort_keys=True, indent=indent)
+        return io.getvalue()
+    values = [5, 'On the Internet nobody knows you\'re a dog.', range(20), dict([(str(i), i) for i in range(20)])]
+    results = []
+    for value in values:
+        description = type(value).__name__
+        results.append(('%s, indented' % description, _microsecondsPerCall(lambda: indentedJsonString(value), CALLS / 10), 'us/object'))
+        results.append(('%s, compact' % description, _microsecondsPerCall(lambda: serialization.asJsonString(value), CALLS / 10), 'us/object'))
+    
+    #A call graph with 1000 calls, with an int argument each
+    def annotate(a):
+        a.annotate(MyFunctions, 'add')
+    def codeToRun():
+        MyFunctions.add(4, 5)
+    _annotatedMicrosecondsPerCall(annotate, codeToRun, 1000)
+    aProgramExecution = annotator.annotatorInstance().getProgramExecution()
+    for description, prettyPrint in (('database dump, compact', False), ('database dump, pretty-printed', True)):
+        def dump():
+            serialization.CallGraphSerializer().dump(aProgramExecution, StringIO(), prettyPrint)
+        results.append((description, _microsecondsPerCall(dump, 10) / 1000.0, 'ms'))
+    _report('Json encoding (C speedups: %s)' % (json.encoder.c_make_encoder is not None), results)
+
+def main():
+    '''
+    Run all the benchmarks.
+    '''
+    benchmarkEventRecords()
+    benchmarkAnnotatedCall()
+    benchmarkLargeContainers()
+    benchmarkCapturePolicies()
+    benchmarkCaptureEngines()
+    benchmarkJsonEncoding()
+
+if __name__ == '__main__':
+    main()
@@ -21,18 +21,31 @@ but it also stores its data and parameters in a memory representation of the cal
 to persist it later in a Database.
 '''
 from __future__ import with_statement
+import os
 import sys
 import types
 import inspect
+import itertools
+import threading
+import weakref
+import hashlib
+from collections import deque
+from timeit import default_timer
 import simplejson as json
 from cStringIO import StringIO
 
 from threading import Thread
 from Queue import Queue
+import multiprocessing.util
 
 import file_utils
+import clocks
+from instance_identities import InstanceIdentities
 from serialization import CallGraphSerializer
+from serialization import CallGraphStreamWriter
 from serialization import asJsonString
+from event_records import EventRecordWriter
+from event_records import connectToCollector
 from call_graph import LanguageType
 from call_graph import LanguageObject
 from call_graph import FunctionCall
@@ -74,8 +87,9 @@ def _getClassMethodsType(cls):
 ##
 # @param annotatedObj Python "object" (it may be a module, class, or instance) whose functions we're annotating.
 # @param funcName annotatedObj's function to query.
+# @param classMethodsTypeCache Optional dict { class -> _getClassMethodsType(class) }, to avoid inspecting the same class more than once.
 # @return Attribute kind for the function, see function documentation for the values.
-def _getInspectMethodType(annotatedObj, funcName):
+def _getInspectMethodType(annotatedObj, funcName, classMethodsTypeCache = None):
     '''
     Get the kind of attribute for this function, i.e.: one of these strings:
            'class method'    created via classmethod()
@@ -87,18 +101,22 @@ def _getInspectMethodType(annotatedObj, funcName):
     methodType = 'method'
     cls = _getClassForAnnotatedObj(annotatedObj)
     if cls is not None:
-        methodsType = _getClassMethodsType(cls)
+        if classMethodsTypeCache is None:
+            methodsType = _getClassMethodsType(cls)
+        else:
+            if not classMethodsTypeCache.has_key(cls):
+                classMethodsTypeCache[cls] = _getClassMethodsType(cls)
+            methodsType = classMethodsTypeCache[cls]
         methodType = methodsType[funcName]
     return methodType
 
 ##
-# @param obj Python "object" (it may be a module, class, or instance) whose functions we're annotating.
-# @param funcName obj's function to query.
+# @param inspectMethodType Attribute kind for the function (see _getInspectMethodType()).
+# @param funcName Function name.
 # @return The suitable FunctionCall.MethodType for the function, see function documentation for the values.
-def _getFunctionCallMethodType(obj, funcName):
+def _getFunctionCallMethodType(inspectMethodType, funcName):
     '''
-    Get 'bug_reproducer_assistant' method type for an objet's function.
-    Get the 'inspect' module method type, and then translate it to FunctionCall.MethodType.
+    Translate the 'inspect' module method type to 'bug_reproducer_assistant' method type (FunctionCall.MethodType).
     There's a special type 'Constructor' for the object's constructor (__init__)
     This is the mapping:
         Inspect's 'static method' -> FunctionCall.MethodType.STATIC_METHOD
@@ -108,7 +126,7 @@ def _getFunctionCallMethodType(obj, funcName):
         Constructor (__init__)    -> FunctionCall.MethodType.CONSTRUCTOR
     '''
     MT = FunctionCall.MethodType
-    imt = _getInspectMethodType(obj, funcName)
+    imt = inspectMethodType
     if imt == 'static method':
         return MT.STATIC_METHOD
     if imt == 'class method':
@@ -133,443 +151,2868 @@ def _getLanguageType(obj):
         return LanguageType.CLASS
     return LanguageType.INSTANCE
 
-class AnnotatorThread(Thread):
+#Immutable native types: their objects are identified by value
+_VALUE_TYPES = frozenset([types.NoneType, types.BooleanType, types.IntType, types.LongType, types.FloatType, types.ComplexType, types.StringType, types.UnicodeType])
+#Native containers: their children are declared one by one
+_CONTAINER_TYPES = frozenset([types.TupleType, types.ListType, types.DictType])
+
+#Containers nested deeper than this are not copied by _getContentsSnapshot()
+_MAX_SNAPSHOT_DEPTH = 50
+
+class _NoSnapshotException(Exception):
     '''
-    Thread class to annotate the functions. It may work in a multi-threaded
-    environment, because it uses Python threading queues.
+    Raised by _getContentsSnapshot() for a container inside itself, or too deep.
     '''
-    #Constants
-    class Containers:
+    pass
+
+##
+# @param obj A native container (tuple, list or dict).
+# @param path The id()'s of the containers being copied, that contain obj.
+# @param captureLimits CaptureLimits, or None.
+# @return A copy of the container, that may be compared with it later.
+def _getContentsSnapshot(obj, path = None, captureLimits = None):
+    '''
+    Copy a container, and recursively the containers inside it (other children are shared, not copied).
+    Comparing the copy with the container tells whether the container, or any container inside it,
+    has changed since the copy was made (see _hasSameContents()). It's much cheaper than walking the container again.
+    A container inside itself can't be copied this way (and == can't compare it): it raises _NoSnapshotException,
+    like a container with more than _MAX_SNAPSHOT_DEPTH nesting levels.
+    The containers inside it over the capture limits are not copied: AnnotatorThread summarizes them anyway.
+    '''
+    objType = type(obj)
+    if objType is types.DictType:
+        #Fast path (native loops only): no containers inside
+        if _CONTAINER_TYPES.isdisjoint(map(type, obj.itervalues())):
+            return dict(obj)
+    elif _CONTAINER_TYPES.isdisjoint(map(type, obj)):
+        #A tuple without containers inside never changes
+        return obj if objType is types.TupleType else list(obj)
+    if path is None:
+        path = set()
+    if id(obj) in path or len(path) == _MAX_SNAPSHOT_DEPTH:
+        raise _NoSnapshotException()
+    path.add(id(obj))
+    if objType is types.DictType:
+        snapshot = dict( (key, _getChildSnapshot(value, path, captureLimits)) for key, value in obj.iteritems() )
+    else:
+        children = [_getChildSnapshot(child, path, captureLimits) for child in obj]
+        snapshot = tuple(children) if objType is types.TupleType else children
+    path.remove(id(obj))
+    return snapshot
+
+##
+# @param child A child of a container being copied by _getContentsSnapshot().
+# @param path The id()'s of the containers being copied, that contain child.
+# @param captureLimits CaptureLimits, or None.
+# @return The child copy, or the child itself if it's not a container, or it's over the capture limits.
+def _getChildSnapshot(child, path, captureLimits):
+    '''
+    Copy a child of a container (see _getContentsSnapshot()). A child shared by the copy is not compared
+    by _hasSameContents(): a summarized container doesn't tell whether it has changed.
+    '''
+    if type(child) not in _CONTAINER_TYPES:
+        return child
+    if captureLimits is not None and captureLimits.mustSummarize(child, len(path) + 1, None):
+        return child
+    return _getContentsSnapshot(child, path, captureLimits)
+
+##
+# @param obj A native container (tuple, list or dict).
+# @param snapshot A previous _getContentsSnapshot() for a container with the same id().
+# @return True if obj has the same contents as the snapshot.
+def _hasSameContents(obj, snapshot):
+    '''
+    Tell whether a container has the same contents as a snapshot (see _getContentsSnapshot()).
+    The comparison is type-strict: 1, 1.0 and True are equal for ==, but they're different arguments.
+    Every child must have the same type as its copy, the values are compared by ==, and any other child
+    must be the very same object (its __eq__ is never called).
+    Dicts are compared in iteration order: if it has changed, they're just reported as changed.
+    '''
+    pending = [(obj, snapshot)]
+    while pending:
+        current, copy = pending.pop()
+        if current is copy:
+            #A tuple without containers inside is its own snapshot
+            continue
+        currentType = type(current)
+        if currentType is not type(copy) or len(current) != len(copy):
+            return False
+        if currentType is types.DictType:
+            currentChildren = list(itertools.chain.from_iterable(current.iteritems()))
+            copyChildren = list(itertools.chain.from_iterable(copy.iteritems()))
+        else:
+            currentChildren = current
+            copyChildren = copy
+        childrenTypes = map(type, currentChildren)
+        if childrenTypes != map(type, copyChildren):
+            return False
+        if _VALUE_TYPES.issuperset(childrenTypes):
+            #Fast path (native loops only): values of the same types
+            if currentChildren != copyChildren:
+                return False
+            continue
+        for child, childCopy, childType in itertools.izip(currentChildren, copyChildren, childrenTypes):
+            if childType in _CONTAINER_TYPES:
+                pending.append( (child, childCopy) )
+            elif childType in _VALUE_TYPES:
+                if child != childCopy:
+                    return False
+            elif child is not childCopy:
+                return False
+    return True
+
+class _ContainerFrame:
+    '''
+    A container being walked by AnnotatorThread._declareContainer().
+    '''
+    ##
+    # @param self The _ContainerFrame instance to construct.
+    # @param container A native container (tuple, list or dict).
+    def __init__(self, container):
         '''
-        Type of container. Language Objects and Function Calls are stored separately.
+        Constructor.
         '''
-        LANGUAGE_OBJECTS, FUNCTION_CALLS = range(2)
-    
-    class QueueInfo:
+        self.container_ = container
+        #Children not walked yet: for dicts, every key followed by its value
+        if type(container) is types.DictType:
+            self.children_ = itertools.chain.from_iterable(container.items())
+        else:
+            self.children_ = iter(container)
+        self.childrenIds_ = []
+        #LanguageObject id, if there's a back-reference to the container (see AnnotatorThread._reserveContainerId())
+        self.reservedId_ = None
+
+    ##
+    # @param self The _ContainerFrame instance.
+    # @return The container, with its children replaced by their LanguageObject id's.
+    def getObjectToDeclare(self):
         '''
-        Indices in the item data stored in the queue.
-        Each one represents different information for function calls.
+        Get the container to declare, once every child has been declared.
         '''
-        class MessageTypes:
-            '''
-            Type of queue message.
-            '''
-            ENTER_FUNCTION, EXIT_FUNCTION, END_ANNOTATION = range(3)
-        #Index in Queue item list
-        MESSAGE_TYPE,\
-        INDEX_OBJ,\
-        INDEX_FUNC_NAME,\
-        INDEX_FUNC_CALL,\
-        INDEX_ANNOTATION_ID,\
-        INDEX_ARGS,\
-        INDEX_KARGS,\
-        INDEX_THREW,\
-        INDEX_RETURNED_OBJ = range(9)
+        containerType = type(self.container_)
+        if containerType is types.TupleType:
+            return tuple(self.childrenIds_)
+        if containerType is types.DictType:
+            return dict(zip(self.childrenIds_[0::2], self.childrenIds_[1::2]))
+        return self.childrenIds_
 
+class _WrittenLanguageObject(LanguageObject):
+    '''
+    A LanguageObject already written to the streaming database: only what the records referring to it need
+    (its id, and its type, to validate its children) is kept, without its declaration code or parent.
+    '''
     ##
-    # @param self The AnnotatorThread to construct.
-    # @param aProgramExecution ProgramExecution instance where the Call Graph will be stored.
-    # @param callGraphQueue Message queue for other threads to inform about function calls to store.
-    def __init__(self, aProgramExecution, callGraphQueue):
+    # @param self The _WrittenLanguageObject instance to construct.
+    # @param lo The LanguageObject written.
+    def __init__(self, lo):
         '''
         Constructor.
         '''
-        Thread.__init__(self)
-        self.nextIdsMap_ = {}
-        self.nextIdsMap_[AnnotatorThread.Containers.LANGUAGE_OBJECTS] = 1
-        self.nextIdsMap_[AnnotatorThread.Containers.FUNCTION_CALLS] = 1
-        self.annotationIdToFuncCall_ = {}
-        self.pythonIdToLanguageObjectId_ = {} 
-        self.programExecution_ = aProgramExecution
-        self.callGraphQueue_ = callGraphQueue
-        self.currentFunctionLevel_ = ProgramExecution.MIN_LEVEL - 1
-        self.annotationEnded_ = False
+        self.id_ = lo.getId()
+        self.languageType_ = lo.getLanguageType()
+        self.declarationType_ = lo.getDeclarationType()
+        self.declarationCode_ = None
+        self.parent_ = None
 
+class _RecentObjects:
+    '''
+    The LanguageObject's declared most recently, by their python id (see AnnotatorThread._getPythonUniqueId()),
+    for the streaming mode: they're not kept in the ProgramExecution, and only the recent ones are remembered.
+    Once written, a LanguageObject is only referred to by its id: just a _WrittenLanguageObject is remembered.
+    There are two generations: when the newer one is full, the older one is forgotten, and the newer one takes its place.
+    A hit in the older generation brings the object back to the newer one, so the objects in use are never forgotten.
+    A forgotten object that appears again is just declared again (with a new id).
+    '''
     ##
-    # @param self The AnnotatorThread instance.
-    def run(self):
+    # @param self The _RecentObjects instance to construct.
+    # @param generationSize Maximum number of objects in each generation.
+    def __init__(self, generationSize):
         '''
-        "Almost infinite" loop for processing the queue messages.
-        It may only be broken with an "END_ANNOTATION" message.
+        Constructor.
         '''
-        while not self.annotationEnded_:
-            item = self.callGraphQueue_.get()
-            self._processQueueItem(item)
-            self.callGraphQueue_.task_done()
+        assert generationSize > 0
+        self.generationSize_ = generationSize
+        #{ python id -> LanguageObject }
+        self.newer_ = {}
+        self.older_ = {}
 
     ##
-    # @param self The AnnotatorThread instance.
-    # @param item Queue item to process.
-    def _processQueueItem(self, item):
+    # @param self The _RecentObjects instance.
+    # @param pythonId The object's python id.
+    # @return Its LanguageObject, or None if it's not remembered.
+    def get(self, pythonId):
         '''
-        Process queue item. It's a dict mapping QueueInfo constants to custom data.
-        The most important data is MESSAGE_TYPE, to indicate begin or end of annotations, or function process.
+        Get a remembered LanguageObject.
         '''
-        msgType = item[AnnotatorThread.QueueInfo.MESSAGE_TYPE]
-        
-        #Special message for commanding this thread to terminate
-        if msgType == AnnotatorThread.QueueInfo.MessageTypes.END_ANNOTATION:
-            self.annotationEnded_ = True
-            return
-        
-        if msgType == AnnotatorThread.QueueInfo.MessageTypes.ENTER_FUNCTION:
-            self.currentFunctionLevel_ += 1 
-            obj = item[AnnotatorThread.QueueInfo.INDEX_OBJ]
-            annotationId = item[AnnotatorThread.QueueInfo.INDEX_ANNOTATION_ID]
-            funcName = item[AnnotatorThread.QueueInfo.INDEX_FUNC_NAME]
-            methodType = _getFunctionCallMethodType(obj, funcName)
-            args = item[AnnotatorThread.QueueInfo.INDEX_ARGS]
-            kargs = item[AnnotatorThread.QueueInfo.INDEX_KARGS]
-            
-            lo = self._declareObjectAndParents(obj, isCallee = True)
-            argsList = []
-            for arg in args:
-                argLanguageObject = self._declareObjectAndParents(arg, isCallee = False)
-                argsList.append(Argument(argLanguageObject))
-            
-            for argName, karg in kargs.items():
-                argLanguageObject = self._declareObjectAndParents(karg, isCallee = False)
-                argsList.append(Argument(argLanguageObject, argName))
-    
-            newFunctionCallId = self._getNewId(AnnotatorThread.Containers.FUNCTION_CALLS)
-            aCall = FunctionCall(newFunctionCallId, lo, funcName, methodType, argsList, self.currentFunctionLevel_)
-            self.programExecution_.addFunctionCall(aCall)
-            self.annotationIdToFuncCall_[annotationId] = aCall
+        lo = self.newer_.get(pythonId)
+        if lo is None:
+            lo = self.older_.pop(pythonId, None)
+            if lo is not None:
+                self.newer_[pythonId] = lo
+        return lo
+
+    ##
+    # @param self The _RecentObjects instance.
+    # @param pythonId The object's python id.
+    # @param lo Its LanguageObject.
+    # @return The python id's forgotten to make room for it.
+    def add(self, pythonId, lo):
+        '''
+        Remember a newly declared LanguageObject.
+        '''
+        forgotten = ()
+        if len(self.newer_) >= self.generationSize_:
+            forgotten = self.older_.keys()
+            self.older_ = self.newer_
+            self.newer_ = {}
+        self.newer_[pythonId] = lo
+        return forgotten
+
+#Children hashed at once by _getSummary(): the memory it needs doesn't depend on the container size
+_SUMMARY_CHUNK_SIZE = 1024
+
+##
+# @param obj A native container (tuple, list or dict), or a string.
+# @return A short description of obj: its type, its size, and a sha1 of its contents.
+def _getSummary(obj):
+    '''
+    Describe a value that is not captured, because it's over the capture limits (see CaptureLimits).
+    For instance: "list of 1,000,000 ints, sha1=...". The sha1 tells whether two summarized values are the same.
+    The contents are hashed by chunks: a container's children are hashed by their repr().
+    '''
+    objType = type(obj)
+    digest = hashlib.sha1()
+    try:
+        if objType is types.UnicodeType or objType is types.StringType:
+            contents = obj.encode('utf-8') if objType is types.UnicodeType else obj
+            description = '%s of %s bytes' % (objType.__name__, format(len(contents), ','))
+            digest.update(contents)
+        else:
+            if objType is types.DictType:
+                itemsDescription = 'items'
+                children = obj.iteritems()
+            else:
+                childrenTypes = set(itertools.imap(type, obj))
+                itemsDescription = childrenTypes.pop().__name__ + 's' if len(childrenTypes) == 1 else 'items'
+                children = iter(obj)
+            description = '%s of %s %s' % (objType.__name__, format(len(obj), ','), itemsDescription)
+            chunk = list(itertools.islice(children, _SUMMARY_CHUNK_SIZE))
+            while chunk:
+                digest.update(repr(chunk))
+                chunk = list(itertools.islice(children, _SUMMARY_CHUNK_SIZE))
+    except Exception:
+        #A child's repr() failed, or it's too deep
+        return description
+    return description + ', sha1=' + digest.hexdigest()
+
+class CallSiteDescriptor:
+    '''
+    Everything the annotations need to know about an annotated function that does not depend on a given call.
+    It's resolved only once, when the function is wrapped (see Annotator.startAnnotations()),
+    so neither annotatedFunction() nor AnnotatorThread have to inspect the class on every call.
+    It's immutable: it only has getters.
+    '''
+    ##
+    # @param self The CallSiteDescriptor instance to construct.
+    # @param functionName Function name to store in the call graph.
+    # @param languageType LanguageType (MODULE, CLASS, INSTANCE) for the annotated object.
+    # @param inspectMethodType Attribute kind for the function (see _getInspectMethodType()).
+    def __init__(self, functionName, languageType, inspectMethodType):
+        '''
+        Constructor.
+        '''
+        self.functionName_ = functionName
+        self.languageType_ = languageType
+        self.inspectMethodType_ = inspectMethodType
+        self.methodType_ = _getFunctionCallMethodType(inspectMethodType, functionName)
+        isClassOrStaticMethod = inspectMethodType in ('class method', 'static method')
+        # Special case: annotating a class, if it's not a class or static method:
+        # Use self (1st argument) as the callee
+        self.calleeIsFirstArg_ = languageType == LanguageType.CLASS and not isClassOrStaticMethod
+        #Skip extra first arg (cls or self) before running
+        self.skipFirstArg_ = inspectMethodType == 'class method' or (languageType == LanguageType.INSTANCE and inspectMethodType == 'method')
+
+    ##
+    # @param self The CallSiteDescriptor instance.
+    # @return The function name.
+    def getFunctionName(self):
+        '''
+        Get the function name.
+        '''
+        return self.functionName_
+
+    ##
+    # @param self The CallSiteDescriptor instance.
+    # @return LanguageType (MODULE, CLASS, INSTANCE) for the annotated object.
+    def getLanguageType(self):
+        '''
+        Get the LanguageType for the annotated object.
+        '''
+        return self.languageType_
+
+    ##
+    # @param self The CallSiteDescriptor instance.
+    # @return Attribute kind for the function (see _getInspectMethodType()).
+    def getInspectMethodType(self):
+        '''
+        Get the 'inspect' module attribute kind for the function.
+        '''
+        return self.inspectMethodType_
+
+    ##
+    # @param self The CallSiteDescriptor instance.
+    # @return The FunctionCall.MethodType for the function.
+    def getMethodType(self):
+        '''
+        Get the FunctionCall.MethodType for the function.
+        '''
+        return self.methodType_
+
+    ##
+    # @param self The CallSiteDescriptor instance.
+    # @return True if the callee is the first argument (self), instead of the annotated object.
+    def calleeIsFirstArg(self):
+        '''
+        Callee-resolution rule: tell whether the callee is the first argument (self) instead of the annotated object.
+        '''
+        return self.calleeIsFirstArg_
+
+    ##
+    # @param self The CallSiteDescriptor instance.
+    # @return True if the first argument (cls or self) must be removed before calling the original function.
+    def skipFirstArg(self):
+        '''
+        Arg-slicing rule: tell whether the first argument (cls or self) must be removed before calling the original function.
+        '''
+        return self.skipFirstArg_
+
+##
+# @param obj Python "object" (it may be a module, class, or instance) whose functions we're annotating.
+# @param funcName obj's function to describe.
+# @param fun The function to be annotated (getattr(obj, funcName)).
+# @param classMethodsTypeCache Optional dict { class -> _getClassMethodsType(class) } shared between calls.
+# @return A new CallSiteDescriptor for the function.
+def _createCallSiteDescriptor(obj, funcName, fun, classMethodsTypeCache = None):
+    '''
+    Resolve once all the per-function information that annotatedFunction() and AnnotatorThread need.
+    '''
+    return CallSiteDescriptor(fun.__name__, _getLanguageType(obj), _getInspectMethodType(obj, funcName, classMethodsTypeCache))
+
+##
+# @param obj Python "object" (module, class, or instance) whose function we're annotating.
+# @param funcName Function name.
+# @return The function name, qualified by its class or module (e.g.: 'MyClass.myMethod').
+def _getQualifiedFunctionName(obj, funcName):
+    '''
+    Qualify a function name with its class name (for methods) or module name, to tell it apart in the capture metadata.
+    '''
+    owner = _getClassForAnnotatedObj(obj) or obj
+    return getattr(owner, '__name__', str(owner)) + '.' + funcName
+
+class ThreadEventBuffer:
+    '''
+    Capture state for one application thread: its capture thread id, the sequence number for its next event,
+    how many annotated functions it's running right now, (in the buffered capture mode, see Annotator.setEventBufferSize())
+    the events not handed to AnnotatorThread yet, and (in the capture-on-failure mode, see Annotator.setCaptureOnFailure())
+    the events of the root call it's running.
+    Only the owner thread appends events to it, but any thread may take them when the annotations finish
+    (see Annotator._finishCapture()), or once the owner thread has ended (see Annotator._takeEndedThreadEventBuffers()),
+    so the buffered events list is only appended to, or handed off, under its lock.
+    '''
+    #Capture thread id's are small consecutive numbers: thread.get_ident() values may be reused when a thread dies
+    nextThreadIds_ = itertools.count(1)
+    #Maximum number of containers whose last snapshot is remembered
+    MAX_SNAPSHOTS = 1024
+
+    ##
+    # @param self The ThreadEventBuffer instance to construct.
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        self.threadId_ = ThreadEventBuffer.nextThreadIds_.next()
+        self.nextSequence_ = 0
+        self.depth_ = 0
+        self.events_ = []
+        self.eventsLock_ = threading.Lock()
+        #Snapshot capture policy: { id(container) -> its last snapshot }
+        self.snapshots_ = {}
+        #How many annotated functions it's running without capturing them (see Annotator.mustSkipCapture())
+        self.skippedDepth_ = 0
+        #Root calls started while the capture queue was full, and how many of them were dropped (see OverflowPolicy)
+        self.overflowRootCalls_ = 0
+        self.droppedRootCalls_ = 0
+        #Capture-on-failure mode: events of the current root call, and its nested calls
+        self.rootCallEvents_ = []
+        #Profiler engine: (frame, Annotator, captured) for every annotated function running, innermost last
+        self.profiledFrames_ = []
+        #Profiler engine, timed calls (see Annotator.setCallTiming()): (wall, CPU) start times for every captured call running, innermost last
+        self.profiledStartTimes_ = []
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    # @return The capture thread id (unique in the process, unlike thread.get_ident()).
+    def getThreadId(self):
+        '''
+        Get the capture thread id.
+        '''
+        return self.threadId_
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    # @return The sequence number for the next event of this thread.
+    def nextSequence(self):
+        '''
+        Get the sequence number for the next event of this thread.
+        AnnotatorThread uses it to restore the thread's events order, whatever the batches arrival order.
+        '''
+        sequence = self.nextSequence_
+        self.nextSequence_ += 1
+        return sequence
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    # @param event Queue item to hand to AnnotatorThread later.
+    # @return The number of buffered events.
+    def append(self, event):
+        '''
+        Buffer an event.
+        '''
+        with self.eventsLock_:
+            self.events_.append(event)
+            return len(self.events_)
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    # @return The buffered events (the buffer is left empty).
+    def takeEvents(self):
+        '''
+        Take all the buffered events, leaving the buffer empty.
+        '''
+        with self.eventsLock_:
+            events = self.events_
+            self.events_ = []
+        return events
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    # @return The events of the root call that has just ended (the root call buffer is left empty).
+    def takeRootCallEvents(self):
+        '''
+        Capture-on-failure mode: take the events of the root call that has just ended, to commit them.
+        '''
+        events = self.rootCallEvents_
+        self.rootCallEvents_ = []
+        return events
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    def discardRootCall(self):
+        '''
+        Capture-on-failure mode: forget the events of the root call that has just ended.
+        Their sequence numbers are reused, so AnnotatorThread doesn't wait for them.
+        '''
+        if self.rootCallEvents_:
+            self.nextSequence_ = self.rootCallEvents_[0][AnnotatorThread.QueueInfo.INDEX_SEQUENCE]
+        self.rootCallEvents_ = []
+
+    ##
+    # @param self The ThreadEventBuffer instance.
+    # @param obj An argument or returned object.
+    # @param captureLimits CaptureLimits, or None.
+    # @return An object with obj's current value, that won't change if obj is changed later.
+    def snapshot(self, obj, captureLimits = None):
+        '''
+        Snapshot capture policy (see CapturePolicy): copy a native container (see _getContentsSnapshot()),
+        but reuse the last snapshot for that container if its contents have not changed (not even the types of its values,
+        see _hasSameContents()), so AnnotatorThread
+        recognizes it (see AnnotatorThread._declareObjectAndParents()). Other objects (and the containers
+        that can't be copied) are returned as they are.
+        A container over the capture limits is not copied either: AnnotatorThread summarizes it, so its summary
+        may describe the contents it has by then.
+        '''
+        if type(obj) not in _CONTAINER_TYPES:
+            return obj
+        if captureLimits is not None and captureLimits.mustSummarize(obj, 1, None):
+            return obj
+        snapshot = self.snapshots_.get(id(obj))
+        if snapshot is None or not _hasSameContents(obj, snapshot):
+            if len(self.snapshots_) >= ThreadEventBuffer.MAX_SNAPSHOTS:
+                self.snapshots_.clear()
+            try:
+                snapshot = _getContentsSnapshot(obj, captureLimits = captureLimits)
+            except _NoSnapshotException:
+                #Captured by reference
+                return obj
+            self.snapshots_[id(obj)] = snapshot
+        return snapshot
+
+class CapturePolicy:
+    '''
+    How the arguments and returned objects of the annotated calls are captured:
+        * REFERENCE: they're passed to AnnotatorThread as they are. It's the cheapest policy, but if a container
+          is changed after the call (and before AnnotatorThread declares it), the new contents are recorded.
+        * SNAPSHOT: native containers (lists, dicts, tuples) are copied on the calling thread (see ThreadEventBuffer.snapshot()).
+          Immutable values and other objects are still passed as they are, and AnnotatorThread does the encoding.
+    '''
+    REFERENCE, SNAPSHOT = range(2)
+
+class OverflowPolicy:
+    '''
+    What an application thread does when the capture queue is full (see Annotator.setQueueBound()):
+        * BLOCK: wait until AnnotatorThread makes room.
+        * DROP: don't capture the calls, until there's room again.
+        * SAMPLE: capture one of every overflowSampleRate calls (waiting for room), and drop the others.
+    The decision is taken for root calls only: a root call is captured or dropped along with its nested calls,
+    so the call graph is never left with half a call. Dropped root calls are counted in the ProgramExecution
+    metadata (see ProgramExecution.Metadata.DROPPED_ROOT_CALLS).
+    '''
+    BLOCK, DROP, SAMPLE = range(3)
+    #Default overflowSampleRate for SAMPLE
+    DEFAULT_SAMPLE_RATE = 10
+
+class CaptureLimits:
+    '''
+    Limits for the arguments and returned objects captured by AnnotatorThread (see Annotator.setCaptureLimits()).
+    A string or a container over the limits is not captured: it's declared as a summary
+    (LanguageObject.DECLARATION_TYPES.SUMMARY, see _getSummary()), so the memory and dump size for a call are bounded.
+    Every limit is optional: 0 means no limit.
+        * maxContainerLength: maximum number of children in a tuple, list or dict.
+        * maxDepth: maximum nesting level of the containers (an argument is at level 1).
+        * maxStringBytes: maximum length of a string (unicode strings are measured in UTF-8).
+        * maxBytesPerCall: maximum size of the declaration codes added for a call (its callee, arguments and returned object).
+          When a container goes over it while it's being walked, the whole container is summarized.
+    The other limits also apply where the objects are handled before AnnotatorThread: the snapshot capture policy
+    doesn't copy the containers over them (see ThreadEventBuffer.snapshot()), and the out-of-process capture
+    summarizes them when it encodes the events (see event_records.encodeObject()), so they're never sent to the collector.
+    maxBytesPerCall doesn't apply to the out-of-process capture: the declaration codes are only known by the collector.
+    '''
+    ##
+    # @param self The CaptureLimits instance to construct.
+    # @param maxContainerLength Maximum number of children in a container, or 0.
+    # @param maxDepth Maximum nesting level of the containers, or 0.
+    # @param maxStringBytes Maximum length of a string, or 0.
+    # @param maxBytesPerCall Maximum size of the declaration codes for a call, or 0.
+    def __init__(self, maxContainerLength = 0, maxDepth = 0, maxStringBytes = 0, maxBytesPerCall = 0):
+        '''
+        Constructor.
+        '''
+        assert maxContainerLength >= 0 and maxDepth >= 0 and maxStringBytes >= 0 and maxBytesPerCall >= 0
+        self.maxContainerLength_ = maxContainerLength
+        self.maxDepth_ = maxDepth
+        self.maxStringBytes_ = maxStringBytes
+        self.maxBytesPerCall_ = maxBytesPerCall
+
+    ##
+    # @param self The CaptureLimits instance.
+    # @return Maximum size of the declaration codes for a call, or None if there's no limit.
+    def getMaxBytesPerCall(self):
+        '''
+        Get the bytes a call may add (see AnnotatorThread._addLanguageObject()).
+        '''
+        return self.maxBytesPerCall_ or None
+
+    ##
+    # @param self The CaptureLimits instance.
+    # @param obj An argument or returned object, or an object inside them.
+    # @param depth For containers, their nesting level.
+    # @param callBytesLeft The bytes the call may still add, or None if there's no limit.
+    # @return True if obj must be declared as a summary.
+    def mustSummarize(self, obj, depth, callBytesLeft):
+        '''
+        Tell whether a string or a container is over the limits. Any other object is always captured.
+        '''
+        objType = type(obj)
+        if objType in _CONTAINER_TYPES:
+            if self.maxDepth_ and depth > self.maxDepth_:
+                return True
+            if self.maxContainerLength_ and len(obj) > self.maxContainerLength_:
+                return True
+        elif objType is types.StringType or objType is types.UnicodeType:
+            if self.maxStringBytes_ and len(obj) > self.maxStringBytes_ / (4 if objType is types.UnicodeType else 1):
+                stringBytes = len(obj.encode('utf-8')) if objType is types.UnicodeType else len(obj)
+                if stringBytes > self.maxStringBytes_:
+                    return True
+        else:
+            return False
+        return callBytesLeft is not None and callBytesLeft <= 0
+
+    ##
+    # @param self The CaptureLimits instance.
+    # @param obj A string or a native container over the limits (see mustSummarize()).
+    # @return Its summary (see _getSummary()).
+    def getSummary(self, obj):
+        '''
+        Describe an object over the limits, where it's summarized out of AnnotatorThread (see event_records.encodeObject()).
+        '''
+        return _getSummary(obj)
+
+class FlightRecorder:
+    '''
+    Keeps only the last N root calls (calls at ProgramExecution.MIN_LEVEL, for any thread), with their nested calls.
+    Older root calls are evicted as new ones arrive, so an always-on capture uses bounded memory.
+    AnnotatorThread collects the LanguageObject's no longer referenced by the remaining calls (see AnnotatorThread.setFlightRecorder()).
+    '''
+    ##
+    # @param self The FlightRecorder instance to construct.
+    # @param size Number of root calls to keep.
+    def __init__(self, size):
+        '''
+        Constructor.
+        '''
+        assert size > 0
+        self.size_ = size
+        #Each element is a root call followed by its nested calls
+        self.rootCallGroups_ = deque()
+        #{ threadId -> group of the root call that thread is running }
+        self.currentGroups_ = {}
+
+    ##
+    # @param self The FlightRecorder instance.
+    # @param aCall A FunctionCall that has just been entered.
+    # @return True if an old root call has been evicted.
+    def addFunctionCall(self, aCall):
+        '''
+        Keep a new call. A root call starts a new group, evicting the oldest one if there are too many.
+        '''
+        threadId = aCall.getThreadId()
+        if aCall.getLevel() != ProgramExecution.MIN_LEVEL:
+            self.currentGroups_[threadId].append(aCall)
+            return False
+        group = [aCall]
+        self.currentGroups_[threadId] = group
+        self.rootCallGroups_.append(group)
+        if len(self.rootCallGroups_) <= self.size_:
+            return False
+        self.rootCallGroups_.popleft()
+        return True
+
+    ##
+    # @param self The FlightRecorder instance.
+    # @return The calls being kept, in call order.
+    def getFunctionCalls(self):
+        '''
+        Get the calls being kept, in call order (i.e.: FunctionCall id order, for all the threads).
+        '''
+        calls = [aCall for group in self.rootCallGroups_ for aCall in group]
+        calls.sort(key = FunctionCall.getId)
+        return calls
+
+class Demotion:
+    '''
+    How an annotated function is demoted when the capture overhead goes over budget (see OverheadMonitor):
+        * SAMPLED: only one of every demotionSampleRate calls is captured.
+        * PASS_THROUGH: its calls aren't captured at all.
+    Unlike sampling.Sampler's (that choose root calls), demotions apply at any nesting level: the skipped calls
+    (and the calls they make) are missing from their callers' nested calls.
+    '''
+    SAMPLED, PASS_THROUGH = 'sampled', 'passThrough'
+
+class CallTiming:
+    '''
+    What is measured for every captured call (see Annotator.setCallTiming()):
+        * NONE: nothing (default).
+        * WALL: the wall time, with a monotonic clock (see clocks.monotonicTime()): the inclusive time (FunctionCall.getTotalTime()),
+          and the self time (FunctionCall.getSelfTime()), i.e.: not spent in the captured calls it made.
+        * WALL_AND_CPU: the wall time, and the thread CPU time (FunctionCall.getCpuTime()), if the platform has a thread CPU clock.
+    Every clock is read twice per call: right before and right after the original function runs.
+    '''
+    NONE = 'none'
+    WALL = 'wall'
+    WALL_AND_CPU = 'wallAndCpu'
+
+class CaptureEngine:
+    '''
+    How the calls to the annotated functions are intercepted (see Annotator.setCaptureEngine()):
+        * WRAPPERS: each function is replaced (setattr) with a wrapper that captures its calls (see annotatedFunction()).
+        * PROFILER: the functions are left as they are, and a profile function (sys.setprofile() and threading.setprofile())
+          captures the calls to their code objects. It also sees the calls made through references taken before
+          the annotations started, and it doesn't add frames. But it's called for every Python call, annotated or not,
+          and it can't see exceptions: every call looks like it has returned None.
+    Both engines send the same events to AnnotatorThread (see Annotator.functionStarted() and Annotator.functionEnded()).
+    '''
+    WRAPPERS, PROFILER = range(2)
+
+class FunctionOverhead:
+    '''
+    Runtime state of an annotated function, for the overhead budget (see OverheadMonitor):
+    calls and capture overhead in the current check window, and its demotion.
+    Counters are updated without locks: they may lose some increments with many threads, which is fine for an estimation.
+    '''
+    ##
+    # @param self The FunctionOverhead instance to construct.
+    # @param monitor The OverheadMonitor the function reports to.
+    # @param functionName Function name, qualified by its class or module.
+    def __init__(self, monitor, functionName):
+        '''
+        Constructor.
+        '''
+        self.monitor_ = monitor
+        self.functionName_ = functionName
+        self.calls_ = 0
+        self.overheadTime_ = 0.0
+        self.demotion_ = None
+        self.sampledCalls_ = itertools.count()
+
+    ##
+    # @param self The FunctionOverhead instance.
+    # @return The function name.
+    def getFunctionName(self):
+        '''
+        Get the function name, qualified by its class or module.
+        '''
+        return self.functionName_
+
+    ##
+    # @param self The FunctionOverhead instance.
+    # @return The Demotion applied to the function, or None.
+    def getDemotion(self):
+        '''
+        Get the Demotion applied to the function, or None if it's fully captured.
+        '''
+        return self.demotion_
+
+    ##
+    # @param self The FunctionOverhead instance.
+    # @return True if the call being made must not be captured, because of the function demotion.
+    def mustSkip(self):
+        '''
+        Count a new call, and tell whether the function demotion skips its capture.
+        '''
+        self.calls_ += 1
+        if self.demotion_ is None:
+            return False
+        if self.demotion_ == Demotion.PASS_THROUGH:
+            return True
+        return next(self.sampledCalls_) % self.monitor_.demotionSampleRate_ != 0
+
+    ##
+    # @param self The FunctionOverhead instance.
+    # @param overheadTime Seconds spent by a captured call in the annotation code (i.e.: not in the original function).
+    def addOverhead(self, overheadTime):
+        '''
+        Account the overhead of a captured call, and let the monitor check the budget.
+        '''
+        self.overheadTime_ += overheadTime
+        self.monitor_.checkBudget()
+
+class OverheadMonitor:
+    '''
+    Keeps the capture overhead under a budget: a fraction of the wall time.
+    Every annotated function measures the time its captured calls spend in the annotation code (see annotatedFunction()).
+    Every checkInterval seconds, if the overhead has gone over budget, the hottest functions are demoted
+    (first to Demotion.SAMPLED, and then to Demotion.PASS_THROUGH) until it's estimated to be under budget again.
+    Demotions are recorded in the ProgramExecution metadata (see ProgramExecution.Metadata.DEMOTED_FUNCTIONS),
+    so the generated code tells which calls are incomplete.
+    '''
+    ##
+    # @param self The OverheadMonitor instance to construct.
+    # @param overheadBudget Maximum fraction of the wall time (e.g.: 0.05) spent in the annotation code.
+    # @param demotionSampleRate For Demotion.SAMPLED, capture one of every demotionSampleRate calls.
+    # @param checkInterval Seconds between budget checks.
+    # @param clock Function returning the current time, in seconds.
+    def __init__(self, overheadBudget, demotionSampleRate = 100, checkInterval = 1.0, clock = default_timer):
+        '''
+        Constructor.
+        '''
+        assert 0 < overheadBudget < 1
+        assert demotionSampleRate > 1
+        assert checkInterval >= 0
+        self.overheadBudget_ = overheadBudget
+        self.demotionSampleRate_ = demotionSampleRate
+        self.checkInterval_ = checkInterval
+        self.clock_ = clock
+        self.functionOverheads_ = []
+        #Demotions, as they go into the metadata
+        self.demotions_ = []
+        self.lock_ = threading.Lock()
+        self.windowStart_ = clock()
+
+    ##
+    # @param self The OverheadMonitor instance.
+    # @param functionName Function name, qualified by its class or module.
+    # @return A new FunctionOverhead for the function.
+    def addFunction(self, functionName):
+        '''
+        Start monitoring an annotated function.
+        '''
+        functionOverhead = FunctionOverhead(self, functionName)
+        self.functionOverheads_.append(functionOverhead)
+        return functionOverhead
+
+    ##
+    # @param self The OverheadMonitor instance.
+    # @return The demotions so far, as dictionaries ready for the metadata.
+    def getDemotions(self):
+        '''
+        Get the demotions so far, in order. Each one has the function name, the Demotion, and the function calls per second when it was demoted.
+        '''
+        with self.lock_:
+            return list(self.demotions_)
+
+    ##
+    # @param self The OverheadMonitor instance.
+    def checkBudget(self):
+        '''
+        If the check interval has elapsed, compare the overhead with the budget, demote the hottest functions if needed,
+        and start a new window.
+        '''
+        now = self.clock_()
+        if now - self.windowStart_ < self.checkInterval_:
+            return
+        with self.lock_:
+            window = now - self.windowStart_
+            if window < self.checkInterval_:
+                #Another thread has just checked
+                return
+            candidates = [functionOverhead for functionOverhead in self.functionOverheads_
+                          if functionOverhead.demotion_ != Demotion.PASS_THROUGH and functionOverhead.overheadTime_ > 0]
+            candidates.sort(key = lambda functionOverhead: functionOverhead.overheadTime_, reverse = True)
+            overheadTime = sum([functionOverhead.overheadTime_ for functionOverhead in candidates])
+            for functionOverhead in candidates:
+                if overheadTime <= self.overheadBudget_ * window:
+                    break
+                #A demoted function overhead is estimated as negligible
+                overheadTime -= functionOverhead.overheadTime_
+                self._demote(functionOverhead, window)
+            for functionOverhead in self.functionOverheads_:
+                functionOverhead.calls_ = 0
+                functionOverhead.overheadTime_ = 0.0
+            self.windowStart_ = now
+
+    ##
+    # @param self The OverheadMonitor instance.
+    # @param functionOverhead The FunctionOverhead to demote.
+    # @param window Seconds elapsed in the current check window.
+    def _demote(self, functionOverhead, window):
+        '''
+        Demote a function one more step, and record it.
+        '''
+        if functionOverhead.demotion_ is None:
+            functionOverhead.demotion_ = Demotion.SAMPLED
+        else:
+            functionOverhead.demotion_ = Demotion.PASS_THROUGH
+        demotion = { 'function': functionOverhead.functionName_, 'demotion': functionOverhead.demotion_,
+                     'callsPerSecond': functionOverhead.calls_ / window if window > 0 else 0.0 }
+        if functionOverhead.demotion_ == Demotion.SAMPLED:
+            demotion['sampleRate'] = self.demotionSampleRate_
+        self.demotions_.append(demotion)
+
+##
+# @param obj Python object.
+# @return The same object.
+def _encodeAsItself(obj):
+    '''
+    Encoder for the types JSON knows how to dump (see ObjectEncoders): the object is dumped as it is.
+    '''
+    return obj
+
+##
+# @param obj Object returned by an encoder (see ObjectEncoders).
+# @return Obj in JSON, or None if it can't be dumped, or it's not a scalar.
+def _asScalarJsonString(obj):
+    '''
+    Dump the object an encoder returned. It must be a scalar: the declaration code of the containers
+    has their children ids (see ObjectEncoders.getDeclarationCode()), so a list or a dict would be read as ids.
+    '''
+    try:
+        declarationCode = asJsonString(obj)
+    except:
+        #It depends on the value (e.g.: a str that is not UTF-8)
+        return None
+    if declarationCode.startswith(('[', '{')):
+        return None
+    return declarationCode
+
+class _EncoderVerdict:
+    '''
+    A verdict in the ObjectEncoders registry, instead of an encoder (it must not be None: that's "not found").
+    '''
+    ##
+    # @param self The _EncoderVerdict instance to construct.
+    # @param name Verdict name, for its representation.
+    def __init__(self, name):
+        '''
+        Constructor.
+        '''
+        self.name_ = name
+
+    ##
+    # @param self The _EncoderVerdict instance.
+    # @return The verdict name.
+    def __repr__(self):
+        '''
+        Representation, as it's referred to.
+        '''
+        return 'ObjectEncoders.' + self.name_
+
+class ObjectEncoders:
+    '''
+    Per-class registry of the encoders for the instances declared as FIXED_VALUE (see AnnotatorThread._getDeclarationInfo()).
+    An encoder takes an instance, and returns the object to dump as its declaration code, in JSON.
+    The registry has an encoder for the scalar types JSON knows how to dump, and the ones given to registerEncoder()
+    (they also apply to the subclasses). For any other class, the first instance is dumped as it is: if it fails,
+    the class gets the DUMMY verdict, so the next instances are declared as Dummy's without trying.
+    The encoder (or verdict) for a class is looked up just once: every class seen is cached.
+    The encoded objects must be scalars (see _asScalarJsonString()): e.g.: an instance of a dict subclass is declared as a Dummy.
+    '''
+    #Verdict for the classes whose instances are declared as Dummy's
+    DUMMY = _EncoderVerdict('DUMMY')
+    #Scalar types JSON knows how to dump (it depends on their values: e.g.: a str that is not UTF-8 is not dumped)
+    JSON_TYPES = (types.NoneType, bool, int, long, float, basestring)
+
+    ##
+    # @param self The ObjectEncoders instance to construct.
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        #{ class -> encoder, or DUMMY }, given to registerEncoder()
+        self.registeredEncoders_ = {}
+        #{ class -> encoder, or DUMMY }, for every class seen
+        self.classEncoders_ = {}
+        #{ class -> registered encoder, or DUMMY }, for every class seen by encodeRegistered()
+        self.registeredClassEncoders_ = {}
+
+    ##
+    # @param self The ObjectEncoders instance.
+    # @param cls Class (new-style or old-style).
+    # @param encoder Function that takes an instance of cls (or a subclass) and returns the scalar to dump, or DUMMY.
+    def registerEncoder(self, cls, encoder):
+        '''
+        Register the encoder for the instances of cls and its subclasses. With DUMMY, they are declared as Dummy's.
+        It overrides the encoder registered for a base class.
+        '''
+        self.registeredEncoders_[cls] = encoder
+        self.classEncoders_.clear()
+        self.registeredClassEncoders_.clear()
+
+    ##
+    # @param self The ObjectEncoders instance.
+    # @param obj Python instance.
+    # @return The JSON declaration code for obj, or None if it must be declared as a Dummy.
+    def getDeclarationCode(self, obj):
+        '''
+        Encode obj with the encoder for its class, and dump it in JSON.
+        '''
+        cls = obj.__class__
+        if cls in _CONTAINER_TYPES:
+            #The declaration code of a container: its children ids (see AnnotatorThread._getDeclarationInfo())
+            return asJsonString(obj)
+        if cls not in self.classEncoders_:
+            encoder = self._findEncoder(cls)
+            if encoder is None:
+                #Neither registered nor a JSON type: the first instance decides
+                declarationCode = _asScalarJsonString(obj)
+                self.classEncoders_[cls] = ObjectEncoders.DUMMY if declarationCode is None else _encodeAsItself
+                return declarationCode
+            self.classEncoders_[cls] = encoder
+        encoder = self.classEncoders_[cls]
+        if encoder is ObjectEncoders.DUMMY:
+            return None
+        try:
+            encodedObj = encoder(obj)
+        except:
+            return None
+        return _asScalarJsonString(encodedObj)
+
+    ##
+    # @param self The ObjectEncoders instance.
+    # @param obj Python instance.
+    # @return What the encoder registered for its class returns, or DUMMY if there's none (or it fails).
+    def encodeRegistered(self, obj):
+        '''
+        Encode obj with the encoder registered for its class, without dumping it. When a collector builds the call graph,
+        the captured process encodes its instances this way (see event_records.encodeObject()): the collector can't run the encoders.
+        '''
+        cls = obj.__class__
+        encoder = self.registeredClassEncoders_.get(cls)
+        if encoder is None:
+            encoder = ObjectEncoders.DUMMY
+            for baseClass in inspect.getmro(cls):
+                if baseClass in self.registeredEncoders_:
+                    encoder = self.registeredEncoders_[baseClass]
+                    break
+            self.registeredClassEncoders_[cls] = encoder
+        if encoder is ObjectEncoders.DUMMY:
+            return ObjectEncoders.DUMMY
+        try:
+            return encoder(obj)
+        except:
+            return ObjectEncoders.DUMMY
+
+    ##
+    # @param self The ObjectEncoders instance.
+    # @param cls Class (new-style or old-style).
+    # @return The encoder (or DUMMY) for cls, or None if it's neither registered nor a JSON type.
+    def _findEncoder(self, cls):
+        '''
+        Find the encoder registered for cls or its closest base class, or the JSON types encoder.
+        '''
+        for baseClass in inspect.getmro(cls):
+            if baseClass in self.registeredEncoders_:
+                return self.registeredEncoders_[baseClass]
+        if issubclass(cls, ObjectEncoders.JSON_TYPES):
+            return _encodeAsItself
+        return None
+
+class AnnotatorThread(Thread):
+    '''
+    Thread class to annotate the functions. It may work in a multi-threaded
+    environment, because it uses Python threading queues.
+    '''
+    #Constants
+    class Containers:
+        '''
+        Type of container. Language Objects and Function Calls are stored separately.
+        '''
+        LANGUAGE_OBJECTS, FUNCTION_CALLS = range(2)
+    
+    class QueueInfo:
+        '''
+        Layout of the items stored in the queue. Every item is a tuple, with a fixed layout for each message type:
+            ENTER_FUNCTION: (MESSAGE_TYPE, threadId, sequence, annotationId, obj, callSite, args, kargs)
+            EXIT_FUNCTION:  (MESSAGE_TYPE, threadId, sequence, annotationId, threwException, returnedObject, totalTime, cpuTime)
+            EVENTS_BATCH:   (MESSAGE_TYPE, events)
+            DUMP:           (MESSAGE_TYPE, dumpFileName, doneEvent, prettyPrint)
+            END_ANNOTATION: (MESSAGE_TYPE,)
+        A tuple is much cheaper than a dict to build and to decode, and there's one per annotated call event.
+        '''
+        class MessageTypes:
+            '''
+            Type of queue message.
+            '''
+            ENTER_FUNCTION, EXIT_FUNCTION, END_ANNOTATION, EVENTS_BATCH, DUMP = range(5)
+        #Index in every Queue item
+        MESSAGE_TYPE = 0
+        #Indices in ENTER_FUNCTION and EXIT_FUNCTION items
+        INDEX_THREAD_ID,\
+        INDEX_SEQUENCE,\
+        INDEX_ANNOTATION_ID = range(1, 4)
+        #Indices in ENTER_FUNCTION items
+        INDEX_OBJ,\
+        INDEX_CALL_SITE,\
+        INDEX_ARGS,\
+        INDEX_KARGS = range(4, 8)
+        #Indices in EXIT_FUNCTION items
+        INDEX_THREW,\
+        INDEX_RETURNED_OBJ,\
+        INDEX_TOTAL_TIME,\
+        INDEX_CPU_TIME = range(4, 8)
+        #Index in EVENTS_BATCH items
+        INDEX_EVENTS = 1
+        #Indices in DUMP items
+        INDEX_DUMP_FILE_NAME,\
+        INDEX_DUMP_DONE,\
+        INDEX_DUMP_PRETTY_PRINT = range(1, 4)
+
+    #Minimum LanguageObject's count before collecting the unreferenced ones, in the flight recorder mode
+    MIN_OBJECTS_TO_COLLECT = 1024
+    #Maximum number of containers whose last snapshot is remembered (see _setContainerSnapshot())
+    MAX_CONTAINER_SNAPSHOTS = 1024
+    #Streaming mode: LanguageObject's remembered to declare them once, in each generation (see _RecentObjects)
+    STREAMED_OBJECTS_GENERATION_SIZE = 32768
+
+    ##
+    # @param self The AnnotatorThread to construct.
+    # @param aProgramExecution ProgramExecution instance where the Call Graph will be stored.
+    # @param callGraphQueue Message queue for other threads to inform about function calls to store.
+    def __init__(self, aProgramExecution, callGraphQueue):
+        '''
+        Constructor.
+        '''
+        Thread.__init__(self)
+        self.nextIdsMap_ = {}
+        self.nextIdsMap_[AnnotatorThread.Containers.LANGUAGE_OBJECTS] = 1
+        self.nextIdsMap_[AnnotatorThread.Containers.FUNCTION_CALLS] = 1
+        self.annotationIdToFuncCall_ = {}
+        self.pythonIdToLanguageObjectId_ = {} 
+        #Identities for the declared instances, see _getPythonUniqueId()
+        self.instanceIdentities_ = InstanceIdentities()
+        #{ id(container) -> (contents snapshot, LanguageObject) }, see _getContentsSnapshot()
+        self.containerSnapshots_ = {}
+        self.programExecution_ = aProgramExecution
+        self.callGraphQueue_ = callGraphQueue
+        #{ threadId -> nesting level of the function being run by that thread }
+        self.currentFunctionLevels_ = {}
+        self.annotationEnded_ = False
+        #{ threadId -> sequence number expected for its next event }
+        self.nextSequences_ = {}
+        #Events arrived before a previous event of the same thread: { (threadId, sequence) -> item }
+        self.pendingEvents_ = {}
+        #If not None, objects and calls are written as they happen, instead of being kept in the ProgramExecution
+        self.streamWriter_ = None
+        #Streaming mode: _RecentObjects, instead of pythonIdToLanguageObjectId_
+        self.streamedObjects_ = None
+        #If not None, calls are kept in the FlightRecorder until the end, instead of in the ProgramExecution
+        self.flightRecorder_ = None
+        #Flight recorder mode: { container LanguageObject id -> its children ids }
+        self.containerChildren_ = {}
+        #Flight recorder mode: LanguageObject's count that triggers the next collection
+        self.objectsToCollect_ = AnnotatorThread.MIN_OBJECTS_TO_COLLECT
+        #If not None, events are written for a collector process (see event_records), instead of being captured in this one
+        self.eventRecordWriter_ = None
+        #{ threadId -> for every call it's running, outermost first, the total time of the captured calls it has made }
+        self.nestedCallsTimes_ = {}
+        self.objectEncoders_ = ObjectEncoders()
+        #If not None, the strings and containers over the limits are summarized
+        self.captureLimits_ = None
+        #The bytes the call being declared may still add (None: no limit), see CaptureLimits
+        self.callBytesLeft_ = None
+        #{ annotationId -> bytes left }, for the calls that have not returned yet
+        self.callsBytesLeft_ = {}
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param captureLimits CaptureLimits, or None to capture every object as it is.
+    def setCaptureLimits(self, captureLimits):
+        '''
+        Choose the limits for the captured arguments and returned objects.
+        It must be set before the first function event.
+        '''
+        self.captureLimits_ = captureLimits
+        if self.eventRecordWriter_ is not None:
+            self.eventRecordWriter_.setCaptureLimits(captureLimits)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param objectEncoders ObjectEncoders used to declare the instances.
+    def setObjectEncoders(self, objectEncoders):
+        '''
+        Share the encoders (and their cache) with the Annotator, and its sessions.
+        It must be set before the first function event.
+        '''
+        self.objectEncoders_ = objectEncoders
+        if self.eventRecordWriter_ is not None:
+            self.eventRecordWriter_.setObjectEncoders(objectEncoders)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param streamWriter CallGraphStreamWriter for the streaming database, or None to keep the whole call graph in memory.
+    def setStreamWriter(self, streamWriter):
+        '''
+        Choose where the function calls go: to the ProgramExecution (default), or to a streaming database.
+        In the streaming mode, the LanguageObject's are not kept either: only the recently declared ones are remembered
+        (see _RecentObjects), so the memory doesn't grow with the capture.
+        It must be set before the first function event.
+        '''
+        self.streamWriter_ = streamWriter
+        self.streamedObjects_ = _RecentObjects(AnnotatorThread.STREAMED_OBJECTS_GENERATION_SIZE) if streamWriter is not None else None
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param flightRecorder FlightRecorder for the last root calls, or None to keep the whole call graph.
+    def setFlightRecorder(self, flightRecorder):
+        '''
+        Choose whether to keep every call (default) or just the last root calls (see FlightRecorder).
+        In the latter case, the calls are added to the ProgramExecution when the annotations end.
+        It must be set before the first function event.
+        '''
+        self.flightRecorder_ = flightRecorder
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param eventRecordWriter event_records.EventRecordWriter for a collector process, or None to capture the events in this one.
+    def setEventRecordWriter(self, eventRecordWriter):
+        '''
+        Choose who builds the call graph: this thread (default), or a collector process (see collector).
+        In the latter case, this thread just encodes the events and writes them, and the ProgramExecution only keeps the metadata.
+        It must be set before the first function event.
+        '''
+        self.eventRecordWriter_ = eventRecordWriter
+        if eventRecordWriter is not None:
+            eventRecordWriter.setCaptureLimits(self.captureLimits_)
+            eventRecordWriter.setObjectEncoders(self.objectEncoders_)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    def run(self):
+        '''
+        "Almost infinite" loop for processing the queue messages.
+        It may only be broken with an "END_ANNOTATION" message.
+        '''
+        #This thread calls are never captured (see CaptureEngine.PROFILER)
+        sys.setprofile(None)
+        while not self.annotationEnded_:
+            item = self.callGraphQueue_.get()
+            self._processQueueItem(item)
+            self.callGraphQueue_.task_done()
+            #Nothing else to do for now: don't leave records in the write buffer
+            if self.streamWriter_ is not None and self.callGraphQueue_.empty():
+                self.streamWriter_.flush()
+            if self.eventRecordWriter_ is not None and self.callGraphQueue_.empty():
+                self.eventRecordWriter_.flush()
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param item Queue item to process.
+    def _processQueueItem(self, item):
+        '''
+        Process queue item. It's a tuple, see QueueInfo for its layout.
+        The most important data is MESSAGE_TYPE, to indicate begin or end of annotations, or function process.
+        '''
+        msgType = item[AnnotatorThread.QueueInfo.MESSAGE_TYPE]
+        
+        #Out-of-process capture: the collector processes the events
+        if self.eventRecordWriter_ is not None:
+            self._writeEventRecordsSafely(item)
+            return
+        
+        #Special message for commanding this thread to terminate
+        if msgType == AnnotatorThread.QueueInfo.MessageTypes.END_ANNOTATION:
+            if self.flightRecorder_ is not None:
+                for aCall in self.flightRecorder_.getFunctionCalls():
+                    self.programExecution_.addFunctionCall(aCall)
+            if self.streamWriter_ is not None:
+                self.streamWriter_.writeMetadata(self.programExecution_)
+            self.annotationEnded_ = True
+            return
+        
+        #Dump the call graph captured so far, while the annotations go on
+        if msgType == AnnotatorThread.QueueInfo.MessageTypes.DUMP:
+            _, dumpFileName, doneEvent, prettyPrint = item
+            try:
+                self._dumpCurrentProgramExecution(dumpFileName, prettyPrint)
+            finally:
+                doneEvent.set()
+            return
+        
+        #Events buffered by an application thread, handed in just one message
+        if msgType == AnnotatorThread.QueueInfo.MessageTypes.EVENTS_BATCH:
+            for event in item[AnnotatorThread.QueueInfo.INDEX_EVENTS]:
+                self._processFunctionEvent(event)
+            return
+
+        self._processFunctionEvent(item)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param item Queue item to write.
+    def _writeEventRecordsSafely(self, item):
+        '''
+        Write the records for a queue item (see _writeEventRecords()): an event that can't be written is reported,
+        and it doesn't stop this thread, nor the capture.
+        '''
+        try:
+            self._writeEventRecords(item)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param item Queue item to write.
+    def _writeEventRecords(self, item):
+        '''
+        Out-of-process capture: write the records for a queue item (see event_records.RecordTypes).
+        The events are written as they arrive: the collector restores every thread's events order.
+        '''
+        MT = AnnotatorThread.QueueInfo.MessageTypes
+        msgType = item[AnnotatorThread.QueueInfo.MESSAGE_TYPE]
+        if msgType == MT.ENTER_FUNCTION:
+            _, threadId, sequence, annotationId, obj, callSite, args, kargs = item
+            self.eventRecordWriter_.writeEnterFunction(threadId, sequence, annotationId, obj, callSite, args, kargs)
+        elif msgType == MT.EXIT_FUNCTION:
+            _, threadId, sequence, annotationId, threwException, returnedObject, totalTime, cpuTime = item
+            self.eventRecordWriter_.writeExitFunction(threadId, sequence, annotationId, threwException, returnedObject, totalTime, cpuTime)
+        elif msgType == MT.EVENTS_BATCH:
+            for event in item[AnnotatorThread.QueueInfo.INDEX_EVENTS]:
+                self._writeEventRecordsSafely(event)
+        elif msgType == MT.DUMP:
+            _, dumpFileName, doneEvent, prettyPrint = item
+            try:
+                self.eventRecordWriter_.writeDump(dumpFileName, prettyPrint)
+                self.eventRecordWriter_.flush()
+            finally:
+                doneEvent.set()
+        else:
+            assert msgType == MT.END_ANNOTATION
+            try:
+                self.eventRecordWriter_.writeMetadata(self.programExecution_.getMetadata())
+                self.eventRecordWriter_.writeEnd()
+                self.eventRecordWriter_.flush()
+            finally:
+                self.annotationEnded_ = True
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param item ENTER_FUNCTION or EXIT_FUNCTION queue item.
+    def _processFunctionEvent(self, item):
+        '''
+        Process a function event in its thread order: an event that arrives before a previous one
+        of the same thread (see ThreadEventBuffer.nextSequence()) waits until the missing ones arrive.
+        '''
+        threadId = item[AnnotatorThread.QueueInfo.INDEX_THREAD_ID]
+        sequence = item[AnnotatorThread.QueueInfo.INDEX_SEQUENCE]
+        expectedSequence = self.nextSequences_.get(threadId, 0)
+        if sequence != expectedSequence:
+            self.pendingEvents_[(threadId, sequence)] = item
+            return
+        
+        self._processOrderedFunctionEvent(item)
+        expectedSequence += 1
+        while self.pendingEvents_.has_key((threadId, expectedSequence)):
+            self._processOrderedFunctionEvent(self.pendingEvents_.pop((threadId, expectedSequence)))
+            expectedSequence += 1
+        self.nextSequences_[threadId] = expectedSequence
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param item ENTER_FUNCTION or EXIT_FUNCTION queue item, whose previous events (for the same thread) were already processed.
+    def _processOrderedFunctionEvent(self, item):
+        '''
+        Add a FunctionCall to the ProgramExecution (ENTER_FUNCTION), or complete it (EXIT_FUNCTION).
+        '''
+        if item[AnnotatorThread.QueueInfo.MESSAGE_TYPE] == AnnotatorThread.QueueInfo.MessageTypes.ENTER_FUNCTION:
+            _, threadId, _, annotationId, obj, callSite, args, kargs = item
+            level = self.currentFunctionLevels_.get(threadId, ProgramExecution.MIN_LEVEL - 1) + 1
+            self.currentFunctionLevels_[threadId] = level
+            funcName = callSite.getFunctionName()
+            methodType = callSite.getMethodType()
+            
+            if self.captureLimits_ is not None:
+                self.callBytesLeft_ = self.captureLimits_.getMaxBytesPerCall()
+            lo = self._declareObjectAndParents(obj, isCallee = True)
+            argsList = []
+            for arg in args:
+                argLanguageObject = self._declareObjectAndParents(arg, isCallee = False)
+                argsList.append(Argument(argLanguageObject))
+            
+            for argName, karg in kargs.items():
+                argLanguageObject = self._declareObjectAndParents(karg, isCallee = False)
+                argsList.append(Argument(argLanguageObject, argName))
+    
+            newFunctionCallId = self._getNewId(AnnotatorThread.Containers.FUNCTION_CALLS)
+            aCall = FunctionCall(newFunctionCallId, lo, funcName, methodType, argsList, level, threadId = threadId)
+            self.nestedCallsTimes_.setdefault(threadId, []).append(0.0)
+            if self.streamWriter_ is not None:
+                self.streamWriter_.writeFunctionCall(aCall)
+            elif self.flightRecorder_ is not None:
+                if self.flightRecorder_.addFunctionCall(aCall) and len(self.programExecution_.getLanguageObjects()) >= self.objectsToCollect_:
+                    self._collectLanguageObjects()
+            else:
+                self.programExecution_.addFunctionCall(aCall)
+            self.annotationIdToFuncCall_[annotationId] = aCall
+            if self.callBytesLeft_ is not None:
+                self.callsBytesLeft_[annotationId] = self.callBytesLeft_
+        else:
+            assert item[AnnotatorThread.QueueInfo.MESSAGE_TYPE] == AnnotatorThread.QueueInfo.MessageTypes.EXIT_FUNCTION
+            _, threadId, _, annotationId, threwException, returnedObject, totalTime, cpuTime = item
+            funcCall = self.annotationIdToFuncCall_.pop(annotationId)
+            self.callBytesLeft_ = self.callsBytesLeft_.pop(annotationId, None)
+            returnedObjectLo = self._declareObjectAndParents(returnedObject, isCallee = False)
+            funcCall.setReturnedObject(returnedObjectLo)
+            funcCall.setThrewException(threwException)
+            nestedCallsTimes = self.nestedCallsTimes_[threadId]
+            nestedCallsTime = nestedCallsTimes.pop()
+            if totalTime is not None:
+                funcCall.setTotalTime(totalTime)
+                funcCall.setSelfTime(totalTime - nestedCallsTime)
+                funcCall.setCpuTime(cpuTime)
+                if nestedCallsTimes:
+                    nestedCallsTimes[-1] += totalTime
+            if self.streamWriter_ is not None:
+                self.streamWriter_.writeFunctionReturn(funcCall)
+            self.currentFunctionLevels_[threadId] -= 1
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj Python "object" (module, class, or instance) to declare.
+    # @param isCallee Obj is the callee, i.e.: the receiver of the message (the function call).
+    # @return The newly declared LanguageObject.
+    def _declareObjectAndParents(self, obj, isCallee):
+        '''
+        Get the LanguageObject for a Python object. If not previously declared,
+        "declare" a Python object (module, class or instance),
+        but declaring first its parent (see _declareObject()).
+        For containers, see _declareContainer().
+        '''
+        if type(obj) in _CONTAINER_TYPES:
+            return self._declareContainer(obj)
+        if self.captureLimits_ is not None and self.captureLimits_.mustSummarize(obj, 0, self.callBytesLeft_):
+            return self._declareSummary(obj)
+        return self._declareObject(obj, obj, isCallee)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param container A native container (tuple, list or dict).
+    # @return The LanguageObject for the container.
+    def _declareContainer(self, container):
+        '''
+        Declare a container, after the objects inside it: its declaration code is the container
+        with its children replaced by their LanguageObject id's.
+        The containers inside it are walked with an explicit stack (one _ContainerFrame each), not recursively:
+        deeply nested containers don't hit the recursion limit. A container found again while it's being walked
+        (it's inside itself) is a back-reference: it gets its id before it's declared (see _reserveContainerId()).
+        A container found again after it was declared (e.g.: the same list twice in a dict) is not walked again.
+        The containers over the capture limits are summarized (see CaptureLimits).
+        '''
+        #The same container is usually passed again and again: don't walk it if its contents have not changed
+        lo = self._getUnchangedContainer(container)
+        if lo is not None:
+            return lo
+        if self.captureLimits_ is not None and self.captureLimits_.mustSummarize(container, 1, self.callBytesLeft_):
+            return self._declareSummary(container)
+        #{ id(container) -> LanguageObject } for the containers declared by this walk
+        declaredContainers = {}
+        #{ id(container) -> _ContainerFrame } for the containers being walked
+        framesInProgress = {}
+        stack = [_ContainerFrame(container)]
+        framesInProgress[id(container)] = stack[0]
+        while True:
+            frame = stack[-1]
+            for child in frame.children_:
+                if self.callBytesLeft_ is not None and self.callBytesLeft_ < 0:
+                    return self._summarizeWalk(stack)
+                if type(child) not in _CONTAINER_TYPES:
+                    frame.childrenIds_.append(self._declareObjectAndParents(child, False).getId())
+                    continue
+                childLo = declaredContainers.get(id(child))
+                if childLo is None:
+                    childLo = self._getUnchangedContainer(child)
+                if childLo is not None:
+                    frame.childrenIds_.append(childLo.getId())
+                    continue
+                childFrame = framesInProgress.get(id(child))
+                if childFrame is not None:
+                    frame.childrenIds_.append(self._reserveContainerId(childFrame))
+                    continue
+                if self.captureLimits_ is not None and self.captureLimits_.mustSummarize(child, len(stack) + 1, self.callBytesLeft_):
+                    frame.childrenIds_.append(self._declareSummary(child).getId())
+                    continue
+                #Walk the child before going on with this container
+                break
+            else:
+                #Every child has been declared: declare the container
+                stack.pop()
+                del framesInProgress[id(frame.container_)]
+                lo = self._declareObject(frame.container_, frame.getObjectToDeclare(), False, frame.childrenIds_, frame.reservedId_)
+                declaredContainers[id(frame.container_)] = lo
+                if not stack:
+                    return lo
+                stack[-1].childrenIds_.append(lo.getId())
+                continue
+            childFrame = _ContainerFrame(child)
+            framesInProgress[id(child)] = childFrame
+            stack.append(childFrame)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param stack The _ContainerFrame's of the containers being walked by _declareContainer(), the outermost first.
+    # @return The LanguageObject for the outermost container.
+    def _summarizeWalk(self, stack):
+        '''
+        The call has gone over its bytes while a container was being walked: summarize it as a whole.
+        The containers being walked with back-references to them are summarized too, so their ids are declared.
+        '''
+        for frame in stack[1:]:
+            if frame.reservedId_ is not None:
+                self._declareSummary(frame.container_, frame.reservedId_)
+        return self._declareSummary(stack[0].container_, stack[0].reservedId_)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj A string or a native container, over the capture limits (see CaptureLimits).
+    # @return Its summary.
+    def _summarize(self, obj):
+        '''
+        Describe an object declared as a summary (see _getSummary()).
+        '''
+        return _getSummary(obj)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj A string or a native container, over the capture limits (see CaptureLimits).
+    # @param reservedId For a container with back-references to it, the id it got (see _reserveContainerId()).
+    # @return The LanguageObject for the summary.
+    def _declareSummary(self, obj, reservedId = None):
+        '''
+        Declare obj as a summary (see _getSummary()), instead of its contents.
+        The same summary is declared once, like any other value.
+        '''
+        summary = self._summarize(obj)
+        pythonId = (LanguageObject.DECLARATION_TYPES.SUMMARY, summary)
+        if reservedId is None:
+            lo = self._getDeclaredObject(pythonId)
+            if lo is not None:
+                return lo
+        parentLo = self._declareObjectAndParents(self._getParent(obj, LanguageType.INSTANCE), isCallee = False)
+        return self._addLanguageObject(pythonId, LanguageType.INSTANCE, LanguageObject.DECLARATION_TYPES.SUMMARY, asJsonString(summary), parentLo, reservedId = reservedId)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param frame The _ContainerFrame of a container being walked.
+    # @return The LanguageObject id for the container.
+    def _reserveContainerId(self, frame):
+        '''
+        A back-reference to a container being walked: give it its id, before it's declared.
+        Its parent (its class) is declared first, so the parent has a lower id, as usual.
+        '''
+        if frame.reservedId_ is None:
+            self._declareObjectAndParents(self._getParent(frame.container_, LanguageType.INSTANCE), isCallee = False)
+            frame.reservedId_ = self._getNewId(AnnotatorThread.Containers.LANGUAGE_OBJECTS)
+        return frame.reservedId_
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param container A native container (tuple, list or dict).
+    # @return The LanguageObject declared for the container, if its contents have not changed since then. Else, None.
+    def _getUnchangedContainer(self, container):
+        '''
+        Compare a container with its last snapshot (see _setContainerSnapshot()).
+        '''
+        snapshotAndLo = self.containerSnapshots_.get(id(container))
+        if snapshotAndLo is not None and _hasSameContents(container, snapshotAndLo[0]):
+            return snapshotAndLo[1]
+        return None
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param container A native container (tuple, list or dict).
+    # @param lo The LanguageObject for the container.
+    def _setContainerSnapshot(self, container, lo):
+        '''
+        Keep a snapshot of the container (see _getContentsSnapshot()), to recognize it if it's passed again.
+        The containers inside themselves (or too deep) are walked every time.
+        At most MAX_CONTAINER_SNAPSHOTS containers are remembered: when there are more, all of them are forgotten
+        (as ThreadEventBuffer.snapshot() does).
+        '''
+        if len(self.containerSnapshots_) >= AnnotatorThread.MAX_CONTAINER_SNAPSHOTS and id(container) not in self.containerSnapshots_:
+            self.containerSnapshots_.clear()
+        try:
+            self.containerSnapshots_[id(container)] = (_getContentsSnapshot(container), lo)
+        except _NoSnapshotException:
+            self.containerSnapshots_.pop(id(container), None)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj Python "object" (module, class, or instance) to declare.
+    # @param objToDeclare For containers, obj with its children replaced by their LanguageObject id's. For other objects, obj itself.
+    # @param isCallee Obj is the callee, i.e.: the receiver of the message (the function call).
+    # @param childrenIds For containers, their children LanguageObject id's.
+    # @param reservedId For a container with back-references to it, the id it got (see _reserveContainerId()).
+    # @return The LanguageObject for obj.
+    def _declareObject(self, obj, objToDeclare, isCallee, childrenIds = None, reservedId = None):
+        '''
+        Get the LanguageObject for obj, if it was declared before (see _getPythonUniqueId()). Else, declare it,
+        declaring first its parent (and here is where the recursion appears: at most, an instance's class and its module).
+        '''
+        objType = type(obj)
+        isContainer = objType in _CONTAINER_TYPES
+        pythonId = self._getPythonUniqueId(obj, objToDeclare, objType)
+        lo = self._getDeclaredObject(pythonId) if reservedId is None else None
+        if lo is not None:
+            if isContainer:
+                self._setContainerSnapshot(obj, lo)
+            return lo
+
+        #obj
+        objType = _getLanguageType(obj)
+        declarationType, declarationCode = self._getDeclarationInfo(pythonId, objToDeclare, objType, isCallee)
+        
+        parentLo = None
+        if self._hasParent(obj, objType):
+            parent = self._getParent(obj, objType)
+            parentLo = self._declareObjectAndParents(parent, isCallee = False) 
+        lo = self._addLanguageObject(pythonId, objType, declarationType, declarationCode, parentLo, childrenIds, reservedId)
+        if isContainer:
+            self._setContainerSnapshot(obj, lo)
+        return lo
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param pythonId The id that identifies the object (see _getPythonUniqueId()).
+    # @param languageType The LanguageType for the object.
+    # @param declarationType The declaration type for the object (see LanguageObject.DECLARATION_TYPES).
+    # @param declarationCode The declaration code for the object.
+    # @param parentLo The LanguageObject for the object's parent, or None.
+    # @param childrenIds For containers, their children LanguageObject id's.
+    # @param reservedId For a container with back-references to it, the id it got (see _reserveContainerId()).
+    # @return The new LanguageObject.
+    def _addLanguageObject(self, pythonId, languageType, declarationType, declarationCode, parentLo, childrenIds = None, reservedId = None):
+        '''
+        Add a new LanguageObject to the call graph (or write it, in the streaming mode).
+        Its declaration code is charged to the call being declared (see CaptureLimits).
+        '''
+        newId = reservedId if reservedId is not None else self._getNewId(AnnotatorThread.Containers.LANGUAGE_OBJECTS)
+        lo =  LanguageObject(newId, languageType, declarationType, declarationCode, parentLo)
+        if self.streamWriter_ is not None:
+            self.streamWriter_.writeLanguageObject(lo)
+            for forgottenPythonId in self.streamedObjects_.add(pythonId, _WrittenLanguageObject(lo)):
+                self._forgetPythonId(forgottenPythonId)
+        else:
+            self.programExecution_.addLanguageObject(lo)
+            self.pythonIdToLanguageObjectId_[pythonId] = newId
+        if self.flightRecorder_ is not None and childrenIds is not None:
+            self.containerChildren_[newId] = childrenIds
+        if self.callBytesLeft_ is not None:
+            self.callBytesLeft_ -= len(declarationCode)
+        return lo
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param pythonId An object's python id (see _getPythonUniqueId()).
+    # @return The LanguageObject declared for it, or None if there's none.
+    def _getDeclaredObject(self, pythonId):
+        '''
+        Get the LanguageObject declared for a python id (in the streaming mode, if it's still remembered).
+        '''
+        if self.streamedObjects_ is not None:
+            return self.streamedObjects_.get(pythonId)
+        loId = self.pythonIdToLanguageObjectId_.get(pythonId)
+        if loId is None:
+            return None
+        return self.programExecution_.getLanguageObjects()[loId]
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param pythonId The python id of a LanguageObject no longer remembered.
+    def _forgetPythonId(self, pythonId):
+        '''
+        Release what is kept for a python id (an instance's identity, see _getPythonUniqueId()).
+        '''
+        if pythonId[0] == "ID":
+            self.instanceIdentities_.forget(pythonId[1])
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj Python "object" (module, class, or instance) to declare
+    # @param objToDeclare For containers, obj with its children replaced by their LanguageObject id's. For other objects, obj itself.
+    # @param objType Obj's object type returned by type() function.
+    # @return A hashable id for obj.
+    def _getPythonUniqueId(self, obj, objToDeclare, objType):
+        '''
+        Get a unique id for the object, to identify it in the containers.
+        We use identities for instances, and values for all other objects (classes, modules, native types, etc.):
+            * Instances (old or new style): ("ID", identity), see instance_identities.InstanceIdentities.
+              Their code (as __str__) is never run, and instances that print the same are not mixed up.
+            * Immutable native values (numbers, strings, None): (type, value).
+            * Containers: (type, children ids), so a container is never stringified.
+            * Modules and classes: their str().
+        We cannot use ID for every object, because garbage collector may free the memory after returning from a function.
+        For instance:
+            def f():
+                i = 5
+                vector = [1, i]
+                annotatedFunction(i, vector)
+            f()
+            f()
+            After the first call, the garbage collector may free the memory for i and vector,
+            hence: were we to use id() to identify objects, arguments for annotatedFunction() from the first and second call to f()
+            may be recognized as different, when they are logically the same.
+        Instances are different objects even when they are equal, so a plain id() would do, but for the same reason
+        (a freed instance's id() may be reused by another one) the identity adds a generation to it.
+        '''
+        if objType is types.InstanceType:
+            return ("ID", self.instanceIdentities_.getIdentity(obj))
+        elif objType in _VALUE_TYPES:
+            return (objType, obj)
+        elif objType is types.TupleType or objType is types.ListType:
+            return (objType, tuple(objToDeclare))
+        elif objType is types.DictType:
+            return (objType, frozenset(objToDeclare.iteritems()))
+        elif _getLanguageType(obj) == LanguageType.INSTANCE:
+            return ("ID", self.instanceIdentities_.getIdentity(obj))
+        else:
+            return ("ST", str(obj))
+
+    ##
+    # @param self The AnnotatorThread instance.
+    def _collectLanguageObjects(self):
+        '''
+        Flight recorder mode: remove the LanguageObject's no longer referenced by the calls being kept
+        (or the calls that have not returned yet). It's a mark and sweep: mark the objects each call refers to
+        (callee, arguments, returned object) and, recursively, their parents and container children.
+        The next collection waits until the objects count doubles, so the collection cost per call is constant.
+        '''
+        languageObjects = self.programExecution_.getLanguageObjects()
+        marked = set()
+        toMark = []
+        for aCall in itertools.chain(self.flightRecorder_.getFunctionCalls(), self.annotationIdToFuncCall_.values()):
+            toMark.append(aCall.getCallee())
+            toMark.extend([anArgument.getLanguageObject() for anArgument in aCall.getArgsList()])
+            toMark.append(aCall.getReturnedObject())
+        while toMark:
+            lo = toMark.pop()
+            if lo is None or lo.getId() in marked:
+                continue
+            marked.add(lo.getId())
+            toMark.append(lo.getParent())
+            for childId in self.containerChildren_.get(lo.getId(), ()):
+                toMark.append(languageObjects[childId])
+        
+        for loId in languageObjects.keys():
+            if loId not in marked:
+                self.programExecution_.removeLanguageObject(loId)
+                self.containerChildren_.pop(loId, None)
+        for pythonId, loId in self.pythonIdToLanguageObjectId_.items():
+            if loId not in marked:
+                del self.pythonIdToLanguageObjectId_[pythonId]
+                self._forgetPythonId(pythonId)
+        for containerId, (_, lo) in self.containerSnapshots_.items():
+            if lo.getId() not in marked:
+                del self.containerSnapshots_[containerId]
+        self.objectsToCollect_ = max(2 * len(marked), AnnotatorThread.MIN_OBJECTS_TO_COLLECT)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param dumpFileName File where the call graph database will be dumped.
+    def _dumpCurrentProgramExecution(self, dumpFileName, prettyPrint):
+        '''
+        Dump the call graph captured so far (the calls being kept, in the flight recorder mode), including the calls that have not returned yet.
+        In the streaming mode, the database is already being written: just flush it.
+        '''
+        if self.streamWriter_ is not None:
+            self.streamWriter_.flush()
+            return
+        aProgramExecution = self.programExecution_
+        if self.flightRecorder_ is not None:
+            aProgramExecution = ProgramExecution( self.programExecution_.getLanguage() )
+            for _, lo in sorted(self.programExecution_.getLanguageObjects().items()):
+                aProgramExecution.addLanguageObject(lo)
+            for aCall in self.flightRecorder_.getFunctionCalls():
+                aProgramExecution.addFunctionCall(aCall)
+        with open(dumpFileName, 'w') as jsonFileOut:
+            CallGraphSerializer().dump(aProgramExecution, jsonFileOut, prettyPrint)
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param containerType Container type (for Language objects or Function calls).
+    # @return The new id for the containerType.
+    def _getNewId(self, containerType):
+        '''
+        Get a new id to be used for a new LanguageObject or FunctionCall,
+        according to the containerType (Containers.LANGUAGE_OBJECTS or Containers.FUNCTION_CALLS).
+        '''
+        newId = self.nextIdsMap_[containerType]
+        self.nextIdsMap_[containerType] += 1
+        return newId
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param pythonId Unique id to identify Python objects.
+    # @param obj Object to declare.
+    # @param objType Obj's object type returned by type() function.
+    # @param isCallee Is the callee, i.e.: the receiver of the message (the function call).
+    # @return A tuple (declarationType, declarationCode) for this object.
+    def _getDeclarationInfo(self, pythonId, obj, objType, isCallee ):
+        '''
+        Returns a tuple declarationType, declarationCode with information to declare obj parameter.
+        For declarationType values, see LanguageObject.DECLARATION_TYPES enum.
+        The declarationCode is a string with the object representation.
+        For instance: for obj == 5 -> (FIXED_VALUE, "5")
+                          obj == int class -> (FIXED_VALUE, "int")
+                          obj == instance -> (CONSTRUCTOR, "None")
+        NOTE: For constructor, declarationCode doesn't matter, because the object will be declared
+        with the constructor notation: var1 = MyClass()
+        But for the FIXED_VALUE's, this code is used to declare:
+            var2 = 5 ("5" is read from declarationCode).
+        '''
+        #It has not been declared before
+        assert not self.pythonIdToLanguageObjectId_.has_key( pythonId )
+
+        DT = LanguageObject.DECLARATION_TYPES
+        #Default values
+        declarationType = DT.FIXED_VALUE
+        objToDump = None
+        if objType == LanguageType.MODULE:
+            objToDump = obj.__name__
+        elif objType == LanguageType.CLASS:
+            moduleName = obj.__module__
+            modulePrefix = "" if moduleName == PythonConstants.BUILTINS_MODULE_NAME else moduleName + "." 
+            objToDump = modulePrefix + obj.__name__
+        else:
+            assert objType == LanguageType.INSTANCE
+            if isCallee:
+                #We always annotate __main__ function
+                declarationType = DT.CONSTRUCTOR
+            else:
+                objToDump = obj
+        #TODO GERVA: Object rules configurables
+        #Argument. We have two options
+        # If it's an object to annotate, it should have been annotated before
+        # Otherwise, try (in this precedence order):
+        # * JSON (Fixed value), with the encoder for its class (see ObjectEncoders)
+        # * Dummy object
+        if objType == LanguageType.INSTANCE and not isCallee:
+            declarationCode = self.objectEncoders_.getDeclarationCode(objToDump)
+            if declarationCode is None:
+                declarationType = DT.DUMMY
+                declarationCode = asJsonString('Dummy')
+        else:
+            declarationCode = asJsonString(objToDump)
+        return declarationType, declarationCode
+    
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj Python "object" (module, class, or instance).
+    # @param objType Obj's object type returned by type() function.
+    # @return The obj's parent, or None if it's a module/
+    def _getParent(self, obj, objType):
+        '''
+        Python objects do have a hierarchical structure:
+            Module 
+              |
+            Class
+              |
+            Instance
+        This function returns the parent for any object (None for the "root" modules).
+        '''
+        assert self._hasParent(obj, objType)
+        if objType == LanguageType.CLASS:
+            return sys.modules[obj.__module__]
+        return obj.__class__
+
+    ##
+    # @param self The AnnotatorThread instance.
+    # @param obj Python "object" (module, class, or instance).
+    # @param objType Obj's object type returned by type() function.
+    # @return True if the object has parent, i.e.: it's not a module (see documentation for _getParent()).
+    def _hasParent(self, obj, objType):
+        '''
+        Return whether or not the object has parent, i.e.: it's not a module.
+        '''
+        return objType != LanguageType.MODULE
+
+#Message types, at module level for the producers hot path
+_ENTER_FUNCTION = AnnotatorThread.QueueInfo.MessageTypes.ENTER_FUNCTION
+_EXIT_FUNCTION = AnnotatorThread.QueueInfo.MessageTypes.EXIT_FUNCTION
+_END_ANNOTATION = AnnotatorThread.QueueInfo.MessageTypes.END_ANNOTATION
+_EVENTS_BATCH = AnnotatorThread.QueueInfo.MessageTypes.EVENTS_BATCH
+_DUMP = AnnotatorThread.QueueInfo.MessageTypes.DUMP
+
+class _SessionQueue:
+    '''
+    The capture queue of a session (see Annotator.startSession()). The session's AnnotatorThread is not started:
+    its events go to the queue shared by all the sessions, tagged with this _SessionQueue, and _SessionsThread
+    hands them back to it (see process()).
+    '''
+    ##
+    # @param self The _SessionQueue instance to construct.
+    # @param sessionsQueue The queue shared by all the sessions (see _SessionsThread).
+    # @param annotatorThread The session's AnnotatorThread.
+    def __init__(self, sessionsQueue, annotatorThread):
+        '''
+        Constructor.
+        '''
+        self.sessionsQueue_ = sessionsQueue
+        self.annotatorThread_ = annotatorThread
+        #The same bound as the shared queue (see Annotator.setQueueBound())
+        self.maxsize = sessionsQueue.maxsize
+        self.ended_ = threading.Event()
+
+    ##
+    # @param self The _SessionQueue instance.
+    # @param item Queue item for the session's AnnotatorThread.
+    def put(self, item):
+        '''
+        Put an item in the shared queue, for this session.
+        '''
+        self.sessionsQueue_.put( (self, item) )
+
+    ##
+    # @param self The _SessionQueue instance.
+    # @return True if the shared queue is full.
+    def full(self):
+        '''
+        Tell whether the shared queue is full (see OverflowPolicy).
+        '''
+        return self.sessionsQueue_.full()
+
+    ##
+    # @param self The _SessionQueue instance.
+    # @param item An item put by this session.
+    def process(self, item):
+        '''
+        Let the session's AnnotatorThread process an item (it's called by _SessionsThread).
+        '''
+        try:
+            self.annotatorThread_._processQueueItem(item)
+        finally:
+            if item[AnnotatorThread.QueueInfo.MESSAGE_TYPE] == _END_ANNOTATION:
+                self.ended_.set()
+
+    ##
+    # @param self The _SessionQueue instance.
+    def waitUntilEnded(self):
+        '''
+        Wait until the session's END_ANNOTATION message (and so, all the previous ones) has been processed.
+        '''
+        self.ended_.wait()
+
+class _SessionsThread(Thread):
+    '''
+    Runs the AnnotatorThread's of all the capture sessions of an Annotator (see Annotator.startSession()) in just one thread:
+    the sessions put their events in one shared queue (see _SessionQueue), and this thread hands each event to its session.
+    So a session doesn't start a thread, and the sessions don't share any capture state.
+    '''
+    ##
+    # @param self The _SessionsThread instance to construct.
+    # @param queueSize Bound for the shared queue (0 for no bound, see Annotator.setQueueBound()).
+    def __init__(self, queueSize):
+        '''
+        Constructor.
+        '''
+        Thread.__init__(self)
+        #Sessions not finished must not prevent the process from exiting
+        self.setDaemon(True)
+        self.queue_ = Queue(queueSize)
+
+    ##
+    # @param self The _SessionsThread instance.
+    # @return The queue shared by all the sessions.
+    def getQueue(self):
+        '''
+        Get the queue shared by all the sessions.
+        '''
+        return self.queue_
+
+    ##
+    # @param self The _SessionsThread instance.
+    def run(self):
+        '''
+        Hand every event to its session, until stop() is called.
+        '''
+        #This thread calls are never captured (see CaptureEngine.PROFILER)
+        sys.setprofile(None)
+        while True:
+            sessionQueue, item = self.queue_.get()
+            if sessionQueue is None:
+                return
+            try:
+                sessionQueue.process(item)
+            except Exception:
+                #A session's event must not stop the other sessions
+                import traceback
+                traceback.print_exc()
+
+    ##
+    # @param self The _SessionsThread instance.
+    def stop(self):
+        '''
+        Stop the thread, once every event put so far has been handed to its session.
+        '''
+        self.queue_.put( (None, None) )
+        self.join()
+    
+class Annotator:
+    '''
+    Interface for the calling programmer code to annotate the functions, i.e.:
+    replace them with a similar code that stores the function call in a container,
+    to persist it later in a database. 
+    It may work in a multi-threaded environment, because it calls AnnotatorThread class,
+    that uses Python threading queues.
+    It implements the "with" statement interface (RAII pattern in Python).
+    '''
+    activeAnnotators = False
+    ##
+    # @param self The Annotator instance to construct.
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        self.oldFuncs = {}
+        self.funcsToAnnotate = []
+        #{ (obj, funcName) -> Sampler given to annotate() }
+        self.funcSamplers_ = {}
+        #Profiler engine: { code object -> [(obj, callSite, sampler), ...] }
+        self.profiledCode_ = {}
+        self.annotationsStarted_ = False
+        self.callGraphQueue_ = Queue()
+        self.programExecution_ = None
+        self.annotatorThread_ = None
+        #Process being captured, and its parent if it's a child process that captures its own shard (see setChildProcessesDumpFile())
+        self.processId_ = os.getpid()
+        self.parentProcessId_ = None
+        #Set in the multiprocessing child processes, until they start their own capture (see _startChildCapture())
+        self.forked_ = False
+        self.childCaptureLock_ = threading.Lock()
+        multiprocessing.util.register_after_fork(self, Annotator._processForked)
+        self._resetCaptureState()
+
+    ##
+    # @param self The Annotator instance.
+    # @param obj Python "object" (module, class, or instance).
+    # @param *methodNames If None, annotate all obj's methods, else only the ones contained in *methodNames.
+    # @param **options Only 'sampler': a sampling.Sampler to choose which root calls of these methods are captured (default: all of them).
+    def annotate(self, obj, *methodNames, **options):
+        '''
+            Annotate an obj's methods (with an optional methodNames filter).
+            With a sampler, every method gets its own copy of it (see sampling.Sampler.clone()).
+        '''
+        sampler = options.pop('sampler', None)
+        assert not options, "Invalid options: " + str(options.keys())
+        if not methodNames:
+            methodNames = [name for name, _ in inspect.getmembers(obj,inspect.isroutine)]
+        for methodName in methodNames:
+            self._annotateMethod(obj,methodName)
+            if sampler is not None:
+                self.funcSamplers_[(obj, methodName)] = sampler
+
+    ##
+    # @param self The Annotator instance.
+    def __enter__(self):
+        '''
+        Entry point for the "with" sentence. It starts the annotations.
+        '''
+        self.startAnnotations()
+
+    ##
+    # @param self The Annotator instance.
+    def startAnnotations(self):
+        '''
+        Start an annotations process. Replace the functions stored in self.funcsToAnnotate
+        with a new function returned by annotatedFunction() method.
+        Use the Python native getattr() and setattr() methods to get and replace
+        the functions for an object.
+        '''
+        assert self.captureEngine_ != CaptureEngine.PROFILER or not self.captureOnFailure_, "The capture-on-failure mode is not available for the profiler engine: it can't see exceptions"
+        if Annotator.activeAnnotators:
+            #Limit instances number to 1
+            raise Exception('Only one annotator instance allowed.') 
+        Annotator.activeAnnotators = True
+        try:
+            self._replaceFunctions(self.funcsToAnnotate)
+            self.annotationsStarted_ = True
+            return self
+        except Exception, e:
+            self.restoreFunctions()
+            raise e
+
+    ##
+    # @param self The Annotator instance.
+    # @param objAndFuncNames List of (obj, funcName) to annotate, from self.funcsToAnnotate.
+    def _replaceFunctions(self, objAndFuncNames):
+        '''
+        Replace the functions with a new function returned by annotatedFunction() method
+        (or register them for the profiler engine, see CaptureEngine).
+        '''
+        #Every class is inspected only once, no matter how many of its methods are annotated
+        classMethodsTypeCache = {}
+        for objAndFuncName in objAndFuncNames:
+            obj, funcName = objAndFuncName
+            fun = getattr( obj, funcName )
+            callSite = _createCallSiteDescriptor(obj, funcName, fun, classMethodsTypeCache)
+            theLanguageType = callSite.getLanguageType()
+            methodType = callSite.getInspectMethodType()
+            
+            sampler = self.funcSamplers_.get(objAndFuncName, self.defaultSampler_)
+            if sampler is not None:
+                sampler = sampler.clone()
+            if self.captureEngine_ == CaptureEngine.PROFILER:
+                self._addProfiledFunction(obj, fun, callSite, sampler)
+                continue
+            functionOverhead = None
+            if self.overheadMonitor_ is not None:
+                functionOverhead = self.overheadMonitor_.addFunction(_getQualifiedFunctionName(obj, funcName))
+            
+            newFun = annotatedFunction(self, obj, fun, callSite, sampler, functionOverhead)
+            if methodType == 'static method':
+                newFun = staticmethod( newFun )
+            elif methodType == 'class method':
+                newFun = classmethod( newFun )
+            elif methodType == 'method' and theLanguageType == LanguageType.INSTANCE:
+                newFun = types.MethodType(newFun, obj, obj.__class__)
+            setattr(obj, funcName, newFun )
+            #Backup old and new functions, in order to restore them later
+            self.oldFuncs[objAndFuncName] = (fun, methodType)
+        if self.profiledCode_:
+            sys.setprofile(self._profileEvent)
+            threading.setprofile(self._profileEvent)
+
+    ##
+    # @param self The Annotator instance.
+    # @param obj Python "object" (module, class, or instance).
+    # @param *methodNames If None, annotate all obj's methods, else only the ones contained in *methodNames.
+    # @param **options The same as in annotate().
+    def annotateNow(self, obj, *methodNames, **options):
+        '''
+        Annotate an obj's methods, like annotate(). If the annotations have already started, they're replaced right away
+        (e.g.: for a module imported while capturing, see import_hook). Methods already annotated are skipped.
+        '''
+        if not methodNames:
+            methodNames = [name for name, _ in inspect.getmembers(obj,inspect.isroutine)]
+        methodNames = [methodName for methodName in methodNames if (obj, methodName) not in self.funcsToAnnotate]
+        if not methodNames:
+            return
+        firstNewFunction = len(self.funcsToAnnotate)
+        self.annotate(obj, *methodNames, **options)
+        if self.annotationsStarted_:
+            self._replaceFunctions(self.funcsToAnnotate[firstNewFunction:])
+
+    ##
+    # @param self The Annotator instance.
+    def __exit__(self, _, __, ___):
+        '''
+        Exit point for the "with" sentence. It finishes the annotations.
+        '''
+        self.finishAnnotations()
+
+    ##
+    # @param self The Annotator instance.
+    def finishAnnotations(self):
+        '''
+        Finish the annotations process, by sending an "End Process" message to AnnotatorThread.
+        Finally, restore the original functions.
+        '''
+        try:
+            Annotator.activeAnnotators = False
+            self._checkProcess()
+            self.annotationsStarted_ = False
+            self._finishCapture()
+        finally:
+            self.restoreFunctions()
+
+    ##
+    # @param self The Annotator instance.
+    def _finishCapture(self):
+        '''
+        Hand the events still buffered by any thread, and the capture metadata, to AnnotatorThread,
+        and wait until it processes all of them.
+        '''
+        with self.threadEventBuffersLock_:
+            threadEventBuffers = [threadEventBuffer for _, threadEventBuffer in self.threadEventBuffers_]
+            droppedRootCalls = self.endedThreadsDroppedRootCalls_
+        for threadEventBuffer in threadEventBuffers:
+            self._handEvents(threadEventBuffer)
+        if self.callGraphQueue_.maxsize > 0:
+            droppedRootCalls += sum([threadEventBuffer.droppedRootCalls_ for threadEventBuffer in threadEventBuffers])
+            self.programExecution_.setMetadata(ProgramExecution.Metadata.DROPPED_ROOT_CALLS, droppedRootCalls)
+        self._setDemotionsMetadata()
+        self.callGraphQueue_.put( (_END_ANNOTATION,) )
+
+        #Wait for the thread to process all messages
+        if isinstance(self.callGraphQueue_, _SessionQueue):
+            self.callGraphQueue_.waitUntilEnded()
+        else:
+            self.annotatorThread_.join()
+        if self.sessionsThread_ is not None:
+            self.sessionsThread_.stop()
+            self.sessionsThread_ = None
+
+    ##
+    # @param self The Annotator instance.
+    # @return The Annotator capturing the current thread calls: its session (see startSession()), or this one.
+    def getCurrentSession(self):
+        '''
+        Get the Annotator capturing the current thread calls: the session the thread has started, if any, or this one.
+        Every annotated call asks for it before anything else, so it's where a child process detects it has been forked.
+        '''
+        if self.forked_ or (self.childDumpFileName_ is not None and self.processId_ != os.getpid()):
+            self._startChildCapture()
+        return getattr(self.sessionLocals_, 'session', self)
+
+    ##
+    # @param self The Annotator instance.
+    def _checkProcess(self):
+        '''
+        Start the child process capture (see _startChildCapture()), if this process has been forked and it has not started it yet.
+        The multiprocessing child processes are flagged when they start (see _processForked()). Any other child process
+        (e.g.: created by os.fork()) is only detected by its process id, if the child processes capture is on.
+        '''
+        if self.forked_ or (self.childDumpFileName_ is not None and self.processId_ != os.getpid()):
+            self._startChildCapture()
+
+    ##
+    # @param self The Annotator instance.
+    def _processForked(self):
+        '''
+        multiprocessing "after fork" function: flag the child process, so it starts its own capture (see _checkProcess()).
+        '''
+        self.forked_ = True
+
+    ##
+    # @param self The Annotator instance.
+    # @param childDumpFileName File where every child process dumps its call graph (see file_utils.getShardDumpFileName()).
+    # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
+    def setChildProcessesDumpFile(self, childDumpFileName, preserveOldDumpFiles = True):
+        '''
+        Fork-aware capture: a child process (created by os.fork() or multiprocessing) captures its calls in its own ProgramExecution,
+        a shard tagged with its process id and its parent's (see ProgramExecution.Metadata), and dumps it when it exits.
+        Otherwise, the multiprocessing child processes don't capture their calls: the annotated functions just call the original ones.
+        The shards may be merged with this process call graph (see process_shards).
+        The shard is dumped by an exit finalizer: a child process created by os.fork() must exit through sys.exit() (or by returning),
+        since os._exit() doesn't run the finalizers, and its shard is never dumped.
+        '''
+        self.childDumpFileName_ = childDumpFileName
+        self.preserveOldChildDumpFiles_ = preserveOldDumpFiles
+        self.programExecution_.setMetadata(ProgramExecution.Metadata.PROCESS_ID, self.processId_)
+
+    ##
+    # @param self The Annotator instance.
+    def _startChildCapture(self):
+        '''
+        Called in a child process, the first time it captures a call (or finishes the annotations).
+        The child has a copy of its parent's capture state, but not its AnnotatorThread, and the locks held by other threads
+        when the process was forked are still locked: start a new capture, with the same options, in a new ProgramExecution.
+        The streaming database and the collector connection are the parent's: the child keeps its calls in memory.
+        The calls the forking thread was running are in the parent's call graph: when they return, they're ignored (see functionEnded()).
+        The child process id is set last: other threads of the child wait until the new capture has started.
+        '''
+        with self.childCaptureLock_:
+            if self.processId_ != os.getpid():
+                self._startChildCaptureLocked()
+            self.forked_ = False
+
+    ##
+    # @param self The Annotator instance.
+    def _startChildCaptureLocked(self):
+        '''
+        Start the child process capture, see _startChildCapture(). The caller holds childCaptureLock_.
+        '''
+        processId = os.getpid()
+        forkingThreadEventBuffer = getattr(self.threadLocals_, 'eventBuffer', None)
+        self.parentProcessId_ = self.processId_
+        self.threadLocals_ = threading.local()
+        self.threadEventBuffers_ = []
+        self.threadEventBuffersLock_ = threading.Lock()
+        self.endedThreadsDroppedRootCalls_ = 0
+        self.sessionLocals_ = threading.local()
+        self.sessionsThread_ = None
+        self.sessionsThreadLock_ = threading.Lock()
+        if forkingThreadEventBuffer is not None:
+            #The annotated functions called by a function that skipped the capture still skip it
+            self._getThreadEventBuffer().skippedDepth_ = forkingThreadEventBuffer.skippedDepth_
+        self.callGraphQueue_ = Queue(self.callGraphQueue_.maxsize)
+        flightRecorder = self.annotatorThread_.flightRecorder_
+        self.programExecution_ = ProgramExecution( ProgramExecution.Languages.PYTHON )
+        self.programExecution_.setMetadata(ProgramExecution.Metadata.PROCESS_ID, processId)
+        self.programExecution_.setMetadata(ProgramExecution.Metadata.PARENT_PROCESS_ID, self.parentProcessId_)
+        captureLimits = self.annotatorThread_.captureLimits_
+        self.annotatorThread_ = AnnotatorThread(self.programExecution_, self.callGraphQueue_)
+        self.annotatorThread_.setObjectEncoders(self.objectEncoders_)
+        self.annotatorThread_.setCaptureLimits(captureLimits)
+        if flightRecorder is not None:
+            self.annotatorThread_.setFlightRecorder(FlightRecorder(flightRecorder.size_))
+        #The child process must not wait for it to exit: the shard is dumped by the exit finalizer, while it's still running
+        self.annotatorThread_.setDaemon(True)
+        self.annotatorThread_.start()
+        if self.childDumpFileName_ is None:
+            self.captureOutsideSessions_ = False
+        else:
+            #multiprocessing runs its finalizers when its child processes exit (they don't run the atexit functions),
+            #and it registers an atexit function that runs them in any other process
+            multiprocessing.util.Finalize(None, self._finishChildCapture, args = (processId,), exitpriority = 0)
+        self.processId_ = processId
+
+    ##
+    # @param self The Annotator instance.
+    # @param processId The child process that registered this finalizer (see _startChildCapture()).
+    def _finishChildCapture(self, processId):
+        '''
+        Exit finalizer for a child process: finish its capture, and dump its shard.
+        '''
+        if processId != os.getpid() or not self.annotationsStarted_:
+            #A copy inherited by a grandchild process, or the annotations have already been finished
+            return
+        self.annotationsStarted_ = False
+        self._finishCapture()
+        self.dumpProgramExecution(self.childDumpFileName_, self.preserveOldChildDumpFiles_)
+
+    ##
+    # @param self The Annotator instance.
+    # @return A new Annotator, capturing the current thread calls until finishSession().
+    def startSession(self):
+        '''
+        Start a capture session for the current thread (e.g.: for a request in a server):
+        the calls it makes to the annotated functions are captured in the session's own ProgramExecution,
+        with its own AnnotatorThread state, instead of this Annotator's ones. The sessions don't start a thread each:
+        their AnnotatorThread's are run by a _SessionsThread, shared by all of them, that lives until the annotations finish
+        (so every session must be finished before).
+        The functions are annotated just once (see startAnnotations()): the sessions share them, but no capture state,
+        so many threads can run their sessions in parallel. A session has the capture options of this Annotator,
+        except for the stream dump file and the flight recorder. The demotions of the overhead budget are
+        the annotated functions', so they're only recorded in the session's metadata (see finishSession()).
+        The calls made by other threads (even the ones started by this thread) are not in the session.
+        '''
+        assert self.getCurrentSession() is self, "A session has already been started by this thread"
+        session = Annotator()
+        session.programExecution_ = ProgramExecution( ProgramExecution.Languages.PYTHON )
+        session.annotatorThread_ = AnnotatorThread(session.programExecution_, None)
+        session.callGraphQueue_ = _SessionQueue(self._getSessionsThread().getQueue(), session.annotatorThread_)
+        session.eventBufferSize_ = self.eventBufferSize_
+        session.maxCaptureDepth_ = self.maxCaptureDepth_
+        session.capturePolicy_ = self.capturePolicy_
+        session.overflowPolicy_ = self.overflowPolicy_
+        session.overflowSampleRate_ = self.overflowSampleRate_
+        session.captureOnFailure_ = self.captureOnFailure_
+        session.wallClock_ = self.wallClock_
+        session.cpuClock_ = self.cpuClock_
+        session.objectEncoders_ = self.objectEncoders_
+        session.annotatorThread_.setObjectEncoders(self.objectEncoders_)
+        session.annotatorThread_.setCaptureLimits(self.annotatorThread_.captureLimits_)
+        self.sessionLocals_.session = session
+        return session
+
+    ##
+    # @param self The Annotator instance.
+    # @param session The Annotator returned by startSession(), in this same thread.
+    def finishSession(self, session):
+        '''
+        Finish the current thread's capture session: the calls it makes from now on are captured by this Annotator again
+        (if setCaptureOutsideSessions() allows it). When it returns, the session's ProgramExecution is complete.
+        '''
+        assert self.getCurrentSession() is session, "The session was not started by this thread"
+        del self.sessionLocals_.session
+        if self.overheadMonitor_ is not None:
+            session.programExecution_.setMetadata(ProgramExecution.Metadata.DEMOTED_FUNCTIONS, self.overheadMonitor_.getDemotions())
+        session._finishCapture()
+
+    ##
+    # @param self The Annotator instance.
+    # @return The _SessionsThread for this Annotator's sessions.
+    def _getSessionsThread(self):
+        '''
+        Get the _SessionsThread that runs the sessions, starting it the first time.
+        '''
+        with self.sessionsThreadLock_:
+            if self.sessionsThread_ is None:
+                self.sessionsThread_ = _SessionsThread(self.callGraphQueue_.maxsize)
+                self.sessionsThread_.start()
+            return self.sessionsThread_
+
+    ##
+    # @param self The Annotator instance.
+    # @param captureOutsideSessions If False, only the calls made inside sessions (see startSession()) are captured.
+    def setCaptureOutsideSessions(self, captureOutsideSessions):
+        '''
+        Choose whether this Annotator captures the calls made outside sessions (default), or just lets them pass through.
+        '''
+        self.captureOutsideSessions_ = captureOutsideSessions
+
+    ##
+    # @param self The Annotator instance.
+    # @return The ProgramExecution where the calls are captured.
+    def getProgramExecution(self):
+        '''
+        Get the ProgramExecution where the calls are captured.
+        It's complete only when the capture has finished (see finishAnnotations() and finishSession()).
+        '''
+        return self.programExecution_
+
+    ##
+    # @param self The Annotator instance.
+    # @param annotationId Annotation id: it'll be necessary later in the "end function" message, to know which function is ending. 
+    # @param obj Python "object" (it may be a module, class, or instance) whose functions we're annotating
+    # @param callSite CallSiteDescriptor for the function.
+    # @param *args Arguments list.
+    # @param **kwargs Named arguments.
+    # @return The current thread's ThreadEventBuffer, to pass it to functionEnded().
+    def functionStarted(self, annotationId, obj, callSite, *args, **kwargs):
+        '''
+        Send a "Function started" message to the queue, to start this function annotations.
+        '''
+        threadEventBuffer = self._getThreadEventBuffer()
+        threadEventBuffer.depth_ += 1
+        if self.capturePolicy_ == CapturePolicy.SNAPSHOT:
+            captureLimits = self.annotatorThread_.captureLimits_
+            args = tuple([threadEventBuffer.snapshot(arg, captureLimits) for arg in args])
+            kwargs = dict([(name, threadEventBuffer.snapshot(karg, captureLimits)) for name, karg in kwargs.iteritems()])
+        item = (_ENTER_FUNCTION, threadEventBuffer.threadId_, threadEventBuffer.nextSequence(), annotationId, obj, callSite, args, kwargs)
+        self._putEvent(threadEventBuffer, item)
+        return threadEventBuffer
+
+    ##
+    # @param self The Annotator instance.
+    # @param annotationId Annotation id: to identify the function.
+    # @param threwException The function has raised an exception.
+    # @param returnedObject If threwException is False, the object returned by the function. If True, the exception being raised.
+    # @param totalTime Wall time taken by the function, or None if the calls are not timed (see setCallTiming()).
+    # @param cpuTime Thread CPU time taken by the function, or None if it's not measured (see setCallTiming()).
+    # @param threadEventBuffer The current thread's ThreadEventBuffer returned by functionStarted(), or None to look it up.
+    def functionEnded(self, annotationId, threwException, returnedObject, totalTime = None, cpuTime = None, threadEventBuffer = None):
+        '''
+        Send a "Function ended" message to the queue. Pass also the "returned object" (or exception) information.
+        '''
+        if threadEventBuffer is None:
+            threadEventBuffer = self._getThreadEventBuffer()
+        if not threadEventBuffer.depth_:
+            #Entered before this process was forked (see _startChildCapture())
+            return
+        threadEventBuffer.depth_ -= 1
+        if self.capturePolicy_ == CapturePolicy.SNAPSHOT:
+            returnedObject = threadEventBuffer.snapshot(returnedObject, self.annotatorThread_.captureLimits_)
+        item = (_EXIT_FUNCTION, threadEventBuffer.threadId_, threadEventBuffer.nextSequence(), annotationId, threwException, returnedObject, totalTime, cpuTime)
+        self._putEvent(threadEventBuffer, item)
+
+    ##
+    # @param self The Annotator instance.
+    # @param eventBufferSize Maximum number of events an application thread buffers before handing them to AnnotatorThread. 0 (default) disables the buffers.
+    def setEventBufferSize(self, eventBufferSize):
+        '''
+        Choose the capture mode:
+            * eventBufferSize == 0: each event is put in the shared queue as soon as it happens.
+            * eventBufferSize > 0: each application thread appends its events to its own buffer, and hands them
+              to AnnotatorThread in just one message, when the buffer is full or the thread is idle
+              (it has left the outermost annotated function). This way, the queue lock is taken once per batch, not twice per call.
+        It must be set before starting the annotations.
+        '''
+        assert eventBufferSize >= 0
+        self.eventBufferSize_ = eventBufferSize
+
+    ##
+    # @param self The Annotator instance.
+    # @return The ThreadEventBuffer for the current thread.
+    def _getThreadEventBuffer(self):
+        '''
+        Get the ThreadEventBuffer for the current thread, creating it the first time.
+        '''
+        threadEventBuffer = getattr(self.threadLocals_, 'eventBuffer', None)
+        if threadEventBuffer is None:
+            threadEventBuffer = ThreadEventBuffer()
+            self.threadLocals_.eventBuffer = threadEventBuffer
+            #Registered, to hand its remaining events when the annotations finish
+            with self.threadEventBuffersLock_:
+                endedThreadEventBuffers = self._takeEndedThreadEventBuffers()
+                self.threadEventBuffers_.append( (weakref.ref(threading.currentThread()), threadEventBuffer) )
+            for endedThreadEventBuffer in endedThreadEventBuffers:
+                self._handEvents(endedThreadEventBuffer)
+        return threadEventBuffer
+
+    ##
+    # @param self The Annotator instance.
+    # @return The ThreadEventBuffer's of the threads that have ended, no longer registered.
+    def _takeEndedThreadEventBuffers(self):
+        '''
+        Unregister the ThreadEventBuffer's of the threads that have ended, so a long capture doesn't keep one
+        (and its snapshots) for every thread that has ever made a captured call. Their dropped root calls are still counted.
+        The caller holds threadEventBuffersLock_, and hands their remaining events (see _handEvents()).
+        '''
+        endedThreadEventBuffers = []
+        liveThreadEventBuffers = []
+        for threadReference, threadEventBuffer in self.threadEventBuffers_:
+            thread = threadReference()
+            if thread is None or not thread.isAlive():
+                endedThreadEventBuffers.append(threadEventBuffer)
+                self.endedThreadsDroppedRootCalls_ += threadEventBuffer.droppedRootCalls_
+            else:
+                liveThreadEventBuffers.append( (threadReference, threadEventBuffer) )
+        self.threadEventBuffers_ = liveThreadEventBuffers
+        return endedThreadEventBuffers
+
+    ##
+    # @param self The Annotator instance.
+    # @param threadEventBuffer The current thread's ThreadEventBuffer.
+    # @param item Queue item for AnnotatorThread.
+    def _putEvent(self, threadEventBuffer, item):
+        '''
+        Send an event to AnnotatorThread, right now or buffered, depending on the capture mode (see setEventBufferSize()).
+        In the capture-on-failure mode (see setCaptureOnFailure()), the events are kept until their root call ends.
+        '''
+        if self.captureOnFailure_:
+            threadEventBuffer.rootCallEvents_.append(item)
+            if threadEventBuffer.depth_ == 0:
+                if item[AnnotatorThread.QueueInfo.INDEX_THREW]:
+                    self.callGraphQueue_.put( (_EVENTS_BATCH, threadEventBuffer.takeRootCallEvents()) )
+                else:
+                    threadEventBuffer.discardRootCall()
+            return
+        if not self.eventBufferSize_:
+            self.callGraphQueue_.put( item )
+            return
+        bufferedEvents = threadEventBuffer.append(item)
+        if bufferedEvents >= self.eventBufferSize_ or threadEventBuffer.depth_ == 0:
+            self._handEvents(threadEventBuffer)
+
+    ##
+    # @param self The Annotator instance.
+    # @param captureEngine How the calls are intercepted (see CaptureEngine).
+    def setCaptureEngine(self, captureEngine):
+        '''
+        Choose how the calls to the annotated functions are intercepted (see CaptureEngine).
+        The overhead budget (see setOverheadBudget()) and the capture-on-failure mode (see setCaptureOnFailure())
+        are available for the wrappers engine only.
+        It must be set before starting the annotations.
+        '''
+        assert captureEngine in (CaptureEngine.WRAPPERS, CaptureEngine.PROFILER)
+        self.captureEngine_ = captureEngine
+
+    ##
+    # @param self The Annotator instance.
+    # @param obj Python "object" (module, class, or instance) whose function we're annotating.
+    # @param fun The function to be annotated (getattr(obj, funcName)).
+    # @param callSite CallSiteDescriptor for the function.
+    # @param sampler sampling.Sampler that chooses which root calls are captured, or None.
+    def _addProfiledFunction(self, obj, fun, callSite, sampler):
+        '''
+        Profiler engine: register the function code object, so the profile function captures its calls.
+        The same code object may be registered for several objects (e.g.: a method inherited by two annotated classes),
+        see _getProfiledTarget().
+        '''
+        assert self.overheadMonitor_ is None, "The overhead budget is not available for the profiler engine"
+        code = getattr(getattr(fun, 'im_func', fun), 'func_code', None)
+        if code is None or code.co_flags & inspect.CO_GENERATOR:
+            #No Python frames, or one call event per resumption
+            raise Exception('The profiler engine can only capture Python non-generator functions: ' + callSite.getFunctionName())
+        self.profiledCode_.setdefault(code, []).append( (obj, callSite, sampler) )
+
+    ##
+    # @param self The Annotator instance.
+    # @param frame The frame being called or returning.
+    # @param event Profile event ('call', 'return', 'c_call', etc.).
+    # @param arg For 'return', the returned object.
+    def _profileEvent(self, frame, event, arg):
+        '''
+        Profiler engine: the profile function. Other events, or code objects that were not annotated, are discarded right away.
+        Once the annotations have finished, it removes itself from the thread (restoreFunctions() can only remove it
+        from the calling thread, and from the threads started later).
+        '''
+        if not self.profiledCode_:
+            sys.setprofile(None)
+            return
+        if event == 'call':
+            targets = self.profiledCode_.get(frame.f_code)
+            if targets is not None:
+                self._profiledFunctionStarted(frame, targets)
+        elif event == 'return' and frame.f_code in self.profiledCode_:
+            self._profiledFunctionEnded(frame, arg)
+
+    ##
+    # @param self The Annotator instance.
+    # @param frame The frame of the annotated function being called.
+    # @param targets The (obj, callSite, sampler)'s registered for its code object.
+    def _profiledFunctionStarted(self, frame, targets):
+        '''
+        Profiler engine: capture a call, like annotatedFunction() does. The arguments are read from the frame,
+        so the ones passed by name (and the defaults) look like positional arguments.
+        '''
+        code = frame.f_code
+        localVars = frame.f_locals
+        argNames = code.co_varnames
+        args = [localVars[argName] for argName in argNames[:code.co_argcount]]
+        nextArgIndex = code.co_argcount
+        if code.co_flags & inspect.CO_VARARGS:
+            args.extend(localVars[argNames[nextArgIndex]])
+            nextArgIndex += 1
+        kwargs = {}
+        if code.co_flags & inspect.CO_VARKEYWORDS:
+            kwargs = localVars[argNames[nextArgIndex]]
+        obj, callSite, sampler = targets[0] if len(targets) == 1 else self._getProfiledTarget(targets, args)
+        if callSite.getLanguageType() == LanguageType.INSTANCE and callSite.skipFirstArg() and args[0] is not obj:
+            #The same method called for another instance
+            return
+        annotator = self.getCurrentSession()
+        threadEventBuffer = self._getThreadEventBuffer()
+        argumentsStart = 1 if callSite.calleeIsFirstArg() or callSite.skipFirstArg() else 0
+        if annotator.mustSkipCapture(sampler, args, kwargs, argumentsStart):
+            annotator._getThreadEventBuffer().skippedDepth_ += 1
+            threadEventBuffer.profiledFrames_.append( (frame, annotator, False) )
+            return
+        callee = args[0] if callSite.calleeIsFirstArg() else obj
+        annotator.functionStarted( id(frame), callee, callSite, *args, **kwargs )
+        threadEventBuffer.profiledFrames_.append( (frame, annotator, True) )
+        if annotator.wallClock_ is not None:
+            #The start times are read last, so the capture is not timed
+            threadEventBuffer.profiledStartTimes_.append( (annotator.wallClock_(), annotator.cpuClock_() if annotator.cpuClock_ is not None else None) )
+
+    ##
+    # @param self The Annotator instance.
+    # @param targets The (obj, callSite, sampler)'s registered for a code object (more than one).
+    # @param args Arguments list of the call.
+    # @return The (obj, callSite, sampler) the call is captured for.
+    def _getProfiledTarget(self, targets, args):
+        '''
+        Profiler engine: choose the object a call to a code object registered more than once is captured for:
+        the instance it's called for, if it's annotated, or else the most derived annotated class of the receiver
+        (as the wrapper found by the method lookup would). Other functions are captured for the first object.
+        '''
+        receiver = args[0] if args else None
+        receiverClass = receiver if inspect.isclass(receiver) else getattr(receiver, '__class__', None)
+        mro = inspect.getmro(receiverClass) if receiverClass is not None else ()
+        chosenTarget = targets[0]
+        chosenIndex = len(mro)
+        for target in targets:
+            obj = target[0]
+            if obj is receiver:
+                return target
+            if obj in mro and mro.index(obj) < chosenIndex:
+                chosenTarget = target
+                chosenIndex = mro.index(obj)
+        return chosenTarget
+
+    ##
+    # @param self The Annotator instance.
+    # @param frame The frame of the annotated function returning.
+    # @param returnedObject The returned object (None if it's raising an exception).
+    def _profiledFunctionEnded(self, frame, returnedObject):
+        '''
+        Profiler engine: finish a call started by _profiledFunctionStarted() (if it was not discarded).
+        '''
+        profiledFrames = self._getThreadEventBuffer().profiledFrames_
+        if not profiledFrames or profiledFrames[-1][0] is not frame:
+            return
+        _, annotator, captured = profiledFrames.pop()
+        if captured:
+            totalTime = cpuTime = None
+            if annotator.wallClock_ is not None:
+                wallStartTime, cpuStartTime = self._getThreadEventBuffer().profiledStartTimes_.pop()
+                totalTime = annotator.wallClock_() - wallStartTime
+                if cpuStartTime is not None:
+                    cpuTime = annotator.cpuClock_() - cpuStartTime
+            annotator.functionEnded( id(frame), False, returnedObject, totalTime, cpuTime )
         else:
-            assert msgType == AnnotatorThread.QueueInfo.MessageTypes.EXIT_FUNCTION
-            annotationId = item[AnnotatorThread.QueueInfo.INDEX_ANNOTATION_ID]
-            funcCall = self.annotationIdToFuncCall_[annotationId]
-            threwException = item[AnnotatorThread.QueueInfo.INDEX_THREW]
-            returnedObject = item[AnnotatorThread.QueueInfo.INDEX_RETURNED_OBJ]
-            returnedObjectLo = self._declareObjectAndParents(returnedObject, isCallee = False)
-            funcCall.setReturnedObject(returnedObjectLo)
-            funcCall.setThrewException(threwException)
-            self.currentFunctionLevel_ -= 1
+            annotator._getThreadEventBuffer().skippedDepth_ -= 1
 
     ##
-    # @param self The AnnotatorThread instance.
-    # @param obj Python "object" (module, class, or instance) to declare.
-    # @param isCallee Obj is the callee, i.e.: the receiver of the message (the function call).
-    # @return The newly declared LanguageObject.
-    def _declareObjectAndParents(self, obj, isCallee):
+    # @param self The Annotator instance.
+    # @param callTiming What is measured for every captured call (see CallTiming).
+    def setCallTiming(self, callTiming):
         '''
-        Recursive function to get a LanguageObject. If not previously declared,
-        "declare" a Python object (module, class or instance),
-        but declaring first its parent (and here is where the recursion appears).
-        For containers:
-            * declare children.
-            * replace original container for a container of language object id's.      
-        '''
-        ##
-        # @param obj Python "object" (module, class, or instance) to declare
-        # @param objType Obj's object type returned by type() function.
-        def getPythonUniqueId(obj, objType):
-            '''
-            Get a unique id for the object, to identify it in the containers.
-            We use id's for instances, and str for all other objects (classes, modules, native types, etc.)
-            We cannot use ID for every object, because garbage collector may free the memory after returning from a function.
-            For instance:
-                def f():
-                    i = 5
-                    vector = [1, i]
-                    annotatedFunction(i, vector)
-                f()
-                f()
-                After the first call, the garbage collector may free the memory for i and vector,
-                hence: were we to use id() to identify objects, arguments for annotatedFunction() from the first and second call to f()
-                may be recognized as different, when they are logically the same.
-            '''
-            if objType is types.InstanceType:
-                return "ID:" + str(id(obj))
-            else:
-                return "ST:" + str(obj)
-            
-        objToDeclare = obj
-        objType = type(obj)
-        if objType is types.TupleType:
-            auxList = []
-            for child in obj:
-                #Recursive call
-                childLo = self._declareObjectAndParents(child, False)
-                auxList.append(childLo.getId())
-            objToDeclare = tuple(auxList)
-        elif objType is types.ListType:
-            objToDeclare = []
-            for child in obj:
-                #Recursive call
-                childLo = self._declareObjectAndParents(child, False)
-                objToDeclare.append(childLo.getId())
-        elif objType is types.DictType:
-            objToDeclare = {}
-            for key, value in obj.items():
-                #Recursive calls
-                keyLo = self._declareObjectAndParents(key, False)
-                valueLo = self._declareObjectAndParents(value, False)
-                objToDeclare[keyLo.getId()] = valueLo.getId()
-
-        #Declare current obj, if not declared before
-        pythonId = getPythonUniqueId(objToDeclare, objType)
-        if self.pythonIdToLanguageObjectId_.has_key(pythonId):
-            return self.programExecution_.getLanguageObjects()[self.pythonIdToLanguageObjectId_[pythonId]]
+        Time the captured calls, so the call graph is also a profile of the annotated functions.
+        It must be set before starting the annotations.
+        '''
+        assert callTiming in (CallTiming.NONE, CallTiming.WALL, CallTiming.WALL_AND_CPU)
+        self.wallClock_ = None if callTiming == CallTiming.NONE else clocks.monotonicTime
+        self.cpuClock_ = clocks.threadCpuTime if callTiming == CallTiming.WALL_AND_CPU else None
 
-        #obj
-        objType = _getLanguageType(obj)
-        declarationType, declarationCode = self._getDeclarationInfo(pythonId, objToDeclare, objType, isCallee)
-        
-        parentLo = None
-        if self._hasParent(obj, objType):
-            parent = self._getParent(obj, objType)
-            parentLo = self._declareObjectAndParents(parent, isCallee = False) 
-        #Recursive call
-        newId = self._getNewId(AnnotatorThread.Containers.LANGUAGE_OBJECTS)
-        lo =  LanguageObject(newId, objType, declarationType, declarationCode, parentLo)
-        self.programExecution_.addLanguageObject(lo)
-        self.pythonIdToLanguageObjectId_[pythonId] = newId
-        return lo
+    ##
+    # @param self The Annotator instance.
+    # @param cls Class (new-style or old-style).
+    # @param encoder Function that takes an instance of cls (or a subclass) and returns the scalar to dump, or ObjectEncoders.DUMMY.
+    def registerEncoder(self, cls, encoder):
+        '''
+        Choose how the instances of cls (passed to, or returned by, the annotated functions) are declared
+        in the generated code: as the value returned by the encoder (a scalar dumpable in JSON: a string, a number, a bool or None), or as Dummy's.
+        E.g.: for an ORM entity, an encoder may return its primary key; ObjectEncoders.DUMMY skips trying to dump it.
+        With a collector (see setCollectorStream()), the encoders run in this process, when the events are encoded.
+        '''
+        self.objectEncoders_.registerEncoder(cls, encoder)
 
     ##
-    # @param self The AnnotatorThread instance.
-    # @param containerType Container type (for Language objects or Function calls).
-    # @return The new id for the containerType.
-    def _getNewId(self, containerType):
+    # @param self The Annotator instance.
+    # @param captureOnFailure If True, only the root calls that raise an exception are captured (with their nested calls).
+    def setCaptureOnFailure(self, captureOnFailure):
         '''
-        Get a new id to be used for a new LanguageObject or FunctionCall,
-        according to the containerType (Containers.LANGUAGE_OBJECTS or Containers.FUNCTION_CALLS).
+        Choose the capture-on-failure mode: each application thread keeps the events of the root call it's running,
+        and hands them to AnnotatorThread only if the root call raises an exception. Otherwise, they're just forgotten:
+        no LanguageObject is declared for them, and they don't reach the database.
+        A root call still running when the annotations finish (or when dumping, see dumpProgramExecutionNow()) isn't captured.
+        The arguments are kept until the root call ends: use CapturePolicy.SNAPSHOT if they're changed meanwhile.
+        It must be set before starting the annotations.
         '''
-        newId = self.nextIdsMap_[containerType]
-        self.nextIdsMap_[containerType] += 1
-        return newId
+        self.captureOnFailure_ = captureOnFailure
 
     ##
-    # @param self The AnnotatorThread instance.
-    # @param pythonId Unique id to identify Python objects.
-    # @param obj Object to declare.
-    # @param objType Obj's object type returned by type() function.
-    # @param isCallee Is the callee, i.e.: the receiver of the message (the function call).
-    # @return A tuple (declarationType, declarationCode) for this object.
-    def _getDeclarationInfo(self, pythonId, obj, objType, isCallee ):
+    # @param self The Annotator instance.
+    # @param maxCaptureDepth Maximum nesting level of the captured calls (1: only the outermost annotated calls). 0 (default) means no limit.
+    def setMaxCaptureDepth(self, maxCaptureDepth):
         '''
-        Returns a tuple declarationType, declarationCode with information to declare obj parameter.
-        For declarationType values, see LanguageObject.DECLARATION_TYPES enum.
-        The declarationCode is a string with the object representation.
-        For instance: for obj == 5 -> (FIXED_VALUE, "5")
-                          obj == int class -> (FIXED_VALUE, "int")
-                          obj == instance -> (CONSTRUCTOR, "None")
-        NOTE: For constructor, declarationCode doesn't matter, because the object will be declared
-        with the constructor notation: var1 = MyClass()
-        But for the FIXED_VALUE's, this code is used to declare:
-            var2 = 5 ("5" is read from declarationCode).
+        Limit the nesting level of the captured calls. Annotated functions called deeper than
+        maxCaptureDepth just call the original function: neither the call nor its arguments reach AnnotatorThread.
+        It must be set before starting the annotations.
         '''
-        #It has not been declared before
-        assert not self.pythonIdToLanguageObjectId_.has_key( pythonId )
+        assert maxCaptureDepth >= 0
+        self.maxCaptureDepth_ = maxCaptureDepth
 
-        DT = LanguageObject.DECLARATION_TYPES
-        #Default values
-        declarationType = DT.FIXED_VALUE
-        objToDump = None
-        if objType == LanguageType.MODULE:
-            objToDump = obj.__name__
-        elif objType == LanguageType.CLASS:
-            moduleName = obj.__module__
-            modulePrefix = "" if moduleName == PythonConstants.BUILTINS_MODULE_NAME else moduleName + "." 
-            objToDump = modulePrefix + obj.__name__
-        else:
-            assert objType == LanguageType.INSTANCE
-            if isCallee:
-                #We always annotate __main__ function
-                declarationType = DT.CONSTRUCTOR
-            else:
-                objToDump = obj
-        #TODO GERVA: Object rules configurables
-        #Argument. We have two options
-        # If it's an object to annotate, it should have been annotated before
-        # Otherwise, try (in this precedence order):
-        # * JSON (Fixed value)
-        # * Dummy object
-        ok = True
-        try:
-            declarationCode = asJsonString(objToDump)
-        except:
-            declarationType = DT.DUMMY
-            declarationCode = asJsonString('Dummy')
-        return declarationType, declarationCode
-    
     ##
-    # @param self The AnnotatorThread instance.
-    # @param obj Python "object" (module, class, or instance).
-    # @param objType Obj's object type returned by type() function.
-    # @return The obj's parent, or None if it's a module/
-    def _getParent(self, obj, objType):
+    # @param self The Annotator instance.
+    # @param capturePolicy One of CapturePolicy values (default: CapturePolicy.REFERENCE).
+    def setCapturePolicy(self, capturePolicy):
         '''
-        Python objects do have a hierarchical structure:
-            Module 
-              |
-            Class
-              |
-            Instance
-        This function returns the parent for any object (None for the "root" modules).
+        Choose how the arguments and returned objects are captured (see CapturePolicy).
+        It must be set before starting the annotations.
         '''
-        assert self._hasParent(obj, objType)
-        if objType == LanguageType.CLASS:
-            return sys.modules[obj.__module__]
-        return obj.__class__
+        assert capturePolicy in (CapturePolicy.REFERENCE, CapturePolicy.SNAPSHOT)
+        self.capturePolicy_ = capturePolicy
 
     ##
-    # @param self The AnnotatorThread instance.
-    # @param obj Python "object" (module, class, or instance).
-    # @param objType Obj's object type returned by type() function.
-    # @return True if the object has parent, i.e.: it's not a module (see documentation for _getParent()).
-    def _hasParent(self, obj, objType):
+    # @param self The Annotator instance.
+    # @param fp File object for the streaming database.
+    # @param flushInterval Maximum seconds a record may stay in the write buffer. If None, CallGraphStreamWriter's default.
+    def setStreamDumpFile(self, fp, flushInterval = None):
         '''
-        Return whether or not the object has parent, i.e.: it's not a module.
+        Write the call graph to a streaming database (see CallGraphStreamWriter) while the program runs,
+        instead of keeping the function calls in memory until dumpProgramExecution().
+        It must be set before starting the annotations. The caller closes the file after finishing them.
         '''
-        return objType != LanguageType.MODULE
-    
-class Annotator:
-    '''
-    Interface for the calling programmer code to annotate the functions, i.e.:
-    replace them with a similar code that stores the function call in a container,
-    to persist it later in a database. 
-    It may work in a multi-threaded environment, because it calls AnnotatorThread class,
-    that uses Python threading queues.
-    It implements the "with" statement interface (RAII pattern in Python).
-    '''
-    activeAnnotators = False
+        if flushInterval is None:
+            flushInterval = CallGraphStreamWriter.DEFAULT_FLUSH_INTERVAL
+        self.annotatorThread_.setStreamWriter(CallGraphStreamWriter(self.programExecution_, fp, flushInterval))
+
     ##
-    # @param self The Annotator instance to construct.
-    def __init__(self):
+    # @param self The Annotator instance.
+    # @param fp File object connected to the collector process: a Unix domain socket (see event_records.connectToCollector()), or a pipe.
+    def setCollectorStream(self, fp):
         '''
-        Constructor.
+        Out-of-process capture: encode the events as compact records (see event_records), and write them to a collector process
+        (see collector), that builds the call graph and dumps it. This process doesn't keep the call graph, so
+        dumpProgramExecution() is the collector's job, and dumpProgramExecutionNow() asks the collector to dump it
+        (it returns as soon as the request is written).
+        It must be set before starting the annotations. The caller closes the file after finishing them.
         '''
-        self.oldFuncs = {}
-        self.funcsToAnnotate = []
-        self.callGraphQueue_ = Queue()
-        self.programExecution_ = None
-        self.annotatorThread_ = None
+        self.annotatorThread_.setEventRecordWriter(EventRecordWriter(fp))
 
     ##
     # @param self The Annotator instance.
-    # @param obj Python "object" (module, class, or instance).
-    # @param *methodNames If None, annotate all obj's methods, else only the ones contained in *methodNames.
-    def annotate(self, obj, *methodNames):
+    # @param flightRecorderSize Number of root calls to keep (see FlightRecorder). 0 (default) keeps all of them.
+    def setFlightRecorderSize(self, flightRecorderSize):
         '''
-            Annotate an obj's methods (with an optional methodNames filter).
+        Flight recorder mode: keep only the last flightRecorderSize root calls, their nested calls,
+        and the objects they refer to. It bounds the memory of an always-on capture.
+        It must be set before starting the annotations.
         '''
-        if methodNames:
-            for methodName in methodNames:
-                self._annotateMethod(obj,methodName)
-        else:
-            objDict = inspect.getmembers(obj,inspect.isroutine)
-            for name, _ in objDict:
-                self._annotateMethod(obj,name)
+        assert flightRecorderSize >= 0
+        self.annotatorThread_.setFlightRecorder(FlightRecorder(flightRecorderSize) if flightRecorderSize else None)
 
     ##
     # @param self The Annotator instance.
-    def __enter__(self):
+    # @param captureLimits CaptureLimits, or None (default) to capture every argument and returned object as it is.
+    def setCaptureLimits(self, captureLimits):
         '''
-        Entry point for the "with" sentence. It starts the annotations.
+        Bound the size of the captured arguments and returned objects: the strings and containers over the limits
+        are declared as summaries, that the generated code replaces with Dummy's (see CaptureLimits).
+        It must be set before starting the annotations.
         '''
-        self.startAnnotations()
+        self.annotatorThread_.setCaptureLimits(captureLimits)
 
     ##
     # @param self The Annotator instance.
-    def startAnnotations(self):
+    # @param queueSize Maximum number of items in the capture queue. 0 (default) means no limit.
+    # @param overflowPolicy What to do when the queue is full (see OverflowPolicy).
+    # @param overflowSampleRate For OverflowPolicy.SAMPLE, capture one of every overflowSampleRate root calls while the queue is full.
+    def setQueueBound(self, queueSize, overflowPolicy = OverflowPolicy.BLOCK, overflowSampleRate = OverflowPolicy.DEFAULT_SAMPLE_RATE):
         '''
-        Start an annotations process. Replace the functions stored in self.funcsToAnnotate
-        with a new function returned by annotatedFunction() method.
-        Use the Python native getattr() and setattr() methods to get and replace
-        the functions for an object.
+        Bound the capture queue, so a program that calls annotated functions faster than AnnotatorThread
+        can process them doesn't use more and more memory. Items are events (or event batches, see setEventBufferSize()).
+        It must be set before starting the annotations.
         '''
-        if Annotator.activeAnnotators:
-            #Limit instances number to 1
-            raise Exception('Only one annotator instance allowed.') 
-        Annotator.activeAnnotators = True
-        try:
-            #Functions
-            for objAndFuncName in self.funcsToAnnotate:
-                obj, funcName = objAndFuncName
-                fun = getattr( obj, funcName )
-                theLanguageType = _getLanguageType(obj)
-                methodType = _getInspectMethodType( obj, funcName )
-                
-                newFun = annotatedFunction(self, obj, fun)
-                if methodType == 'static method':
-                    newFun = staticmethod( newFun )
-                elif methodType == 'class method':
-                    newFun = classmethod( newFun )
-                elif methodType == 'method' and theLanguageType == LanguageType.INSTANCE:
-                    newFun = types.MethodType(newFun, obj, obj.__class__)
-                setattr(obj, funcName, newFun )
-                #Backup old and new functions, in order to restore them later
-                self.oldFuncs[objAndFuncName] = (fun, methodType)
-            return self
-        except Exception, e:
-            self.restoreFunctions()
-            raise e
+        assert queueSize >= 0
+        assert overflowPolicy in (OverflowPolicy.BLOCK, OverflowPolicy.DROP, OverflowPolicy.SAMPLE)
+        assert overflowSampleRate > 0
+        self.callGraphQueue_.maxsize = queueSize
+        self.overflowPolicy_ = overflowPolicy
+        self.overflowSampleRate_ = overflowSampleRate
 
     ##
     # @param self The Annotator instance.
-    def __exit__(self, _, __, ___):
+    # @param sampler A sampling.Sampler for the functions not annotated with a sampler (see annotate()), or None to capture all of their calls.
+    def setDefaultSampler(self, sampler):
         '''
-        Exit point for the "with" sentence. It finishes the annotations.
+        Choose which root calls are captured, for the functions annotated without a sampler.
+        Every function gets its own copy of the sampler (see sampling.Sampler.clone()).
+        It must be set before starting the annotations.
         '''
-        self.finishAnnotations()
+        self.defaultSampler_ = sampler
 
     ##
     # @param self The Annotator instance.
-    def finishAnnotations(self):
+    # @param overheadBudget Maximum fraction of the wall time (e.g.: 0.05) spent in the annotation code. 0 disables the budget.
+    # @param demotionSampleRate For Demotion.SAMPLED, capture one of every demotionSampleRate calls.
+    # @param checkInterval Seconds between budget checks.
+    def setOverheadBudget(self, overheadBudget, demotionSampleRate = 100, checkInterval = 1.0):
         '''
-        Finish the annotations process, by sending an "End Process" message to AnnotatorThread.
-        Finally, restore the original functions.
+        Keep the capture overhead under a budget, demoting the hottest functions when it goes over it (see OverheadMonitor).
+        It must be set before starting the annotations.
         '''
-        try:
-            Annotator.activeAnnotators = False
-            item = {}
-            item[AnnotatorThread.QueueInfo.MESSAGE_TYPE] = AnnotatorThread.QueueInfo.MessageTypes.END_ANNOTATION
-            self.callGraphQueue_.put( item )
+        self.overheadMonitor_ = OverheadMonitor(overheadBudget, demotionSampleRate, checkInterval) if overheadBudget else None
 
-            #Wait for the thread to process all messages
-            self.annotatorThread_.join()
-            
+    ##
+    # @param self The Annotator instance.
+    def _setDemotionsMetadata(self):
+        '''
+        Record the functions demoted so far in the ProgramExecution metadata (see ProgramExecution.Metadata.DEMOTED_FUNCTIONS).
+        '''
+        if self.overheadMonitor_ is not None:
+            self.programExecution_.setMetadata(ProgramExecution.Metadata.DEMOTED_FUNCTIONS, self.overheadMonitor_.getDemotions())
+
+    ##
+    # @param self The Annotator instance.
+    # @param sampler The sampling.Sampler for the function being called, or None.
+    # @param args Arguments list for the function being called.
+    # @param kwargs Named arguments for the function being called.
+    # @param argumentsStart 1 if args[0] is the callee (not a real argument), else 0.
+    # @return True if the annotated function being called right now must not be captured.
+    def mustSkipCapture(self, sampler = None, args = (), kwargs = {}, argumentsStart = 0):
+        '''
+        Tell whether an annotated function being called right now must skip the capture, because:
+            * it's called by a function that skipped the capture, or
+            * it's deeper than the maximum capture depth (see setMaxCaptureDepth()), or
+            * it's a root call not chosen by its sampler (see annotate()), or
+            * it's a root call, and it's dropped because the capture queue is full (see setQueueBound()), or
+            * it's called outside a session, and they're not captured (see setCaptureOutsideSessions()).
+        '''
+        if not self.captureOutsideSessions_:
+            return True
+        #A thread without a ThreadEventBuffer yet is not running a skipped call (see callWithoutCapture())
+        threadEventBuffer = getattr(self.threadLocals_, 'eventBuffer', None)
+        if threadEventBuffer is not None and threadEventBuffer.skippedDepth_:
+            return True
+        if sampler is None and not self.maxCaptureDepth_ and self.overflowPolicy_ == OverflowPolicy.BLOCK:
+            return False
+        if threadEventBuffer is None:
+            threadEventBuffer = self._getThreadEventBuffer()
+        if self.maxCaptureDepth_ and threadEventBuffer.depth_ >= self.maxCaptureDepth_:
+            return True
+        if threadEventBuffer.depth_ == 0 and sampler is not None and not sampler.mustSample(args[argumentsStart:], kwargs):
+            return True
+        if threadEventBuffer.depth_ == 0 and self.overflowPolicy_ != OverflowPolicy.BLOCK and self.callGraphQueue_.full():
+            threadEventBuffer.overflowRootCalls_ += 1
+            if self.overflowPolicy_ == OverflowPolicy.DROP or threadEventBuffer.overflowRootCalls_ % self.overflowSampleRate_:
+                threadEventBuffer.droppedRootCalls_ += 1
+                return True
+        return False
+
+    ##
+    # @param self The Annotator instance.
+    # @param f Original function.
+    # @param args Arguments list.
+    # @param kwargs Named arguments.
+    # @return What f returns.
+    def callWithoutCapture(self, f, args, kwargs):
+        '''
+        Call an annotated function skipping the capture (see mustSkipCapture()). The annotated functions it calls skip it too.
+        '''
+        threadEventBuffer = self._getThreadEventBuffer()
+        threadEventBuffer.skippedDepth_ += 1
+        try:
+            return f( *args, **kwargs )
         finally:
-            self.restoreFunctions()
+            threadEventBuffer.skippedDepth_ -= 1
 
     ##
     # @param self The Annotator instance.
-    # @param annotationId Annotation id: it'll be necessary later in the "end function" message, to know which function is ending. 
-    # @param obj Python "object" (it may be a module, class, or instance) whose functions we're annotating
-    # @param funcName Function name 
-    # @param *args Arguments list.
-    # @param **kwargs Named arguments.
-    def functionStarted(self, annotationId, obj, funcName, *args, **kwargs):
+    # @param threadEventBuffer A ThreadEventBuffer.
+    def _handEvents(self, threadEventBuffer):
         '''
-        Send a "Function started" message to the queue, to start this function annotations.
+        Hand all the events buffered by a thread to AnnotatorThread, in just one message.
         '''
-        item = {}
-        item[AnnotatorThread.QueueInfo.MESSAGE_TYPE] = AnnotatorThread.QueueInfo.MessageTypes.ENTER_FUNCTION
-        item[AnnotatorThread.QueueInfo.INDEX_OBJ] = obj
-        item[AnnotatorThread.QueueInfo.INDEX_ANNOTATION_ID] = annotationId
-        item[AnnotatorThread.QueueInfo.INDEX_FUNC_NAME] = funcName
-        item[AnnotatorThread.QueueInfo.INDEX_ARGS] = args
-        item[AnnotatorThread.QueueInfo.INDEX_KARGS] = kwargs
-        self.callGraphQueue_.put( item )
+        events = threadEventBuffer.takeEvents()
+        if events:
+            self.callGraphQueue_.put( (_EVENTS_BATCH, events) )
 
     ##
     # @param self The Annotator instance.
-    # @param annotationId Annotation id: to identify the function.
-    # @param threwException The function has raised an exception.
-    # @param returnedObject If threwException is False, the object returned by the function. If True, the exception being raised.
-    def functionEnded(self, annotationId, threwException, returnedObject):
+    def _resetCaptureState(self):
         '''
-        Send a "Function ended" message to the queue. Pass also the "returned object" (or exception) information.
+        Forget the per-thread capture state and options from previous annotations.
         '''
-        #TODO GERVA: in multi-threading, use thread id, obj and funcName to identify which function really ended
-        item = {}
-        item[AnnotatorThread.QueueInfo.MESSAGE_TYPE] = AnnotatorThread.QueueInfo.MessageTypes.EXIT_FUNCTION
-        item[AnnotatorThread.QueueInfo.INDEX_ANNOTATION_ID] = annotationId
-        item[AnnotatorThread.QueueInfo.INDEX_THREW] = threwException
-        item[AnnotatorThread.QueueInfo.INDEX_RETURNED_OBJ] = returnedObject
-        self.callGraphQueue_.put( item )
+        self.threadLocals_ = threading.local()
+        #[ (weak reference to a thread, its ThreadEventBuffer) ], see _getThreadEventBuffer()
+        self.threadEventBuffers_ = []
+        self.threadEventBuffersLock_ = threading.Lock()
+        #Root calls dropped by the threads whose ThreadEventBuffer has been unregistered
+        self.endedThreadsDroppedRootCalls_ = 0
+        self.eventBufferSize_ = 0
+        self.maxCaptureDepth_ = 0
+        self.capturePolicy_ = CapturePolicy.REFERENCE
+        self.overflowPolicy_ = OverflowPolicy.BLOCK
+        self.overflowSampleRate_ = OverflowPolicy.DEFAULT_SAMPLE_RATE
+        self.defaultSampler_ = None
+        self.overheadMonitor_ = None
+        self.captureOnFailure_ = False
+        #Current thread's session (see startSession())
+        self.sessionLocals_ = threading.local()
+        #_SessionsThread for the sessions, started by the first one
+        self.sessionsThread_ = None
+        self.sessionsThreadLock_ = threading.Lock()
+        self.captureOutsideSessions_ = True
+        self.captureEngine_ = CaptureEngine.WRAPPERS
+        self.childDumpFileName_ = None
+        self.preserveOldChildDumpFiles_ = True
+        #Per-call timing clocks: no timing if wallClock_ is None (see setCallTiming())
+        self.wallClock_ = None
+        self.cpuClock_ = None
+        self.objectEncoders_ = ObjectEncoders()
 
     ##
     # @param self The Annotator instance.
@@ -579,18 +3022,32 @@ class Annotator:
         '''
         self.oldFuncs = {}
         self.funcsToAnnotate = []
+        self.funcSamplers_ = {}
+        self.profiledCode_ = {}
+        self.annotationsStarted_ = False
         self.callGraphQueue_ = Queue()
+        self.processId_ = os.getpid()
+        self.parentProcessId_ = None
+        self._resetCaptureState()
         self.programExecution_ = ProgramExecution( ProgramExecution.Languages.PYTHON )
         self.annotatorThread_ = AnnotatorThread(self.programExecution_, self.callGraphQueue_)
+        self.annotatorThread_.setObjectEncoders(self.objectEncoders_)
         self.annotatorThread_.start()
 
     ##
     # @param self The Annotator instance.  
     def restoreFunctions(self):
         '''
-        After the annotations process has completed, restore the original functions.
+        After the annotations process has completed, restore the original functions (or remove the profile function).
         '''
+        if self.profiledCode_:
+            sys.setprofile(None)
+            threading.setprofile(None)
+            self.profiledCode_ = {}
         for objAndFuncName in self.funcsToAnnotate:
+            if objAndFuncName not in self.oldFuncs:
+                #Not replaced (see CaptureEngine.PROFILER)
+                continue
             obj, funcName = objAndFuncName
             oldFun, methodType = self.oldFuncs[objAndFuncName]
             #Restore old function
@@ -599,6 +3056,9 @@ class Annotator:
                     #Otherwise, it'll remain unbouned, and get this annoying message:
                     #"TypeError: unbound method newFunction() must be called with ... instance as first argument (got nothing instead)"
                     oldFun = staticmethod( oldFun )
+                elif methodType == 'class method' and inspect.isclass(obj):
+                    #getattr() returned it bound to the class: it must be a class method again, or it'll look like a plain method
+                    oldFun = classmethod( oldFun.im_func )
 
                 setattr(obj, funcName, oldFun )
             except Exception, e:
@@ -618,17 +3078,44 @@ class Annotator:
     # @param self The Annotator instance.
     # @param dumpFileName File where the call graph database will be dumped.
     # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
-    def dumpProgramExecution(self, dumpFileName, preserveOldDumpFiles):
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def dumpProgramExecutionNow(self, dumpFileName, preserveOldDumpFiles, prettyPrint = False):
+        '''
+        Serialize the call graph captured so far (see AnnotatorThread._dumpCurrentProgramExecution()), without finishing the annotations.
+        It waits until AnnotatorThread processes the events already sent to it, and writes the database.
+        A child process writes its shard (see setChildProcessesDumpFile()).
+        '''
+        self._checkProcess()
+        if self.parentProcessId_ is not None:
+            dumpFileName = file_utils.getShardDumpFileName(dumpFileName, self.processId_)
+        if preserveOldDumpFiles:
+            dumpFileName = file_utils.getUniqueDumpFileName(dumpFileName)
+        #This thread events must be included
+        self._handEvents(self._getThreadEventBuffer())
+        self._setDemotionsMetadata()
+        doneEvent = threading.Event()
+        self.callGraphQueue_.put( (_DUMP, dumpFileName, doneEvent, prettyPrint) )
+        doneEvent.wait()
+
+    ##
+    # @param self The Annotator instance.
+    # @param dumpFileName File where the call graph database will be dumped.
+    # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def dumpProgramExecution(self, dumpFileName, preserveOldDumpFiles, prettyPrint = False):
         '''
         Serialize the call graph into a database (Json file indicated in "dumpFileName" parameter).
+        A child process writes its shard (see setChildProcessesDumpFile()).
         '''
         aSerializer = CallGraphSerializer()
+        if self.parentProcessId_ is not None:
+            dumpFileName = file_utils.getShardDumpFileName(dumpFileName, self.processId_)
         #Get a valid file path, to avoid overwriting:
         #This allows having a number of different executions for a given set of annotations
         if preserveOldDumpFiles:
             dumpFileName = file_utils.getUniqueDumpFileName(dumpFileName)
         with open(dumpFileName, 'w') as jsonFileOut:
-            aSerializer.dump(self.programExecution_, jsonFileOut)
+            aSerializer.dump(self.programExecution_, jsonFileOut, prettyPrint)
 
 class Annotation:
     '''
@@ -647,6 +3134,10 @@ class Annotation:
         self.threwException_ = False
         self.returnedObject_ = None
         self.functionCall_ = None
+        self.totalTime_ = None
+        self.cpuTime_ = None
+        #The thread's ThreadEventBuffer, set when the function starts: it's looked up once per call
+        self.threadEventBuffer_ = None
 
     ##
     # @param self The Annotation instance.
@@ -668,6 +3159,17 @@ class Annotation:
         self.threwException_ = threwException
         self.returnedObject_ = returnedObject
 
+    ##
+    # @param self The Annotation instance.
+    # @param totalTime Wall time taken by the function.
+    # @param cpuTime Thread CPU time taken by the function, or None if it's not measured.
+    def setFunctionTimes(self, totalTime, cpuTime):
+        '''
+        Set the times taken by the function (see Annotator.setCallTiming()).
+        '''
+        self.totalTime_ = totalTime
+        self.cpuTime_ = cpuTime
+
     ##
     # @param self The ProgramExecutionDumper instance.
     # @param type Exception type, if an exception has been raised.
@@ -678,54 +3180,84 @@ class Annotation:
         Exit point for the "with" sentence. It tells the annotator instance
         that the function has just ended.
         '''    
-        self.annotator_.functionEnded(id(self), self.threwException_, self.returnedObject_)
+        self.annotator_.functionEnded(id(self), self.threwException_, self.returnedObject_, self.totalTime_, self.cpuTime_, self.threadEventBuffer_)
 
 ##
 # @param theAnnotator Annotator instance that will handle the annotations.
 # @param annotatedObj Python "object" (it may be a module, class, or instance) whose functions we're annotating.
 # @param f Function to be annotated.
-def annotatedFunction(theAnnotator, annotatedObj, f):
+# @param callSite CallSiteDescriptor for 'f'. If None, it's resolved here.
+# @param sampler sampling.Sampler that chooses which root calls to 'f' are captured. If None, all of them.
+# @param functionOverhead FunctionOverhead for 'f', if there's an overhead budget (see OverheadMonitor), else None.
+def annotatedFunction(theAnnotator, annotatedObj, f, callSite = None, sampler = None, functionOverhead = None):
     '''
     THE MOST IMPORTANT FUNCTION: for any given function 'f', it returns an equivalent
     function that calls the original, but it also stores this call in the call graph,
     to later allow its dumping in a database.
+    All the reflection is done here, once: the returned function only reads the precomputed rules.
     '''
+    if callSite is None:
+        callSite = _createCallSiteDescriptor(annotatedObj, f.__name__, f)
+    calleeIsFirstArg = callSite.calleeIsFirstArg()
+    skipFirstArg = callSite.skipFirstArg()
+    #The callee (or class) is not an argument for the sampler
+    argumentsStart = 1 if calleeIsFirstArg or skipFirstArg else 0
     ##
     # @param *args Arguments list for the original 'f' function, redirected to this replacement method.
     # @param **kwargs Named arguments for the original 'f' function, redirected to this replacement method.
     def newFunction( *args, **kwargs ):
         '''
         KEY FUNCTION: it replaces the original 'f' function. It calls it, but also
-        annotates it in "theAnnotator".
+        annotates it in "theAnnotator" (or in the current thread's session, see Annotator.startSession()).
         '''
-        ann = Annotation( theAnnotator )
-        with ann:
-            callee = annotatedObj
-            theLanguageType = _getLanguageType(annotatedObj)
-            inspectMethodType = _getInspectMethodType(annotatedObj, f.__name__)
-            
-            # Special case: annotating a class, if it's not a class or static method:
-            # Use self (1st argument) as the callee
-            if theLanguageType == LanguageType.CLASS and not(inspectMethodType == 'class method' or inspectMethodType == 'static method'):
-                callee = args[0]
+        annotator = theAnnotator.getCurrentSession()
+        if functionOverhead is not None:
+            if functionOverhead.mustSkip():
+                if skipFirstArg:
+                    args = args[1:]
+                return annotator.callWithoutCapture( f, args, kwargs )
+            startTime = default_timer()
+        if annotator.mustSkipCapture(sampler, args, kwargs, argumentsStart):
+            if skipFirstArg:
+                args = args[1:]
+            return annotator.callWithoutCapture( f, args, kwargs )
+        ann = Annotation( annotator )
+        try:
+            with ann:
+                callee = args[0] if calleeIsFirstArg else annotatedObj
 
-            theAnnotator.functionStarted( id(ann), callee, f.__name__, *args, **kwargs )
-            
-            #Skip extra first arg (cls or self) before running
-            if (inspectMethodType == 'class method') or (theLanguageType == LanguageType.INSTANCE and inspectMethodType == 'method'):
-                args = tuple( list(args)[1:] )
+                ann.threadEventBuffer_ = annotator.functionStarted( id(ann), callee, callSite, *args, **kwargs )
+                
+                if skipFirstArg:
+                    args = args[1:]
 
-            threwException = False
-            ret = None
-            try:
-                ret = f( *args, **kwargs )
-            except Exception, e:
-                threwException = True
-                ret = e
-            ann.setFunctionReturnedInfo(threwException, ret)
-            if threwException:
-                raise ret
-            return ret
+                threwException = False
+                ret = None
+                if functionOverhead is not None:
+                    fStartTime = default_timer()
+                wallClock = annotator.wallClock_
+                if wallClock is not None:
+                    cpuClock = annotator.cpuClock_
+                    if cpuClock is not None:
+                        cpuStartTime = cpuClock()
+                    wallStartTime = wallClock()
+                try:
+                    ret = f( *args, **kwargs )
+                except Exception, e:
+                    threwException = True
+                    ret = e
+                if wallClock is not None:
+                    ann.setFunctionTimes(wallClock() - wallStartTime, cpuClock() - cpuStartTime if cpuClock is not None else None)
+                if functionOverhead is not None:
+                    #The original function time is not overhead
+                    startTime += default_timer() - fStartTime
+                ann.setFunctionReturnedInfo(threwException, ret)
+                if threwException:
+                    raise ret
+                return ret
+        finally:
+            if functionOverhead is not None:
+                functionOverhead.addOverhead(default_timer() - startTime)
     return newFunction
 
 annotatorInstance_ = Annotator()
@@ -738,6 +3270,60 @@ def annotatorInstance():
     '''
     return annotatorInstance_
 
+class CaptureSession:
+    '''
+    RAII idiom implemented with the 'with' statement.
+    In the __enter__() point, it starts a capture session for the current thread (see Annotator.startSession()),
+    and in the __exit__(), it finishes it, and dumps the session's calls in a database.
+    The annotator instance must have started the annotations (e.g.: with a ProgramExecutionDumper around the server loop).
+    Sessions running at the same time should use different dump file names: a unique name is chosen when
+    the session ends (see preserveOldDumpFiles), but another session may choose the same one meanwhile.
+    '''
+    ##
+    # @param self The CaptureSession instance to construct.
+    # @param dumpFileName File where the session's call graph database will be dumped. If None, it's not dumped (see getProgramExecution()).
+    # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def __init__(self, dumpFileName = None, preserveOldDumpFiles = True, prettyPrint = False):
+        '''
+        Constructor.
+        '''
+        self.dumpFileName_ = dumpFileName
+        self.preserveOldDumpFiles_ = preserveOldDumpFiles
+        self.prettyPrint_ = prettyPrint
+        self.session_ = None
+
+    ##
+    # @param self The CaptureSession instance.
+    # @return The ProgramExecution where the session's calls are captured.
+    def getProgramExecution(self):
+        '''
+        Get the ProgramExecution where the session's calls are captured (complete after the "with" sentence).
+        '''
+        return self.session_.getProgramExecution()
+
+    ##
+    # @param self The CaptureSession instance.
+    def __enter__(self):
+        '''
+        Entry point for the "with" sentence. It starts the session.
+        '''
+        self.session_ = annotatorInstance().startSession()
+        return self
+
+    ##
+    # @param self The CaptureSession instance.
+    # @param type Exception type, if an exception has been raised.
+    # @param value Exception value, if an exception has been raised.
+    # @param tb Traceback, if an exception has been raised.
+    def __exit__(self, type, value, tb):
+        '''
+        Exit point for the "with" sentence. It finishes the session, and dumps its call graph in a database.
+        '''
+        annotatorInstance().finishSession(self.session_)
+        if self.dumpFileName_ is not None:
+            self.session_.dumpProgramExecution(self.dumpFileName_, self.preserveOldDumpFiles_, self.prettyPrint_)
+
 class ProgramExecutionDumper:
     '''
     RAII idiom implemented with the 'with' statement.
@@ -748,12 +3334,50 @@ class ProgramExecutionDumper:
     # @param self The ProgramExecutionDumper instance to construct.
     # @param dumpFileName File where the call graph database will be dumped.
     # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
-    def __init__(self, dumpFileName, preserveOldDumpFiles = True):
+    # @param eventBufferSize If not None, per-thread event buffers size (see Annotator.setEventBufferSize()).
+    # @param maxCaptureDepth If not None, maximum nesting level of the captured calls (see Annotator.setMaxCaptureDepth()).
+    # @param streaming If True, the database is written while the program runs (see Annotator.setStreamDumpFile()), instead of at the end.
+    # @param flightRecorderSize If not None, number of root calls to keep (see Annotator.setFlightRecorderSize()).
+    # @param capturePolicy If not None, how arguments and returned objects are captured (see Annotator.setCapturePolicy()).
+    # @param queueSize If not None, maximum number of items in the capture queue (see Annotator.setQueueBound()).
+    # @param overflowPolicy What to do when the capture queue is full (see OverflowPolicy).
+    # @param sampler If not None, sampling.Sampler for the functions annotated without a sampler (see Annotator.setDefaultSampler()).
+    # @param overheadBudget If not None, maximum fraction of the wall time spent in the annotation code (see Annotator.setOverheadBudget()).
+    # @param captureOnFailure If True, only the root calls that raise an exception are captured (see Annotator.setCaptureOnFailure()).
+    # @param captureEngine If not None, how the calls are intercepted (see CaptureEngine).
+    # @param callTiming If not None, what is measured for every captured call (see CallTiming).
+    # @param childProcesses If True, every child process captures its own calls, and dumps them to a shard (see Annotator.setChildProcessesDumpFile()).
+    # @param collectorAddress If not None, Unix domain socket of a collector process, that builds and dumps the call graph (see Annotator.setCollectorStream()).
+    #        dumpFileName is only used by dumpNow(), then: the collector has its own dump file.
+    # @param captureLimits If not None, CaptureLimits for the arguments and returned objects (see Annotator.setCaptureLimits()).
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    #        The streaming database is always compact, and the collector has its own option (see collector.Collector).
+    def __init__(self, dumpFileName, preserveOldDumpFiles = True, eventBufferSize = None, maxCaptureDepth = None, streaming = False, flightRecorderSize = None, capturePolicy = None,
+                 queueSize = None, overflowPolicy = OverflowPolicy.BLOCK, sampler = None, overheadBudget = None, captureOnFailure = False, captureEngine = None,
+                 callTiming = None, childProcesses = False, collectorAddress = None, captureLimits = None, prettyPrint = False):
         '''
         Constructor.
         '''
         self.dumpFileName_ = dumpFileName
         self.preserveOldDumpFiles_ = preserveOldDumpFiles
+        self.eventBufferSize_ = eventBufferSize
+        self.maxCaptureDepth_ = maxCaptureDepth
+        self.streaming_ = streaming
+        self.callTiming_ = callTiming
+        self.childProcesses_ = childProcesses
+        self.collectorAddress_ = collectorAddress
+        #Streaming database or collector connection: it's closed when the annotations finish, and there's nothing else to dump
+        self.outputFile_ = None
+        self.flightRecorderSize_ = flightRecorderSize
+        self.capturePolicy_ = capturePolicy
+        self.queueSize_ = queueSize
+        self.overflowPolicy_ = overflowPolicy
+        self.sampler_ = sampler
+        self.overheadBudget_ = overheadBudget
+        self.captureOnFailure_ = captureOnFailure
+        self.captureEngine_ = captureEngine
+        self.captureLimits_ = captureLimits
+        self.prettyPrint_ = prettyPrint
 
     ##
     # @param self The ProgramExecutionDumper instance.
@@ -761,7 +3385,49 @@ class ProgramExecutionDumper:
         '''
         Entry point for the "with" sentence. It tells the annotator instance to enter the annotation process.
         '''
+        if self.eventBufferSize_ is not None:
+            annotatorInstance().setEventBufferSize(self.eventBufferSize_)
+        if self.maxCaptureDepth_ is not None:
+            annotatorInstance().setMaxCaptureDepth(self.maxCaptureDepth_)
+        if self.flightRecorderSize_ is not None:
+            annotatorInstance().setFlightRecorderSize(self.flightRecorderSize_)
+        if self.capturePolicy_ is not None:
+            annotatorInstance().setCapturePolicy(self.capturePolicy_)
+        if self.queueSize_ is not None:
+            annotatorInstance().setQueueBound(self.queueSize_, self.overflowPolicy_)
+        if self.sampler_ is not None:
+            annotatorInstance().setDefaultSampler(self.sampler_)
+        if self.overheadBudget_ is not None:
+            annotatorInstance().setOverheadBudget(self.overheadBudget_)
+        if self.captureOnFailure_:
+            annotatorInstance().setCaptureOnFailure(True)
+        if self.captureEngine_ is not None:
+            annotatorInstance().setCaptureEngine(self.captureEngine_)
+        if self.callTiming_ is not None:
+            annotatorInstance().setCallTiming(self.callTiming_)
+        if self.captureLimits_ is not None:
+            annotatorInstance().setCaptureLimits(self.captureLimits_)
+        if self.childProcesses_:
+            annotatorInstance().setChildProcessesDumpFile(self.dumpFileName_, self.preserveOldDumpFiles_)
+        if self.streaming_:
+            dumpFileName = self.dumpFileName_
+            if self.preserveOldDumpFiles_:
+                dumpFileName = file_utils.getUniqueDumpFileName(dumpFileName)
+            self.outputFile_ = open(dumpFileName, 'w')
+            annotatorInstance().setStreamDumpFile(self.outputFile_)
+        elif self.collectorAddress_ is not None:
+            self.outputFile_ = connectToCollector(self.collectorAddress_)
+            annotatorInstance().setCollectorStream(self.outputFile_)
         annotatorInstance().__enter__()
+        return self
+
+    ##
+    # @param self The ProgramExecutionDumper instance.
+    def dumpNow(self):
+        '''
+        Dump the call graph captured so far, without leaving the "with" sentence (for instance, when a long-running program detects a failure).
+        '''
+        annotatorInstance().dumpProgramExecutionNow(self.dumpFileName_, self.preserveOldDumpFiles_, self.prettyPrint_)
     
     ##
     # @param self The ProgramExecutionDumper instance.
@@ -773,5 +3439,12 @@ class ProgramExecutionDumper:
         Exit point for the "with" sentence. It tells the annotator instance to exit the annotation process,
         and dumps the call graph in a database.
         '''
+        if self.outputFile_ is not None:
+            try:
+                annotatorInstance().__exit__(type, value, tb)
+            finally:
+                self.outputFile_.close()
+                self.outputFile_ = None
+            return
         annotatorInstance().__exit__(type, value, tb)
-        annotatorInstance().dumpProgramExecution(self.dumpFileName_, self.preserveOldDumpFiles_)
\ No newline at end of file
+        annotatorInstance().dumpProgramExecution(self.dumpFileName_, self.preserveOldDumpFiles_, self.prettyPrint_)
\ No newline at end of file
@@ -95,11 +95,14 @@ class LanguageObject:
             * FIXED_VALUE: there's a fixed string representation for the object. For instance, [4, 5] representation is "[4,5]". 
             * DUMMY: As we don't know how to create the object, use a Dummy class.
             * NULL: Object is None.
+            * SUMMARY: The object was too big to be captured: the declaration code is a description of it
+              (e.g.: "list of 1,000,000 ints, sha1=..."). Like DUMMY, a Dummy class is used.
         '''
         CONSTRUCTOR = 'CONSTRUCTOR'
         FIXED_VALUE = 'FIXED_VALUE'
         DUMMY = 'DUMMY'
         NULL = 'NULL'
+        SUMMARY = 'SUMMARY'
 
     ##
     # @param self The LanguageObject instance to construct.
@@ -252,11 +255,12 @@ class FunctionCall:
     # @param functionName Function name.
     # @param methodType This function's method type (see MethodType for the values).
     # @param argsList List of argument objects (see Argument class).
-    # @param level The function nesting level (it starts with 0, and increases going deep).
+    # @param level The function nesting level in its thread (it starts with 0, and increases going deep).
     # @param returnedObject If threwException is False, the object returned by the function. If True, the exception being raised.
     # @param threwException The function has raised an exception.
     # @param totalTime Time taken by the function (this may be used for profiling).
-    def __init__(self, id, callee, functionName, methodType, argsList, level, returnedObject = None, threwException = False, totalTime = None):
+    # @param threadId Id of the thread that made the call (0 if unknown).
+    def __init__(self, id, callee, functionName, methodType, argsList, level, returnedObject = None, threwException = False, totalTime = None, threadId = 0):
         '''
         Constructor.
         '''
@@ -269,6 +273,10 @@ class FunctionCall:
         self.returnedObject_ = returnedObject
         self.threwException_ = threwException
         self.totalTime_ = totalTime
+        self.threadId_ = threadId
+        #Time not spent in the captured calls it made, and thread CPU time (see setSelfTime() and setCpuTime())
+        self.selfTime_ = None
+        self.cpuTime_ = None
 
     # @param self The FunctionCall instance.
     # @return The unique id to identify this FunctionCall instance.
@@ -316,13 +324,22 @@ class FunctionCall:
 
     ##
     # @param self The FunctionCall instance.
-    # @return The function nesting level (it starts with 0, and increases going deep).
+    # @return The function nesting level in its thread (it starts with 0, and increases going deep).
     def getLevel(self):
         '''
-        Get the function nesting level (it starts with 0, and increases going deep).
+        Get the function nesting level in its thread (it starts with 0, and increases going deep).
         '''
         return self.level_
 
+    ##
+    # @param self The FunctionCall instance.
+    # @return Id of the thread that made the call (0 if unknown).
+    def getThreadId(self):
+        '''
+        Get the id of the thread that made the call (0 if unknown).
+        '''
+        return self.threadId_
+
     ##
     # @param self The FunctionCall instance.
     # @return If no exception has been thrown, the object returned by the function. Else, the exception being raised.
@@ -367,6 +384,51 @@ class FunctionCall:
         Get the time taken by the function (this may be used for profiling).
         '''
         return self.totalTime_
+
+    ##
+    # @param self The FunctionCall instance.
+    # @param totalTime The time taken by the function.
+    def setTotalTime(self, totalTime):
+        '''
+        Set the time taken by the function.
+        '''
+        self.totalTime_ = totalTime
+
+    ##
+    # @param self The FunctionCall instance.
+    # @return The time taken by the function itself, i.e.: its total time minus the total time of the captured calls it made.
+    def getSelfTime(self):
+        '''
+        Get the time taken by the function itself, not by the captured calls it made.
+        '''
+        return self.selfTime_
+
+    ##
+    # @param self The FunctionCall instance.
+    # @param selfTime The time taken by the function itself.
+    def setSelfTime(self, selfTime):
+        '''
+        Set the time taken by the function itself, not by the captured calls it made.
+        '''
+        self.selfTime_ = selfTime
+
+    ##
+    # @param self The FunctionCall instance.
+    # @return The CPU time its thread spent running the function (including the calls it made).
+    def getCpuTime(self):
+        '''
+        Get the CPU time its thread spent running the function.
+        '''
+        return self.cpuTime_
+
+    ##
+    # @param self The FunctionCall instance.
+    # @param cpuTime The CPU time its thread spent running the function.
+    def setCpuTime(self, cpuTime):
+        '''
+        Set the CPU time its thread spent running the function.
+        '''
+        self.cpuTime_ = cpuTime
     
 class DuplicatedLanguageObjectIdException(Exception):
     '''
@@ -396,6 +458,20 @@ class ProgramExecution:
     in the functions.
     '''
     MIN_LEVEL = 0
+    class Metadata:
+        '''
+        Metadata keys: information about the capture itself, not about the program.
+        '''
+        #Root calls not captured because the capture queue was full (see annotator.OverflowPolicy)
+        DROPPED_ROOT_CALLS = 'droppedRootCalls'
+        #Functions demoted to keep the capture overhead under budget (see annotator.OverheadMonitor): their calls are incomplete
+        DEMOTED_FUNCTIONS = 'demotedFunctions'
+        #Process that made the calls, and its parent (see annotator.Annotator.setChildProcessesDumpFile())
+        PROCESS_ID = 'processId'
+        PARENT_PROCESS_ID = 'parentProcessId'
+        #Processes whose call graphs were merged (see process_shards.mergeProgramExecutions()): their metadata, and their new thread ids
+        MERGED_PROCESSES = 'mergedProcesses'
+
     class Languages:
         '''
         Languages supported by "Bug-reproducer Assistant".
@@ -416,6 +492,12 @@ class ProgramExecution:
         self.languageTypes_ = [ LT.NONE, LT.MODULE, LT.CLASS, LT.INSTANCE ]
         self.languageObjects_ = {}
         self.functionCalls_ = []
+        #Thread ids, in order of first call
+        self.threadIds_ = []
+        #{ threadId -> list of its FunctionCall's }
+        self.threadFunctionCalls_ = {}
+        #{ key -> value }, see Metadata
+        self.metadata_ = {}
 
     ##
     # @param self The ProgramExecution instance.
@@ -450,6 +532,15 @@ class ProgramExecution:
         assert parent is None or self.languageObjects_.has_key(parent.getId())
         self.languageObjects_[id] = aLanguageObject
 
+    ##
+    # @param self The ProgramExecution instance.
+    # @param id Id of the LanguageObject to remove from the container.
+    def removeLanguageObject(self, id):
+        '''
+        Remove a LanguageObject from the internal container. No remaining object or call may refer to it.
+        '''
+        del self.languageObjects_[id]
+
     ##
     # @param self The ProgramExecution instance.
     # @return The internal LanguageObject container.
@@ -467,6 +558,11 @@ class ProgramExecution:
         Add a new function call to an internal container.
         '''
         self.functionCalls_.append(aFunctionCall)
+        threadId = aFunctionCall.getThreadId()
+        if not self.threadFunctionCalls_.has_key(threadId):
+            self.threadIds_.append(threadId)
+            self.threadFunctionCalls_[threadId] = []
+        self.threadFunctionCalls_[threadId].append(aFunctionCall)
 
     ##
     # @param self The ProgramExecution instance.
@@ -475,4 +571,42 @@ class ProgramExecution:
         '''
         Get the internal FunctionCall container.
         '''
-        return self.functionCalls_ 
\ No newline at end of file
+        return self.functionCalls_ 
+
+    ##
+    # @param self The ProgramExecution instance.
+    # @return The ids of the threads that made calls, in order of first call.
+    def getThreadIds(self):
+        '''
+        Get the ids of the threads that made calls, in order of first call.
+        '''
+        return self.threadIds_
+
+    ##
+    # @param self The ProgramExecution instance.
+    # @param threadId A thread id (see getThreadIds()).
+    # @return The FunctionCall's made by that thread, in call order.
+    def getThreadFunctionCalls(self, threadId):
+        '''
+        Get the call sequence of a thread. Its FunctionCall levels are relative to that thread only.
+        '''
+        return self.threadFunctionCalls_.get(threadId, [])
+
+    ##
+    # @param self The ProgramExecution instance.
+    # @param key Metadata key (see Metadata).
+    # @param value Metadata value (it must be Json-compliant).
+    def setMetadata(self, key, value):
+        '''
+        Set information about the capture itself (for instance, whether the call graph is complete).
+        '''
+        self.metadata_[key] = value
+
+    ##
+    # @param self The ProgramExecution instance.
+    # @return The metadata dict: { key -> value }.
+    def getMetadata(self):
+        '''
+        Get the information about the capture itself.
+        '''
+        return self.metadata_
\ No newline at end of file
@@ -0,0 +1,222 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Start and stop the capture in a running process, without restarting it: with signals (e.g.: SIGUSR1 and SIGUSR2),
+or with a control file. While the capture is off, the original functions are in place, so there's no overhead.
+'''
+from __future__ import with_statement
+import os
+import signal
+import threading
+
+import annotator
+from import_hook import AnnotationSpec
+from import_hook import AnnotationImportHook
+
+class CaptureController:
+    '''
+    Keeps the annotations configuration, and applies it only while capturing:
+        * startCapture(): annotate the functions (see Annotator.resetForNewAnnotations() and Annotator.startAnnotations()).
+        * stopCapture(): restore them (see Annotator.finishAnnotations()), and dump the call graph (see Annotator.dumpProgramExecution()).
+    They may be called directly, or requested by signals (see installSignalHandlers()) or a control file (see watchControlFile()).
+    The requests are served by a daemon thread: a signal handler may run while its thread is capturing an event,
+    holding the capture queue lock, so it must not capture or dump by itself.
+    '''
+    ##
+    # @param self The CaptureController instance to construct.
+    # @param configuration An AnnotationSpec (see import_hook), or a callback that receives the Annotator, to annotate the functions and set the capture options.
+    # @param dumpFileName File where the call graph database will be dumped, when each capture stops.
+    # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
+    # @param theAnnotator The Annotator. If None, the annotator instance (see annotator.annotatorInstance()).
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def __init__(self, configuration, dumpFileName, preserveOldDumpFiles = True, theAnnotator = None, prettyPrint = False):
+        '''
+        Constructor.
+        '''
+        self.configuration_ = configuration
+        self.dumpFileName_ = dumpFileName
+        self.preserveOldDumpFiles_ = preserveOldDumpFiles
+        self.prettyPrint_ = prettyPrint
+        self.annotator_ = theAnnotator if theAnnotator is not None else annotator.annotatorInstance()
+        self.importHook_ = None
+        self.capturing_ = False
+        #Serializes startCapture() and stopCapture()
+        self.lock_ = threading.Lock()
+        #Requests thread state
+        self.requestedCapture_ = None
+        self.wakeUp_ = threading.Event()
+        self.thread_ = None
+        self.shutdown_ = False
+        self.controlFileName_ = None
+        self.controlFileExisted_ = False
+        self.pollInterval_ = None
+        #{ signal number -> previous handler }
+        self.previousHandlers_ = {}
+
+    ##
+    # @param self The CaptureController instance.
+    # @return True if it's capturing.
+    def isCapturing(self):
+        '''
+        Tell whether it's capturing.
+        '''
+        return self.capturing_
+
+    ##
+    # @param self The CaptureController instance.
+    def startCapture(self):
+        '''
+        Annotate the configured functions and start the capture. It does nothing if it's already capturing.
+        '''
+        with self.lock_:
+            if self.capturing_:
+                return
+            if annotator.Annotator.activeAnnotators:
+                raise Exception('Only one annotator instance allowed.')
+            self.annotator_.resetForNewAnnotations()
+            try:
+                if isinstance(self.configuration_, AnnotationSpec):
+                    #Modules imported while capturing are annotated too
+                    self.importHook_ = AnnotationImportHook(self.configuration_, self.annotator_)
+                    self.importHook_.install()
+                else:
+                    self.configuration_(self.annotator_)
+                self.annotator_.startAnnotations()
+            except:
+                #Don't leave AnnotatorThread running
+                if self.importHook_ is not None:
+                    self.importHook_.uninstall()
+                    self.importHook_ = None
+                self.annotator_.finishAnnotations()
+                raise
+            self.capturing_ = True
+
+    ##
+    # @param self The CaptureController instance.
+    def stopCapture(self):
+        '''
+        Stop the capture, restore the original functions and dump the call graph. It does nothing if it's not capturing.
+        '''
+        with self.lock_:
+            if not self.capturing_:
+                return
+            try:
+                if self.importHook_ is not None:
+                    self.importHook_.uninstall()
+                    self.importHook_ = None
+                self.annotator_.finishAnnotations()
+                self.annotator_.dumpProgramExecution(self.dumpFileName_, self.preserveOldDumpFiles_, self.prettyPrint_)
+            finally:
+                #Once it's off, the dump is complete
+                self.capturing_ = False
+
+    ##
+    # @param self The CaptureController instance.
+    # @param startSignal Signal number that starts the capture.
+    # @param stopSignal Signal number that stops it.
+    def installSignalHandlers(self, startSignal = getattr(signal, 'SIGUSR1', None), stopSignal = getattr(signal, 'SIGUSR2', None)):
+        '''
+        Start the capture when the process receives startSignal, and stop it when it receives stopSignal
+        (by default, SIGUSR1 and SIGUSR2, not available in Windows). It must be called from the main thread.
+        The previous handlers are restored by shutdown().
+        '''
+        assert startSignal is not None and stopSignal is not None
+        self._startThread()
+        for signalNumber, mustCapture in ((startSignal, True), (stopSignal, False)):
+            handler = lambda _, __, mustCapture = mustCapture: self._requestCapture(mustCapture)
+            self.previousHandlers_.setdefault(signalNumber, signal.signal(signalNumber, handler))
+
+    ##
+    # @param self The CaptureController instance.
+    # @param controlFileName File whose existence turns on the capture: it's started when the file is created, and stopped when it's removed.
+    # @param pollInterval Seconds between checks.
+    def watchControlFile(self, controlFileName, pollInterval = 1.0):
+        '''
+        Start the capture when controlFileName is created, and stop it when it's removed (e.g.: 'touch' and 'rm' it).
+        Only the changes count: a file that already exists doesn't start the capture until it's removed and created again.
+        '''
+        assert pollInterval > 0
+        self.controlFileName_ = controlFileName
+        self.controlFileExisted_ = os.path.exists(controlFileName)
+        self.pollInterval_ = pollInterval
+        self._startThread()
+        #The thread may be waiting for a signal, with no timeout
+        self.wakeUp_.set()
+
+    ##
+    # @param self The CaptureController instance.
+    def shutdown(self):
+        '''
+        Stop serving requests, restore the previous signal handlers, and stop the capture (dumping it) if it's capturing.
+        '''
+        for signalNumber, previousHandler in self.previousHandlers_.items():
+            signal.signal(signalNumber, previousHandler)
+        self.previousHandlers_ = {}
+        if self.thread_ is not None:
+            self.shutdown_ = True
+            self.wakeUp_.set()
+            self.thread_.join()
+            self.thread_ = None
+        self.stopCapture()
+
+    ##
+    # @param self The CaptureController instance.
+    # @param mustCapture True to request the capture start, False to request its stop.
+    def _requestCapture(self, mustCapture):
+        '''
+        Request a capture start or stop, to be served by the requests thread. It's safe to call it from a signal handler.
+        '''
+        self.requestedCapture_ = mustCapture
+        self.wakeUp_.set()
+
+    ##
+    # @param self The CaptureController instance.
+    def _startThread(self):
+        '''
+        Start the requests thread, if it's not running yet.
+        '''
+        if self.thread_ is None:
+            self.shutdown_ = False
+            self.thread_ = threading.Thread(target = self._serveRequests, name = 'CaptureController')
+            self.thread_.setDaemon(True)
+            self.thread_.start()
+
+    ##
+    # @param self The CaptureController instance.
+    def _serveRequests(self):
+        '''
+        Requests thread loop: wait for a request (or the next control file check), and start or stop the capture.
+        '''
+        while True:
+            self.wakeUp_.wait(self.pollInterval_)
+            self.wakeUp_.clear()
+            if self.shutdown_:
+                return
+            if self.controlFileName_ is not None:
+                controlFileExists = os.path.exists(self.controlFileName_)
+                if controlFileExists != self.controlFileExisted_:
+                    self.controlFileExisted_ = controlFileExists
+                    self.requestedCapture_ = controlFileExists
+            requestedCapture, self.requestedCapture_ = self.requestedCapture_, None
+            try:
+                if requestedCapture:
+                    self.startCapture()
+                elif requestedCapture is not None:
+                    self.stopCapture()
+            except Exception, e:
+                #Keep serving requests
+                print 'CaptureController exception: ' + str(e)
@@ -0,0 +1,91 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Clocks for the per-call timing (see annotator.Annotator.setCallTiming()):
+    * monotonicTime(): a monotonic wall clock, in seconds.
+    * threadCpuTime(): the running thread's CPU time, in seconds. It's None if the platform doesn't have a thread CPU clock.
+They call clock_gettime() through ctypes, where it's available (Linux and Mac OS X).
+Otherwise, the wall clock falls back to time.time(), which may jump if the system time is changed.
+'''
+import sys
+import time
+import ctypes
+import ctypes.util
+
+class _Timespec(ctypes.Structure):
+    '''
+    The C struct timespec, filled by clock_gettime().
+    '''
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+#clock_gettime() ids: (CLOCK_MONOTONIC, CLOCK_THREAD_CPUTIME_ID)
+_CLOCK_IDS = { 'linux': (1, 3), 'darwin': (6, 16) }
+
+##
+# @return The C clock_gettime() function, or None if it's not available.
+def _getClockGettime():
+    '''
+    Find clock_gettime() in the C library (or, in old Linux versions, in the real-time library).
+    '''
+    for libraryName in ('c', 'rt'):
+        libraryPath = ctypes.util.find_library(libraryName)
+        if libraryPath is None:
+            continue
+        try:
+            #No argtypes: converting the arguments by hand is much faster (c_int and the default int restype are right)
+            return ctypes.CDLL(libraryPath).clock_gettime
+        except (OSError, AttributeError):
+            continue
+    return None
+
+##
+# @param clockGettime The C clock_gettime() function.
+# @param clockId The clock_gettime() id for the clock.
+# @return A function that reads the clock, in seconds, or None if the clock doesn't work.
+def _createClock(clockGettime, clockId):
+    '''
+    Create a Python function for a clock_gettime() clock. Every call fills its own timespec, so it's thread safe
+    (ctypes releases the GIL while clock_gettime() runs).
+    '''
+    ##
+    # @return The clock time, in seconds.
+    def readClock():
+        '''
+        Read the clock.
+        '''
+        timespec = _Timespec()
+        clockGettime(clockId, ctypes.byref(timespec))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    if clockGettime(clockId, ctypes.byref(_Timespec())) != 0:
+        return None
+    return readClock
+
+##
+# @return A tuple (monotonic clock, thread CPU clock): the second one may be None.
+def _createClocks():
+    '''
+    Create the clocks for this platform.
+    '''
+    platform = 'linux' if sys.platform.startswith('linux') else sys.platform
+    clockGettime = _getClockGettime() if _CLOCK_IDS.has_key(platform) else None
+    if clockGettime is None:
+        return time.time, None
+    monotonicClockId, threadCpuClockId = _CLOCK_IDS[platform]
+    return _createClock(clockGettime, monotonicClockId) or time.time, _createClock(clockGettime, threadCpuClockId)
+
+monotonicTime, threadCpuTime = _createClocks()
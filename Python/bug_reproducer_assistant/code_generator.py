@@ -145,6 +145,10 @@ class TokensGenerator:
         Constructor.
         '''
         self.idsToVariableInfo_ = {}
+        #Ids of the instances being declared (the outermost first): a container inside may refer back to them (see addFixUp_())
+        self.instancesBeingDeclared_ = []
+        #{ id of an instance being declared -> code to run after its declaration }
+        self.pendingFixUps_ = {}
         self.indentation_ = ""
         self.initSpaces_ = ""
         self.programExecution_ = aProgramExecution
@@ -209,6 +213,27 @@ class TokensGenerator:
         '''
         self.indentation_ = self.getInitialSpaces() + self.getOneIndentation_() * level
 
+    ##
+    # @param self The TokensGenerator instance.
+    # @param threadId Id of the thread whose calls are generated next.
+    # @param threadsCount Number of threads in the program execution.
+    # @return Code to insert before a thread calls.
+    def threadBegin(self, threadId, threadsCount):
+        '''
+        Return code to insert before a thread calls.
+        '''
+        return ""
+
+    ##
+    # @param self The TokensGenerator instance.
+    # @param demotedFunctions Demotions recorded in the ProgramExecution metadata (see ProgramExecution.Metadata.DEMOTED_FUNCTIONS).
+    # @return Code to insert before the calls, warning that some of them are incomplete.
+    def incompleteCallsWarning(self, demotedFunctions):
+        '''
+        Return code to insert before the calls, warning that the calls to the demoted functions weren't all captured.
+        '''
+        return ""
+
     ##
     # @param self The TokensGenerator instance.
     # @return Initial spaces to insert in the current line.
@@ -269,10 +294,37 @@ class TokensGenerator:
                 assert myLanguageType == LanguageType.INSTANCE
                 varInfo = self._calculateInstanceVariableInfo(aLanguageObject)
                 myType = eval(self.getObjectRepresentation(aLanguageObject.getParent()))
+                #Known before declaring the objects inside it, in case they refer back to it
+                self.idsToVariableInfo_[aLanguageObject.getId()] = varInfo
+                self.instancesBeingDeclared_.append(aLanguageObject.getId())
                 declaration = self._declareInstance(varInfo, myType)
+                self.instancesBeingDeclared_.pop()
+                declaration += self.pendingFixUps_.pop(aLanguageObject.getId(), "")
             self.idsToVariableInfo_[aLanguageObject.getId()] = varInfo
         return declaration
 
+    ##
+    # @param self The TokensGenerator instance.
+    # @param languageObjects The LanguageObject's a declaration code refers to.
+    # @return True if any of them is being declared, i.e.: it's not assigned yet (a back-reference).
+    def isBeingDeclared_(self, *languageObjects):
+        '''
+        Tell whether a container declaration refers to a container being declared (e.g.: a list inside itself).
+        '''
+        return any(lo.getId() in self.instancesBeingDeclared_ for lo in languageObjects)
+
+    ##
+    # @param self The TokensGenerator instance.
+    # @param fixUpCode Code that sets a back-reference (see isBeingDeclared_()).
+    # @param languageObjects The LanguageObject's the code refers to.
+    def addFixUp_(self, fixUpCode, *languageObjects):
+        '''
+        Defer the code that sets a back-reference, until every object it refers to has been declared:
+        it goes right after the declaration of the outermost one being declared.
+        '''
+        outermostId = min([lo.getId() for lo in languageObjects if lo.getId() in self.instancesBeingDeclared_], key = self.instancesBeingDeclared_.index)
+        self.pendingFixUps_[outermostId] = self.pendingFixUps_.get(outermostId, "") + fixUpCode
+
     ##
     # @param self The TokensGenerator instance.
     # @myObj A Python object.
@@ -356,6 +408,11 @@ class TokensGenerator:
             pythonObj = AuxiliarClassForDummy(parentClassStr)
             declarationType = DT.FIXED_VALUE
             useVarNameForRepr = False
+        elif declarationType == DT.SUMMARY:
+            #The Dummy gets the summary, instead of the class
+            pythonObj = AuxiliarClassForDummy(pythonObj)
+            declarationType = DT.FIXED_VALUE
+            useVarNameForRepr = False
         
         return TokensGenerator.VariableInfo(instanceName, declarationType, useVarNameForRepr, pythonObj)
 
@@ -635,6 +692,36 @@ if __name__ == '__main__':
 """ % testCaseName
         return ""
 
+    ##
+    # @param self The PythonTokensGenerator instance.
+    # @param threadId Id of the thread whose calls are generated next.
+    # @param threadsCount Number of threads in the program execution.
+    # @return Code to insert before a thread calls.
+    def threadBegin(self, threadId, threadsCount):
+        '''
+        Return a comment that tells which thread the next calls come from, if there are many threads.
+        '''
+        if threadsCount > 1:
+            return self.getInitialSpaces() + "#Thread " + str(threadId) + "\n"
+        return ""
+
+    ##
+    # @param self The PythonTokensGenerator instance.
+    # @param demotedFunctions Demotions recorded in the ProgramExecution metadata (see ProgramExecution.Metadata.DEMOTED_FUNCTIONS).
+    # @return Code to insert before the calls, warning that some of them are incomplete.
+    def incompleteCallsWarning(self, demotedFunctions):
+        '''
+        Return a comment for every demoted function, telling that its calls (and the calls they made) weren't all captured.
+        '''
+        code = ""
+        for demotion in demotedFunctions:
+            code += self.getInitialSpaces() + "#Incomplete capture: calls to " + demotion['function']
+            if 'sampleRate' in demotion:
+                code += " were sampled (1 of every " + str(demotion['sampleRate']) + ")\n"
+            else:
+                code += " were not captured\n"
+        return code
+
     ##
     # @param self The TokensGenerator instance.
     # @param moduleInfo Module information (see VariableInfo)
@@ -723,10 +810,14 @@ if __name__ == '__main__':
             if objType is types.ListType:
                 declCode = self.indentation_ + instanceInfo.getVarName() + " = ["
                 childrenDeclCode = ""
-                for id in myObj:
+                for index, id in enumerate(myObj):
                     childLo = self.programExecution_.getLanguageObjects()[id]
                     childrenDeclCode += self.declareLanguageObject(childLo)  
                     childDecl = self.getObjectRepresentation(childLo)
+                    if self.isBeingDeclared_(childLo):
+                        #A back-reference: it's set once the child is assigned
+                        self.addFixUp_(self.indentation_ + instanceInfo.getVarName() + "[" + str(index) + "] = " + childDecl + "\n", childLo)
+                        childDecl = "None"
                     declCode += childDecl + ", "
                 if myObj:
                     declCode = declCode[:-2]
@@ -742,7 +833,12 @@ if __name__ == '__main__':
                     childrenDeclCode += self.declareLanguageObject(valueLo)
                     keyDecl = self.getObjectRepresentation(keyLo)
                     valueDecl = self.getObjectRepresentation(valueLo)
-                    declCode += self.indentation_ + instanceInfo.getVarName() + "[" + keyDecl + "] = " + valueDecl + "\n"
+                    itemDeclCode = self.indentation_ + instanceInfo.getVarName() + "[" + keyDecl + "] = " + valueDecl + "\n"
+                    if self.isBeingDeclared_(keyLo, valueLo):
+                        #A back-reference: it's set once the key and the value are assigned
+                        self.addFixUp_(itemDeclCode, keyLo, valueLo)
+                    else:
+                        declCode += itemDeclCode
                 return childrenDeclCode + declCode
             if objType is types.InstanceType:
                 return self.indentation_ + instanceInfo.getVarName() + ' = dummy.Dummy' +  '("' + getClassStringForDummy(myObj) + '")\n'
@@ -1219,24 +1315,31 @@ class TokensGeneratorFactory:
 
 ##
 # @param functionCalls: All the program calls (see call_graph.FunctionCall).
-def _mustUseDummy(functionCalls):
+# @param languageObjects: If not None, { id -> LanguageObject } of a Python program: the containers passed as arguments are searched too.
+def _mustUseDummy(functionCalls, languageObjects = None):
     '''
     Return if "Dummy" module must be used
-    (at least one Dummy instance will be created).
+    (at least one Dummy instance will be created, for a DUMMY or a SUMMARY object).
     '''
-    useDummy = False
-    for aCall in functionCalls:
-        if useDummy:
-            break
-        #Arguments
-        for anArgument in aCall.getArgsList():
-            if useDummy:
-                break
-            argLo = anArgument.getLanguageObject()
-            dt = argLo.getDeclarationType()
-            if dt == LanguageObject.DECLARATION_TYPES.DUMMY:
-                useDummy = True
-    return useDummy
+    DT = LanguageObject.DECLARATION_TYPES
+    toCheck = [anArgument.getLanguageObject() for aCall in functionCalls for anArgument in aCall.getArgsList()]
+    checkedIds = set()
+    while toCheck:
+        lo = toCheck.pop()
+        if lo.getId() in checkedIds:
+            continue
+        checkedIds.add(lo.getId())
+        dt = lo.getDeclarationType()
+        if dt == DT.DUMMY or dt == DT.SUMMARY:
+            return True
+        if languageObjects is not None and dt == DT.FIXED_VALUE and lo.getLanguageType() == LanguageType.INSTANCE:
+            #Python containers: their declaration code has their children ids
+            obj = fromJsonString(lo.getDeclarationCode())
+            if type(obj) is types.ListType:
+                toCheck.extend([languageObjects[childId] for childId in obj])
+            elif type(obj) is types.DictType:
+                toCheck.extend([languageObjects[int(key)] for key in obj.keys()] + [languageObjects[value] for value in obj.values()])
+    return False
 
 class CodeGenerator:
     '''
@@ -1293,7 +1396,8 @@ class CodeGenerator:
         langObjects = self.programExecution_.getLanguageObjects()
         theCalls = self.programExecution_.getFunctionCalls()
         #Search in arguments use of Dummy class, include this module only if necessary
-        useDummy = _mustUseDummy(theCalls)
+        isPython = self.programExecution_.getLanguage() == ProgramExecution.Languages.PYTHON
+        useDummy = _mustUseDummy(theCalls, langObjects if isPython else None)
         if useDummy:
             fp.write(self.tokensGenerator_.declareDummyClass())
             
@@ -1309,98 +1413,105 @@ class CodeGenerator:
 
         fp.write('\n')
         fp.write(self.tokensGenerator_.beginMain())
+        demotedFunctions = self.programExecution_.getMetadata().get(ProgramExecution.Metadata.DEMOTED_FUNCTIONS)
+        if demotedFunctions:
+            fp.write(self.tokensGenerator_.incompleteCallsWarning(demotedFunctions))
         constructedObjectIds = []
         #Annotate calls. If necessary, declare objects
-        previousLevel = -1
-        for aCall in theCalls:
-            level = aCall.getLevel()
-            if searchLevel == CodeGenerator.ALL_LEVELS or searchLevel == level:
-                if level != previousLevel:
-                    self.tokensGenerator_.newFunctionLevel(level)
-                    previousLevel = level
-                callee = aCall.getCallee()
-                calleeId = callee.getId()
-                fp.write(self.tokensGenerator_.declareLanguageObject(callee))
+        #Levels are relative to each thread: generate each thread calls in turn
+        threadIds = self.programExecution_.getThreadIds()
+        for threadId in threadIds:
+            fp.write(self.tokensGenerator_.threadBegin(threadId, len(threadIds)))
+            previousLevel = -1
+            for aCall in self.programExecution_.getThreadFunctionCalls(threadId):
+                level = aCall.getLevel()
+                if searchLevel == CodeGenerator.ALL_LEVELS or searchLevel == level:
+                    if level != previousLevel:
+                        self.tokensGenerator_.newFunctionLevel(level)
+                        previousLevel = level
+                    callee = aCall.getCallee()
+                    calleeId = callee.getId()
+                    fp.write(self.tokensGenerator_.declareLanguageObject(callee))
                 
-                #Check default construction, do it only once
-                if calleeId not in constructedObjectIds:
-                    if self.tokensGenerator_.mustDefaultConstruct(callee, aCall):
-                        fp.write(self.tokensGenerator_.defaultConstruct(callee))
-                        constructedObjectIds.append(calleeId)
+                    #Check default construction, do it only once
+                    if calleeId not in constructedObjectIds:
+                        if self.tokensGenerator_.mustDefaultConstruct(callee, aCall):
+                            fp.write(self.tokensGenerator_.defaultConstruct(callee))
+                            constructedObjectIds.append(calleeId)
                 
-                #function will be printed after checking the arguments, in case an object declaration is needed
-                methodCallStr = self.tokensGenerator_.methodCall(aCall)
+                    #function will be printed after checking the arguments, in case an object declaration is needed
+                    methodCallStr = self.tokensGenerator_.methodCall(aCall)
 
-                #Destructors do not have parameters
-                if aCall.getMethodType() != FunctionCall.MethodType.DESTRUCTOR:
-                    methodCallStr += self.tokensGenerator_.argumentsListBegin()
+                    #Destructors do not have parameters
+                    if aCall.getMethodType() != FunctionCall.MethodType.DESTRUCTOR:
+                        methodCallStr += self.tokensGenerator_.argumentsListBegin()
     
-                    #Arguments
-                    argsListStr = ""
-                    argsList = aCall.getArgsList()
-                    argsCount = len(argsList)
-                    currentArg = 0 
-                    for anArgument in argsList:
-                        #Declare object, if necessary
-                        argObject = anArgument.getLanguageObject()
-                        fp.write(self.tokensGenerator_.declareLanguageObject(argObject))                    #Check skip argument for instance or class methods
-                        if not self.tokensGenerator_.mustSkipArgument(aCall, argObject, currentArg):
-                            argName = anArgument.getName()
-                            if argName:
-                                argsListStr += argName + " = "
-                            argsListStr += self.tokensGenerator_.getObjectRepresentation(argObject)
-                            if currentArg < argsCount - 1:
-                                argsListStr += self.tokensGenerator_.argumentsListSeparator()
-                        currentArg += 1
-                    methodCallStr += argsListStr
-                    methodCallStr += self.tokensGenerator_.argumentsListEnd()
-
-                returnedObject = aCall.getReturnedObject()
-                threwException = aCall.threwException()
+                        #Arguments
+                        argsListStr = ""
+                        argsList = aCall.getArgsList()
+                        argsCount = len(argsList)
+                        currentArg = 0 
+                        for anArgument in argsList:
+                            #Declare object, if necessary
+                            argObject = anArgument.getLanguageObject()
+                            fp.write(self.tokensGenerator_.declareLanguageObject(argObject))                    #Check skip argument for instance or class methods
+                            if not self.tokensGenerator_.mustSkipArgument(aCall, argObject, currentArg):
+                                argName = anArgument.getName()
+                                if argName:
+                                    argsListStr += argName + " = "
+                                argsListStr += self.tokensGenerator_.getObjectRepresentation(argObject)
+                                if currentArg < argsCount - 1:
+                                    argsListStr += self.tokensGenerator_.argumentsListSeparator()
+                            currentArg += 1
+                        methodCallStr += argsListStr
+                        methodCallStr += self.tokensGenerator_.argumentsListEnd()
+
+                    returnedObject = aCall.getReturnedObject()
+                    threwException = aCall.threwException()
                 
-                if returnedObject:
-                    if returnedObject.getDeclarationType() != LanguageObject.DECLARATION_TYPES.CONSTRUCTOR:
-                        if sourceType == GeneratedSourceType.UNIT_TEST:
-                            #Declare returned object, if necessary
-                            fp.write(self.tokensGenerator_.declareLanguageObject(returnedObject))
-                            if threwException:
-                                #For assertRaises to work, it calls its arguments
-                                # -> remove the methodCallStr call, it will be
-                                # done automatically by assertRaises
-                                if methodCallStr.endswith('()'):
-                                #Remove final "()"
-                                    methodCallStr = methodCallStr[:-2]
-                                else:
-                                    #There are arguments
-                                    initialIndex = methodCallStr.rfind('(')
-                                    assert initialIndex >=0 and methodCallStr.endswith(')')
-                                    methodCallStr = methodCallStr[:initialIndex] + ", " + methodCallStr[initialIndex + 1: -1]  
+                    if returnedObject:
+                        if returnedObject.getDeclarationType() != LanguageObject.DECLARATION_TYPES.CONSTRUCTOR:
+                            if sourceType == GeneratedSourceType.UNIT_TEST:
+                                #Declare returned object, if necessary
+                                fp.write(self.tokensGenerator_.declareLanguageObject(returnedObject))
+                                if threwException:
+                                    #For assertRaises to work, it calls its arguments
+                                    # -> remove the methodCallStr call, it will be
+                                    # done automatically by assertRaises
+                                    if methodCallStr.endswith('()'):
+                                    #Remove final "()"
+                                        methodCallStr = methodCallStr[:-2]
+                                    else:
+                                        #There are arguments
+                                        initialIndex = methodCallStr.rfind('(')
+                                        assert initialIndex >=0 and methodCallStr.endswith(')')
+                                        methodCallStr = methodCallStr[:initialIndex] + ", " + methodCallStr[initialIndex + 1: -1]  
         
-                        functionPrefix = self.tokensGenerator_.returnedObjectFunctionPrefix(returnedObject, threwException)
-                        functionPosfix = self.tokensGenerator_.returnedObjectFunctionPosfix(returnedObject, threwException)
+                            functionPrefix = self.tokensGenerator_.returnedObjectFunctionPrefix(returnedObject, threwException)
+                            functionPosfix = self.tokensGenerator_.returnedObjectFunctionPosfix(returnedObject, threwException)
     
+                        else:
+                            self.tokensGenerator_.declareLanguageObject(returnedObject)
+                            functionPrefix = self.tokensGenerator_.getInitialSpaces() + self.tokensGenerator_.getObjectRepresentation(returnedObject) + " = "
+                            functionPosfix = ""
                     else:
-                        self.tokensGenerator_.declareLanguageObject(returnedObject)
-                        functionPrefix = self.tokensGenerator_.getInitialSpaces() + self.tokensGenerator_.getObjectRepresentation(returnedObject) + " = "
+                        functionPrefix = ""
                         functionPosfix = ""
-                else:
-                    functionPrefix = ""
-                    functionPosfix = ""
 
-                if functionPrefix.strip():
-                    methodCallStr = methodCallStr.lstrip()
+                    if functionPrefix.strip():
+                        methodCallStr = methodCallStr.lstrip()
                         
-                #Check if we're in the constructor:
-                if self.tokensGenerator_.methodIsConstructor(callee, aCall):
-                    constructedObjectIds.append(calleeId)
-                    #TODO GERVA: This is just a hack
-                    language = self.programExecution_.getLanguage()
-                    functionPrefix = self.tokensGenerator_.getInitialSpaces() if language == ProgramExecution.Languages.PYTHON else "" 
-                    functionPosfix = ""
-
-                methodCallStr = functionPrefix + methodCallStr + functionPosfix
-                methodCallStr += self.tokensGenerator_.endSentence() + "\n"
+                    #Check if we're in the constructor:
+                    if self.tokensGenerator_.methodIsConstructor(callee, aCall):
+                        constructedObjectIds.append(calleeId)
+                        #TODO GERVA: This is just a hack
+                        language = self.programExecution_.getLanguage()
+                        functionPrefix = self.tokensGenerator_.getInitialSpaces() if language == ProgramExecution.Languages.PYTHON else "" 
+                        functionPosfix = ""
+
+                    methodCallStr = functionPrefix + methodCallStr + functionPosfix
+                    methodCallStr += self.tokensGenerator_.endSentence() + "\n"
                 
-                fp.write(methodCallStr)
+                    fp.write(methodCallStr)
         fp.write(self.tokensGenerator_.endMain())
         fp.write(self.tokensGenerator_.finalFileCode())
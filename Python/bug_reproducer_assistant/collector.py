@@ -0,0 +1,444 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Out-of-process capture: the collector receives the event records written by a captured process (see event_records),
+builds the call graph, and dumps it. Only encoding the events is left to the captured process.
+It may run as a separate process:
+    python collector.py <Unix domain socket path, or - to read the records from stdin> <dump file>
+or, as a stand-in for tests and development, in a thread of the captured process (see LocalCollector).
+The objects are rebuilt as placeholders: modules, classes and instances with the same names (and identities)
+as the originals, so AnnotatorThread declares them just as in the captured process, without importing its code.
+'''
+from __future__ import with_statement
+import os
+import sys
+import types
+import socket
+import itertools
+import threading
+from threading import Thread
+from Queue import Queue
+
+import file_utils
+import annotator
+from annotator import AnnotatorThread
+from annotator import CallSiteDescriptor
+from call_graph import LanguageType
+from call_graph import ProgramExecution
+from serialization import CallGraphSerializer
+from event_records import RecordTypes
+from event_records import ObjectTags
+from event_records import EventRecordReader
+
+class _PlaceholderObject(object):
+    '''
+    Base class for the placeholders of new-style instances (see event_records.ObjectTags.INSTANCE, OTHER and SUMMARY).
+    '''
+    ##
+    # @param self The _PlaceholderObject instance to construct.
+    # @param text The original object's description, or None for an instance identified by its identity.
+    # @param isSummary The text is the summary of an object over the capture limits (see CollectorThread._summarize()).
+    def __init__(self, text = None, isSummary = False):
+        '''
+        Constructor.
+        '''
+        self.text_ = text
+        self.isSummary_ = isSummary
+
+    ##
+    # @param self The _PlaceholderObject instance.
+    # @return The original object's repr(), if it's known.
+    def __str__(self):
+        '''
+        Return the original object's repr(), if it's known.
+        '''
+        if self.text_ is None:
+            return object.__str__(self)
+        return self.text_
+
+class ObjectDecoder:
+    '''
+    Rebuilds the objects encoded by event_records.encodeObject(): native values and containers are rebuilt as they were,
+    and modules, classes and instances are replaced by placeholders. The same module, class or instance
+    always gets the same placeholder, so AnnotatorThread identifies them as it does in the captured process.
+    '''
+    ##
+    # @param self The ObjectDecoder instance to construct.
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        #{ moduleName -> module placeholder }
+        self.modules_ = {}
+        #{ encoded class -> class placeholder }
+        self.classes_ = {}
+        #{ (original identity, encoded class) -> instance placeholder }
+        self.instances_ = {}
+
+    #Tags of the encoded containers
+    CONTAINER_TAGS = frozenset([ObjectTags.TUPLE, ObjectTags.LIST, ObjectTags.DICT])
+
+    ##
+    # @param self The ObjectDecoder instance.
+    # @param encodedObj An encoded object (see event_records.ObjectTags).
+    # @return The object, or its placeholder.
+    def decode(self, encodedObj):
+        '''
+        Decode an object. The containers are walked with an explicit stack, as event_records.encodeObject() does.
+        '''
+        tag = encodedObj[0]
+        if tag not in ObjectDecoder.CONTAINER_TAGS:
+            return self.__decodeNonContainer(encodedObj)
+        #The containers being decoded: [tag, iterator over the encoded children, decoded children]
+        stack = [ [tag, _iterEncodedChildren(encodedObj), []] ]
+        while True:
+            tag, encodedChildren, children = stack[-1]
+            for encodedChild in encodedChildren:
+                if encodedChild[0] in ObjectDecoder.CONTAINER_TAGS:
+                    stack.append( [encodedChild[0], _iterEncodedChildren(encodedChild), []] )
+                    break
+                children.append(self.__decodeNonContainer(encodedChild))
+            else:
+                #Every child has been decoded
+                stack.pop()
+                if tag == ObjectTags.DICT:
+                    decoded = dict(zip(children[::2], children[1::2]))
+                elif tag == ObjectTags.TUPLE:
+                    decoded = tuple(children)
+                else:
+                    decoded = children
+                if not stack:
+                    return decoded
+                stack[-1][2].append(decoded)
+
+    ##
+    # @param self The ObjectDecoder instance.
+    # @param encodedObj An encoded object (see event_records.ObjectTags), but not a container.
+    # @return The object, or its placeholder.
+    def __decodeNonContainer(self, encodedObj):
+        '''
+        Decode an object that has no children (see decode()).
+        '''
+        tag = encodedObj[0]
+        if tag == ObjectTags.VALUE:
+            return encodedObj[1]
+        if tag == ObjectTags.MODULE:
+            return self.getModule(encodedObj[1])
+        if tag == ObjectTags.CLASS:
+            return self.__getClass(encodedObj)
+        if tag == ObjectTags.INSTANCE:
+            _, originalIdentity, encodedClass = encodedObj
+            key = (originalIdentity, encodedClass)
+            instance = self.instances_.get(key)
+            if instance is None:
+                cls = self.__getClass(encodedClass)
+                instance = types.InstanceType(cls) if type(cls) is types.ClassType else cls()
+                self.instances_[key] = instance
+            return instance
+        _, text, encodedClass = encodedObj
+        if tag == ObjectTags.SUMMARY:
+            return self.__getClass(encodedClass)(text, isSummary = True)
+        assert tag == ObjectTags.OTHER
+        return self.__getClass(encodedClass)(text)
+
+    ##
+    # @param self The ObjectDecoder instance.
+    # @param moduleName Module name.
+    # @return The module placeholder.
+    def getModule(self, moduleName):
+        '''
+        Get the placeholder for a module (it's not imported, nor added to sys.modules).
+        '''
+        module = self.modules_.get(moduleName)
+        if module is None:
+            module = self.modules_.setdefault(moduleName, types.ModuleType(moduleName))
+        return module
+
+    ##
+    # @param self The ObjectDecoder instance.
+    # @param encodedClass An encoded class (see event_records.ObjectTags.CLASS).
+    # @return The class placeholder.
+    def __getClass(self, encodedClass):
+        '''
+        Get the placeholder for a class: an old-style class for an old-style one, else a _PlaceholderObject subclass.
+        '''
+        cls = self.classes_.get(encodedClass)
+        if cls is None:
+            _, moduleName, className, isOldStyleClass = encodedClass
+            if isOldStyleClass:
+                cls = types.ClassType(className, (), {'__module__': moduleName})
+            else:
+                cls = type(className, (_PlaceholderObject,), {'__module__': moduleName})
+            self.classes_[encodedClass] = cls
+        return cls
+
+##
+# @param encodedContainer An encoded tuple, list or dict (see event_records.ObjectTags).
+# @return An iterator over its encoded children: the keys and values, one after the other, for a dict.
+def _iterEncodedChildren(encodedContainer):
+    '''
+    Iterate over the children of an encoded container, to decode them (see ObjectDecoder.decode()).
+    '''
+    if encodedContainer[0] == ObjectTags.DICT:
+        return itertools.chain.from_iterable(encodedContainer[1])
+    return iter(encodedContainer[1])
+
+class CollectorThread(AnnotatorThread):
+    '''
+    AnnotatorThread for the collector: the objects are placeholders (see ObjectDecoder),
+    so a class parent is its module placeholder, instead of the module in sys.modules.
+    '''
+    ##
+    # @param self The CollectorThread to construct.
+    # @param aProgramExecution ProgramExecution instance where the Call Graph will be stored.
+    # @param callGraphQueue Message queue with the decoded events.
+    # @param objectDecoder The ObjectDecoder that rebuilds the events objects.
+    def __init__(self, aProgramExecution, callGraphQueue, objectDecoder):
+        '''
+        Constructor.
+        '''
+        AnnotatorThread.__init__(self, aProgramExecution, callGraphQueue)
+        self.objectDecoder_ = objectDecoder
+
+    ##
+    # @param self The CollectorThread instance.
+    # @param obj Placeholder object (module, class, or instance).
+    # @param objType Obj's object type returned by type() function.
+    # @return The obj's parent placeholder.
+    def _getParent(self, obj, objType):
+        '''
+        Get the parent for a placeholder object (see AnnotatorThread._getParent()).
+        '''
+        if objType == LanguageType.CLASS:
+            return self.objectDecoder_.getModule(obj.__module__)
+        return AnnotatorThread._getParent(self, obj, objType)
+
+    ##
+    # @param self The CollectorThread instance.
+    # @param obj Python "object" (module, class, or instance) to declare, or its placeholder.
+    # @param isCallee Obj is the callee, i.e.: the receiver of the message (the function call).
+    # @return The LanguageObject for obj.
+    def _declareObjectAndParents(self, obj, isCallee):
+        '''
+        Declare an object (see AnnotatorThread._declareObjectAndParents()): the objects summarized by the captured process
+        (see event_records.ObjectTags.SUMMARY) are declared as summaries.
+        '''
+        if isinstance(obj, _PlaceholderObject) and obj.isSummary_:
+            return self._declareSummary(obj)
+        return AnnotatorThread._declareObjectAndParents(self, obj, isCallee)
+
+    ##
+    # @param self The CollectorThread instance.
+    # @param obj A string or a native container over the capture limits, or the placeholder of a summarized object.
+    # @return Its summary.
+    def _summarize(self, obj):
+        '''
+        Describe an object declared as a summary: the captured process has already described the summarized objects.
+        '''
+        if isinstance(obj, _PlaceholderObject):
+            return obj.text_
+        return AnnotatorThread._summarize(self, obj)
+
+class Collector:
+    '''
+    Builds the call graph from the event records of one captured process, and dumps it when the capture ends
+    (or when the captured process is gone: the calls received so far are not lost).
+    The records are turned into AnnotatorThread queue items, so the call graph is just the same as an in-process capture.
+    '''
+    ##
+    # @param self The Collector instance to construct.
+    # @param dumpFileName File where the call graph database will be dumped.
+    # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def __init__(self, dumpFileName, preserveOldDumpFiles = True, prettyPrint = False):
+        '''
+        Constructor.
+        '''
+        self.dumpFileName_ = dumpFileName
+        self.preserveOldDumpFiles_ = preserveOldDumpFiles
+        self.prettyPrint_ = prettyPrint
+        self.programExecution_ = None
+
+    ##
+    # @param self The Collector instance.
+    # @return The ProgramExecution built by the last collect().
+    def getProgramExecution(self):
+        '''
+        Get the call graph built by the last collect().
+        '''
+        return self.programExecution_
+
+    ##
+    # @param self The Collector instance.
+    # @param fp File object where the records are read from: a socket connection (see serve()), or a pipe.
+    def collect(self, fp):
+        '''
+        Read the records until the END_ANNOTATION record (or the end of the file), and dump the call graph.
+        '''
+        self.programExecution_ = ProgramExecution( ProgramExecution.Languages.PYTHON )
+        callGraphQueue = Queue()
+        objectDecoder = ObjectDecoder()
+        collectorThread = CollectorThread(self.programExecution_, callGraphQueue, objectDecoder)
+        collectorThread.start()
+        try:
+            self.__putQueueItems(EventRecordReader(fp), callGraphQueue, objectDecoder)
+        finally:
+            callGraphQueue.put( (annotator._END_ANNOTATION,) )
+            collectorThread.join()
+        dumpFileName = self.dumpFileName_
+        if self.preserveOldDumpFiles_:
+            dumpFileName = file_utils.getUniqueDumpFileName(dumpFileName)
+        with open(dumpFileName, 'w') as jsonFileOut:
+            CallGraphSerializer().dump(self.programExecution_, jsonFileOut, self.prettyPrint_)
+
+    ##
+    # @param self The Collector instance.
+    # @param listeningSocket Socket returned by listenForCapture().
+    def serve(self, listeningSocket):
+        '''
+        Wait for the captured process to connect, and collect its records (see collect()).
+        '''
+        connection, _ = listeningSocket.accept()
+        try:
+            fp = connection.makefile('rb')
+            try:
+                self.collect(fp)
+            finally:
+                fp.close()
+        finally:
+            connection.close()
+
+    ##
+    # @param self The Collector instance.
+    # @param reader EventRecordReader for the captured process records.
+    # @param callGraphQueue The CollectorThread queue.
+    # @param objectDecoder The ObjectDecoder for the records objects.
+    def __putQueueItems(self, reader, callGraphQueue, objectDecoder):
+        '''
+        Turn the records into AnnotatorThread queue items (see AnnotatorThread.QueueInfo), and put them in the queue.
+        '''
+        decode = objectDecoder.decode
+        #{ callSiteId -> CallSiteDescriptor }
+        callSites = {}
+        record = reader.readRecord()
+        while record is not None:
+            recordType = record[0]
+            if recordType == RecordTypes.CALL_SITE:
+                _, callSiteId, functionName, languageType, inspectMethodType = record
+                callSites[callSiteId] = CallSiteDescriptor(functionName, languageType, inspectMethodType)
+            elif recordType == RecordTypes.ENTER_FUNCTION:
+                _, threadId, sequence, annotationId, obj, callSiteId, args, kargs = record
+                decodedKargs = dict([(argName, decode(karg)) for argName, karg in kargs.iteritems()])
+                callGraphQueue.put( (annotator._ENTER_FUNCTION, threadId, sequence, annotationId, decode(obj), callSites[callSiteId],
+                                     tuple([decode(arg) for arg in args]), decodedKargs) )
+            elif recordType == RecordTypes.EXIT_FUNCTION:
+                _, threadId, sequence, annotationId, threwException, returnedObject, totalTime, cpuTime = record
+                callGraphQueue.put( (annotator._EXIT_FUNCTION, threadId, sequence, annotationId, threwException, decode(returnedObject), totalTime, cpuTime) )
+            elif recordType == RecordTypes.DUMP:
+                _, dumpFileName, prettyPrint = record
+                callGraphQueue.put( (annotator._DUMP, dumpFileName, threading.Event(), prettyPrint) )
+            elif recordType == RecordTypes.METADATA:
+                for key, value in record[1].iteritems():
+                    self.programExecution_.setMetadata(key, value)
+            else:
+                assert recordType == RecordTypes.END_ANNOTATION
+                return
+            record = reader.readRecord()
+
+##
+# @param address Path for the Unix domain socket.
+# @return A socket listening on address.
+def listenForCapture(address):
+    '''
+    Create the Unix domain socket where a captured process connects to (see event_records.connectToCollector()).
+    A file left by a previous collector at that path is removed.
+    '''
+    if os.path.exists(address):
+        os.remove(address)
+    listeningSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listeningSocket.bind(address)
+    listeningSocket.listen(1)
+    return listeningSocket
+
+class LocalCollector(Thread):
+    '''
+    Stand-in collector: it runs a Collector in a thread of the captured process, to try out the out-of-process capture
+    (for instance, in the tests) without starting another process. It's listening as soon as it's constructed.
+    '''
+    ##
+    # @param self The LocalCollector instance to construct.
+    # @param address Path for the Unix domain socket.
+    # @param dumpFileName File where the call graph database will be dumped.
+    # @param preserveOldDumpFiles If True (default), it does not overwrite old dump files -it uses index numbers in the filename, as (1), to generate a new name-.
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def __init__(self, address, dumpFileName, preserveOldDumpFiles = True, prettyPrint = False):
+        '''
+        Constructor.
+        '''
+        Thread.__init__(self)
+        self.address_ = address
+        self.collector_ = Collector(dumpFileName, preserveOldDumpFiles, prettyPrint)
+        self.listeningSocket_ = listenForCapture(address)
+
+    ##
+    # @param self The LocalCollector instance.
+    # @return The ProgramExecution built, once the thread has finished.
+    def getProgramExecution(self):
+        '''
+        Get the call graph built by the collector.
+        '''
+        return self.collector_.getProgramExecution()
+
+    ##
+    # @param self The LocalCollector instance.
+    def run(self):
+        '''
+        Serve one captured process, and remove the socket.
+        '''
+        #This thread calls are never captured (see annotator.CaptureEngine.PROFILER)
+        sys.setprofile(None)
+        try:
+            self.collector_.serve(self.listeningSocket_)
+        finally:
+            self.listeningSocket_.close()
+            os.remove(self.address_)
+
+##
+# @param argv Command line arguments.
+# @return The process exit code.
+def main(argv):
+    '''
+    Run a collector process: serve one captured process on a Unix domain socket (or read its records from stdin), and dump its call graph.
+    '''
+    if len(argv) != 3:
+        print 'Usage: collector.py <Unix domain socket path, or - to read the records from stdin> <dump file>'
+        return 1
+    address, dumpFileName = argv[1:]
+    aCollector = Collector(dumpFileName)
+    if address == '-':
+        aCollector.collect(sys.stdin)
+        return 0
+    listeningSocket = listenForCapture(address)
+    try:
+        aCollector.serve(listeningSocket)
+    finally:
+        listeningSocket.close()
+        os.remove(address)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
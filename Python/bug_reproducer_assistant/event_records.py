@@ -0,0 +1,364 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Compact event records, to capture the function calls in one process and build the call graph in another one (see collector).
+The captured process only encodes its events and writes them to a Unix domain socket (or a pipe):
+it doesn't declare LanguageObject's, nor keep the ProgramExecution in memory.
+'''
+import types
+import inspect
+import itertools
+import marshal
+import socket
+import struct
+
+from instance_identities import InstanceIdentities
+
+class RecordTypes:
+    '''
+    Type of event record. Every record is a tuple, with a fixed layout for each record type:
+        CALL_SITE:      (RECORD_TYPE, callSiteId, functionName, languageType, inspectMethodType)
+        ENTER_FUNCTION: (RECORD_TYPE, threadId, sequence, annotationId, obj, callSiteId, args, kargs)
+        EXIT_FUNCTION:  (RECORD_TYPE, threadId, sequence, annotationId, threwException, returnedObject, totalTime, cpuTime)
+        DUMP:           (RECORD_TYPE, dumpFileName, prettyPrint)
+        METADATA:       (RECORD_TYPE, metadata)
+        END_ANNOTATION: (RECORD_TYPE,)
+    A CALL_SITE record (see annotator.CallSiteDescriptor) is written only once, before the first ENTER_FUNCTION that refers to it.
+    Objects are encoded by encodeObject().
+    '''
+    CALL_SITE, ENTER_FUNCTION, EXIT_FUNCTION, DUMP, METADATA, END_ANNOTATION = range(6)
+
+class ObjectTags:
+    '''
+    Tag for an encoded object (see encodeObject()), its first item:
+        VALUE:       (VALUE, value) for an immutable native value (number, string or None).
+        TUPLE, LIST: (TAG, encodedChildren)
+        DICT:        (DICT, [(encodedKey, encodedValue), ...])
+        MODULE:      (MODULE, moduleName)
+        CLASS:       (CLASS, moduleName, className, isOldStyleClass)
+        INSTANCE:    (INSTANCE, identity, encodedClass) for an instance (old or new style), see instance_identities.InstanceIdentities.
+                     An instance with a registered encoder (see annotator.ObjectEncoders) is encoded as the VALUE it returns.
+        OTHER:       (OTHER, description, encodedClass) for a container inside itself, or nested too deep, or an object
+                     that couldn't be encoded (see encodeObject() and EventRecordWriter).
+        SUMMARY:     (SUMMARY, summary, encodedClass) for a string or a container over the capture limits (see annotator.CaptureLimits).
+    That's all annotator.AnnotatorThread needs to declare an object (see AnnotatorThread._declareObjectAndParents()).
+    '''
+    VALUE, TUPLE, LIST, DICT, MODULE, CLASS, INSTANCE, OTHER, SUMMARY = range(9)
+
+#Immutable native types (the same as annotator's): marshal writes them as they are
+_VALUE_TYPES = frozenset([types.NoneType, types.BooleanType, types.IntType, types.LongType, types.FloatType, types.ComplexType, types.StringType, types.UnicodeType])
+_CONTAINER_TYPES = frozenset([types.TupleType, types.ListType, types.DictType])
+
+#Containers nested deeper are encoded as OTHER: marshal refuses to write (about) 2000 nested objects,
+#and every container level takes 2 or 3 of them
+MAX_ENCODED_DEPTH = 500
+
+#Every record is preceded by its size
+_RECORD_SIZE = struct.Struct('!I')
+
+##
+# @param cls A class (old or new style).
+# @return The encoded class (see ObjectTags).
+def _encodeClass(cls):
+    '''
+    Encode a class by its module and name.
+    '''
+    return (ObjectTags.CLASS, cls.__module__, cls.__name__, type(cls) is types.ClassType)
+
+##
+# @param obj Python "object" (module, class, instance, native value or container).
+# @param instanceIdentities instance_identities.InstanceIdentities for the instances.
+# @param captureLimits annotator.CaptureLimits, or None.
+# @param objectEncoders annotator.ObjectEncoders with the registered encoders, or None.
+# @return A marshal-compliant representation of obj (see ObjectTags).
+def encodeObject(obj, instanceIdentities, captureLimits = None, objectEncoders = None):
+    '''
+    Encode an object with just the information the call graph needs: native values and containers,
+    with their children, and any other object by its identity and its class (or as the value returned by its registered encoder).
+    The containers are walked with an explicit stack, so the nesting depth is not limited by the recursion limit.
+    A container inside itself is encoded as OTHER the second time, and so are the containers nested
+    deeper than MAX_ENCODED_DEPTH: the collector declares them as Dummy's.
+    The strings and containers over the capture limits are encoded as their SUMMARY, without their contents.
+    '''
+    objType = type(obj)
+    if objType not in _CONTAINER_TYPES:
+        return _encodeNonContainer(obj, objType, instanceIdentities, captureLimits, objectEncoders)
+    if captureLimits is not None and captureLimits.mustSummarize(obj, 1, None):
+        return (ObjectTags.SUMMARY, captureLimits.getSummary(obj), _encodeClass(objType))
+    #The containers being encoded, from obj: [container, its type, iterator over its children, encoded children]
+    stack = [ [obj, objType, _iterChildren(obj, objType), []] ]
+    path = set([id(obj)])
+    while True:
+        container, containerType, children, encodedChildren = stack[-1]
+        for child in children:
+            childType = type(child)
+            if childType not in _CONTAINER_TYPES:
+                encodedChildren.append(_encodeNonContainer(child, childType, instanceIdentities, captureLimits, objectEncoders))
+            elif captureLimits is not None and captureLimits.mustSummarize(child, len(stack) + 1, None):
+                encodedChildren.append( (ObjectTags.SUMMARY, captureLimits.getSummary(child), _encodeClass(childType)) )
+            elif id(child) in path:
+                encodedChildren.append( (ObjectTags.OTHER, childType.__name__ + " inside itself", _encodeClass(childType)) )
+            elif len(stack) >= MAX_ENCODED_DEPTH:
+                encodedChildren.append( (ObjectTags.OTHER, childType.__name__ + " nested deeper than " + str(MAX_ENCODED_DEPTH) + " levels", _encodeClass(childType)) )
+            else:
+                stack.append( [child, childType, _iterChildren(child, childType), []] )
+                path.add(id(child))
+                break
+        else:
+            #Every child has been encoded
+            stack.pop()
+            path.remove(id(container))
+            if containerType is types.DictType:
+                encoded = (ObjectTags.DICT, zip(encodedChildren[::2], encodedChildren[1::2]))
+            else:
+                encoded = (ObjectTags.TUPLE if containerType is types.TupleType else ObjectTags.LIST, encodedChildren)
+            if not stack:
+                return encoded
+            stack[-1][3].append(encoded)
+
+##
+# @param container A tuple, list or dict.
+# @param containerType Its type.
+# @return An iterator over its children: the keys and values, one after the other, for a dict.
+def _iterChildren(container, containerType):
+    '''
+    Iterate over the children of a container, to encode them (see encodeObject()).
+    '''
+    if containerType is types.DictType:
+        return itertools.chain.from_iterable(container.iteritems())
+    return iter(container)
+
+##
+# @param obj Python "object" (module, class, instance or native value), but not a container.
+# @param objType Its type.
+# @param instanceIdentities instance_identities.InstanceIdentities for the instances.
+# @param captureLimits annotator.CaptureLimits, or None.
+# @param objectEncoders annotator.ObjectEncoders, or None.
+# @return The encoded object (see ObjectTags).
+def _encodeNonContainer(obj, objType, instanceIdentities, captureLimits, objectEncoders):
+    '''
+    Encode an object that has no children (see encodeObject()).
+    '''
+    if objType in _VALUE_TYPES:
+        if captureLimits is not None and captureLimits.mustSummarize(obj, 0, None):
+            return (ObjectTags.SUMMARY, captureLimits.getSummary(obj), _encodeClass(objType))
+        return (ObjectTags.VALUE, obj)
+    if inspect.ismodule(obj):
+        return (ObjectTags.MODULE, obj.__name__)
+    if inspect.isclass(obj):
+        return _encodeClass(obj)
+    if objectEncoders is not None:
+        encodedObj = objectEncoders.encodeRegistered(obj)
+        #Only the scalars are declared as values, as in the annotator (see annotator.ObjectEncoders.getDeclarationCode())
+        if type(encodedObj) in _VALUE_TYPES and type(encodedObj) is not types.ComplexType:
+            return _encodeNonContainer(encodedObj, type(encodedObj), instanceIdentities, captureLimits, None)
+    return (ObjectTags.INSTANCE, instanceIdentities.getIdentity(obj), _encodeClass(obj.__class__))
+
+##
+# @param address Path of the Unix domain socket where the collector is listening (see collector.Collector).
+# @return A buffered file object to write the event records (see EventRecordWriter).
+def connectToCollector(address):
+    '''
+    Connect to a collector process.
+    '''
+    aSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        aSocket.connect(address)
+        return aSocket.makefile('wb')
+    finally:
+        #The file object keeps the connection open
+        aSocket.close()
+
+class EventRecordWriter:
+    '''
+    Encodes the capture events (see annotator.AnnotatorThread.QueueInfo) as records (see RecordTypes),
+    and writes them to a file object: a Unix domain socket (see connectToCollector()) or a pipe.
+    Each record is marshalled, and preceded by its size.
+    Writes are buffered by the file object: the caller flushes it (see flush()).
+    '''
+    ##
+    # @param self The EventRecordWriter instance to construct.
+    # @param fp File object where the records are written.
+    def __init__(self, fp):
+        '''
+        Constructor.
+        '''
+        self.fp_ = fp
+        #{ CallSiteDescriptor -> callSiteId }
+        self.callSiteIds_ = {}
+        #The instances are encoded by their identity, for the whole capture
+        self.instanceIdentities_ = InstanceIdentities()
+        self.captureLimits_ = None
+        self.objectEncoders_ = None
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param captureLimits annotator.CaptureLimits, or None to encode every object as it is.
+    def setCaptureLimits(self, captureLimits):
+        '''
+        Choose the limits for the encoded arguments and returned objects (see encodeObject()).
+        '''
+        self.captureLimits_ = captureLimits
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param objectEncoders annotator.ObjectEncoders with the registered encoders, or None to encode every instance by its identity.
+    def setObjectEncoders(self, objectEncoders):
+        '''
+        Choose the encoders for the instances (see encodeObject()). They run in the captured process: the collector can't run them.
+        '''
+        self.objectEncoders_ = objectEncoders
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param threadId Capture thread id.
+    # @param sequence Sequence number of the event in its thread.
+    # @param annotationId Annotation id, to match the EXIT_FUNCTION record.
+    # @param obj The callee.
+    # @param callSite annotator.CallSiteDescriptor for the function.
+    # @param args Arguments list.
+    # @param kargs Named arguments.
+    def writeEnterFunction(self, threadId, sequence, annotationId, obj, callSite, args, kargs):
+        '''
+        Write an ENTER_FUNCTION record (and a CALL_SITE record, the first time the function is called).
+        '''
+        callSiteId = self.callSiteIds_.get(callSite)
+        if callSiteId is None:
+            callSiteId = len(self.callSiteIds_) + 1
+            self.callSiteIds_[callSite] = callSiteId
+            self.__writeRecord( (RecordTypes.CALL_SITE, callSiteId, callSite.getFunctionName(), callSite.getLanguageType(), callSite.getInspectMethodType()) )
+        encodedKargs = dict([(argName, self.__encode(karg)) for argName, karg in kargs.iteritems()])
+        self.__writeRecord( (RecordTypes.ENTER_FUNCTION, threadId, sequence, annotationId, self.__encode(obj), callSiteId, [self.__encode(arg) for arg in args], encodedKargs) )
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param threadId Capture thread id.
+    # @param sequence Sequence number of the event in its thread.
+    # @param annotationId Annotation id, the same as in the ENTER_FUNCTION record.
+    # @param threwException The function has raised an exception.
+    # @param returnedObject If threwException is False, the object returned by the function. If True, the exception being raised.
+    # @param totalTime Wall time taken by the function, or None if the calls are not timed.
+    # @param cpuTime Thread CPU time taken by the function, or None if it's not measured.
+    def writeExitFunction(self, threadId, sequence, annotationId, threwException, returnedObject, totalTime, cpuTime):
+        '''
+        Write an EXIT_FUNCTION record.
+        '''
+        self.__writeRecord( (RecordTypes.EXIT_FUNCTION, threadId, sequence, annotationId, threwException, self.__encode(returnedObject), totalTime, cpuTime) )
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param dumpFileName File where the collector dumps the call graph captured so far.
+    # @param prettyPrint If True, the database is indented, to be read by humans (see CallGraphSerializer.dump()).
+    def writeDump(self, dumpFileName, prettyPrint):
+        '''
+        Write a DUMP record.
+        '''
+        self.__writeRecord( (RecordTypes.DUMP, dumpFileName, prettyPrint) )
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param metadata The capture metadata (see call_graph.ProgramExecution.getMetadata()).
+    def writeMetadata(self, metadata):
+        '''
+        Write a METADATA record.
+        '''
+        self.__writeRecord( (RecordTypes.METADATA, metadata) )
+
+    ##
+    # @param self The EventRecordWriter instance.
+    def writeEnd(self):
+        '''
+        Write the END_ANNOTATION record: the collector dumps the call graph.
+        '''
+        self.__writeRecord( (RecordTypes.END_ANNOTATION,) )
+
+    ##
+    # @param self The EventRecordWriter instance.
+    def flush(self):
+        '''
+        Flush the records in the write buffer.
+        '''
+        self.fp_.flush()
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param obj Object to encode.
+    # @return The encoded object (see encodeObject()).
+    def __encode(self, obj):
+        '''
+        Encode an object of an event. If it can't be encoded (e.g.: a dict changed by another thread meanwhile),
+        it's encoded as OTHER: the event is still written, so the collector can match its ENTER_FUNCTION and EXIT_FUNCTION records.
+        '''
+        try:
+            return encodeObject(obj, self.instanceIdentities_, self.captureLimits_, self.objectEncoders_)
+        except Exception, e:
+            return (ObjectTags.OTHER, "not encoded: " + e.__class__.__name__, _encodeClass(type(obj)))
+
+    ##
+    # @param self The EventRecordWriter instance.
+    # @param record A record (see RecordTypes).
+    def __writeRecord(self, record):
+        '''
+        Write a record, preceded by its size.
+        '''
+        data = marshal.dumps(record)
+        self.fp_.write(_RECORD_SIZE.pack(len(data)) + data)
+
+class EventRecordReader:
+    '''
+    Reads the records written by an EventRecordWriter.
+    '''
+    ##
+    # @param self The EventRecordReader instance to construct.
+    # @param fp File object where the records are read from.
+    def __init__(self, fp):
+        '''
+        Constructor.
+        '''
+        self.fp_ = fp
+
+    ##
+    # @param self The EventRecordReader instance.
+    # @return The next record (see RecordTypes), or None if the writer has closed the file.
+    def readRecord(self):
+        '''
+        Read the next record.
+        '''
+        sizeData = self.__read(_RECORD_SIZE.size)
+        if sizeData is None:
+            return None
+        data = self.__read(_RECORD_SIZE.unpack(sizeData)[0])
+        if data is None:
+            return None
+        return marshal.loads(data)
+
+    ##
+    # @param self The EventRecordReader instance.
+    # @param size Number of bytes to read.
+    # @return The bytes, or None if the file ends before them.
+    def __read(self, size):
+        '''
+        Read exactly 'size' bytes (a socket may return less of them).
+        '''
+        chunks = []
+        while size > 0:
+            chunk = self.fp_.read(size)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
@@ -18,6 +18,7 @@
 File-related utilities.
 '''
 import os
+import re
 
 ##
 # @param dumpFileName File where the call graph database will be dumped.
@@ -70,4 +71,27 @@ def getUniqueDumpFileName(dumpFileName):
             if addSeparators:
                 basename += "(1)"
             uniqueDumpFileName = os.path.join(folder, basename + extension)
-    return uniqueDumpFileName
\ No newline at end of file
+    return uniqueDumpFileName
+
+##
+# @param dumpFileName File where the call graph database will be dumped.
+# @param processId Id of the process whose call graph is dumped.
+# @return The file name for the process shard: dumpFileName with ".pid<processId>" before its extension.
+def getShardDumpFileName(dumpFileName, processId):
+    '''
+    Get the file name for a child process call graph (a shard), so every process dumps its own file.
+    '''
+    basename, extension = os.path.splitext(dumpFileName)
+    return basename + ".pid" + str(processId) + extension
+
+##
+# @param dumpFileName File where the call graph database was dumped.
+# @return The shard files dumped by the child processes (see getShardDumpFileName()), sorted by name.
+def getShardDumpFileNames(dumpFileName):
+    '''
+    Find the shards for a dump file, including the ones with "(1)", "(2)", etc. (see getUniqueDumpFileName()).
+    '''
+    folder = os.path.dirname(dumpFileName)
+    basename, extension = os.path.splitext(os.path.basename(dumpFileName))
+    shardPattern = re.compile(re.escape(basename) + r"\.pid\d+(\(\d+\))?" + re.escape(extension) + "$")
+    return sorted([os.path.join(folder, fileName) for fileName in os.listdir(folder or os.curdir) if shardPattern.match(fileName)])
@@ -0,0 +1,291 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Import hook (PEP 302) that annotates the functions chosen by an AnnotationSpec when their modules are imported.
+Unlike SourceCodeParser.annotatePythonObject(), no source file is rewritten: the spec just drives Annotator.annotateNow().
+'''
+import sys
+import inspect
+from fnmatch import fnmatchcase
+
+import annotator
+
+class AnnotationRule:
+    '''
+    Functions to annotate: the ones in the modules matching modulePattern, and in the classes matching classPattern
+    (or module-level functions if it's None), whose names match functionPattern. Patterns are fnmatch patterns.
+    Only the functions and classes defined in the module are matched (not the imported ones),
+    and only the methods defined in the class (not the inherited ones).
+    '''
+    ##
+    # @param self The AnnotationRule instance to construct.
+    # @param modulePattern Pattern for the module names (e.g.: 'myapp.models.*').
+    # @param classPattern Pattern for the class names, or None for module-level functions.
+    # @param functionPattern Pattern for the function names.
+    def __init__(self, modulePattern, classPattern = None, functionPattern = '*'):
+        '''
+        Constructor.
+        '''
+        self.modulePattern_ = modulePattern
+        self.classPattern_ = classPattern
+        self.functionPattern_ = functionPattern
+
+    ##
+    # @param self The AnnotationRule instance.
+    # @return Pattern for the module names.
+    def getModulePattern(self):
+        '''
+        Get the pattern for the module names.
+        '''
+        return self.modulePattern_
+
+    ##
+    # @param self The AnnotationRule instance.
+    # @return Pattern for the class names, or None for module-level functions.
+    def getClassPattern(self):
+        '''
+        Get the pattern for the class names (None for module-level functions).
+        '''
+        return self.classPattern_
+
+    ##
+    # @param self The AnnotationRule instance.
+    # @return Pattern for the function names.
+    def getFunctionPattern(self):
+        '''
+        Get the pattern for the function names.
+        '''
+        return self.functionPattern_
+
+    ##
+    # @param self The AnnotationRule instance.
+    # @param moduleName A module full name.
+    # @return True if the rule applies to that module.
+    def matchesModule(self, moduleName):
+        '''
+        Tell whether the rule applies to a module.
+        '''
+        return fnmatchcase(moduleName, self.modulePattern_)
+
+    ##
+    # @param self The AnnotationRule instance.
+    # @param module A module matching the rule (see matchesModule()).
+    # @return List of (obj, methodNames) to annotate: obj is the module or one of its classes.
+    def getAnnotations(self, module):
+        '''
+        Get the module's functions (or its classes' methods) matching the rule.
+        '''
+        moduleName = module.__name__
+        if self.classPattern_ is None:
+            functionNames = [name for name, value in inspect.getmembers(module, inspect.isfunction)
+                             if value.__module__ == moduleName and fnmatchcase(name, self.functionPattern_)]
+            return [(module, functionNames)] if functionNames else []
+        annotations = []
+        for className, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != moduleName or not fnmatchcase(className, self.classPattern_):
+                continue
+            methodNames = [name for name, value in sorted(cls.__dict__.items())
+                           if (isinstance(value, (staticmethod, classmethod)) or inspect.isfunction(value)) and fnmatchcase(name, self.functionPattern_)]
+            if methodNames:
+                annotations.append( (cls, methodNames) )
+        return annotations
+
+class AnnotationSpec:
+    '''
+    Set of AnnotationRule's. It may be read from a text (see parse()), e.g. from a configuration file.
+    '''
+    ##
+    # @param self The AnnotationSpec instance to construct.
+    # @param rules List of AnnotationRule's.
+    def __init__(self, rules = None):
+        '''
+        Constructor.
+        '''
+        self.rules_ = list(rules) if rules else []
+
+    ##
+    # @param text Spec text: one rule per line, as 'modulePattern', 'modulePattern:functionPattern' or 'modulePattern:ClassPattern.functionPattern'.
+    # @return A new AnnotationSpec.
+    @staticmethod
+    def parse(text):
+        '''
+        Read a spec from a text, with one rule per line. Empty lines and lines starting with '#' are ignored. Examples:
+            myapp.*                      (every function and method in myapp's modules)
+            myapp.utils:parse_*          (module-level functions)
+            myapp.models:*.save          (the save() method of every class)
+        '''
+        spec = AnnotationSpec()
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            modulePattern, _, functionSpec = line.partition(':')
+            if not functionSpec:
+                spec.addRule(modulePattern, None)
+                spec.addRule(modulePattern, '*')
+            elif '.' in functionSpec:
+                classPattern, _, functionPattern = functionSpec.rpartition('.')
+                spec.addRule(modulePattern, classPattern, functionPattern)
+            else:
+                spec.addRule(modulePattern, None, functionSpec)
+        return spec
+
+    ##
+    # @param self The AnnotationSpec instance.
+    # @param modulePattern Pattern for the module names.
+    # @param classPattern Pattern for the class names, or None for module-level functions.
+    # @param functionPattern Pattern for the function names.
+    def addRule(self, modulePattern, classPattern = None, functionPattern = '*'):
+        '''
+        Add an AnnotationRule.
+        '''
+        self.rules_.append(AnnotationRule(modulePattern, classPattern, functionPattern))
+
+    ##
+    # @param self The AnnotationSpec instance.
+    # @return The AnnotationRule's.
+    def getRules(self):
+        '''
+        Get the rules.
+        '''
+        return self.rules_
+
+    ##
+    # @param self The AnnotationSpec instance.
+    # @param moduleName A module full name.
+    # @return True if any rule applies to that module.
+    def matchesModule(self, moduleName):
+        '''
+        Tell whether any rule applies to a module.
+        '''
+        for rule in self.rules_:
+            if rule.matchesModule(moduleName):
+                return True
+        return False
+
+    ##
+    # @param self The AnnotationSpec instance.
+    # @param module A module.
+    # @return List of (obj, methodNames) to annotate: obj is the module or one of its classes.
+    def getAnnotations(self, module):
+        '''
+        Get the module's functions (or its classes' methods) matching any rule.
+        '''
+        annotations = []
+        for rule in self.rules_:
+            if rule.matchesModule(module.__name__):
+                annotations.extend(rule.getAnnotations(module))
+        return annotations
+
+class AnnotationImportHook:
+    '''
+    sys.meta_path hook (PEP 302 finder and loader). The modules matching the spec are imported as usual,
+    and then their functions matching the spec are annotated (see Annotator.annotateNow()):
+    before the annotations start, they're just added to the Annotator; after that, they're replaced right away.
+    The other modules are not touched: find_module() returns None for them.
+    '''
+    ##
+    # @param self The AnnotationImportHook instance to construct.
+    # @param spec The AnnotationSpec.
+    # @param theAnnotator The Annotator that annotates the functions. If None, the annotator instance (see annotator.annotatorInstance()).
+    def __init__(self, spec, theAnnotator = None):
+        '''
+        Constructor.
+        '''
+        self.spec_ = spec
+        self.annotator_ = theAnnotator if theAnnotator is not None else annotator.annotatorInstance()
+        #Modules being imported by load_module(): find_module() must not find them again
+        self.loading_ = set()
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    # @return The AnnotationSpec.
+    def getSpec(self):
+        '''
+        Get the spec.
+        '''
+        return self.spec_
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    def install(self):
+        '''
+        Install the hook, and annotate the modules matching the spec that were already imported (see annotateLoadedModules()).
+        '''
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+        self.annotateLoadedModules()
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    def uninstall(self):
+        '''
+        Uninstall the hook. The functions already annotated are restored by the Annotator, when the annotations finish.
+        '''
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    def annotateLoadedModules(self):
+        '''
+        Annotate the functions matching the spec, in the modules already imported.
+        It's needed again after Annotator.resetForNewAnnotations(), to capture another run.
+        '''
+        for moduleName, module in sys.modules.items():
+            if module is not None and self.spec_.matchesModule(moduleName):
+                self._annotateModule(module)
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    # @param fullname Full name of the module being imported.
+    # @param path Package path, for submodules.
+    # @return This hook if it must load the module, else None.
+    def find_module(self, fullname, path = None):
+        '''
+        PEP 302 finder: claim the modules matching the spec.
+        '''
+        if fullname in self.loading_ or not self.spec_.matchesModule(fullname):
+            return None
+        return self
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    # @param fullname Full name of the module being imported.
+    # @return The imported module.
+    def load_module(self, fullname):
+        '''
+        PEP 302 loader: import the module with the usual machinery, and then annotate it.
+        '''
+        self.loading_.add(fullname)
+        try:
+            __import__(fullname)
+        finally:
+            self.loading_.discard(fullname)
+        module = sys.modules[fullname]
+        self._annotateModule(module)
+        return module
+
+    ##
+    # @param self The AnnotationImportHook instance.
+    # @param module A module matching the spec.
+    def _annotateModule(self, module):
+        '''
+        Annotate the module's functions (or its classes' methods) matching the spec.
+        '''
+        for obj, methodNames in self.spec_.getAnnotations(module):
+            self.annotator_.annotateNow(obj, *methodNames)
@@ -0,0 +1,154 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Identity for the captured instances (old and new style), see InstanceIdentities.
+'''
+import weakref
+from collections import OrderedDict
+from collections import deque
+
+class _StrongReference:
+    '''
+    Used instead of a weak reference for the objects that don't support them: it keeps the object alive,
+    so its id() cannot be reused while it's known.
+    '''
+    ##
+    # @param self The _StrongReference instance to construct.
+    # @param obj The referenced object.
+    def __init__(self, obj):
+        '''
+        Constructor.
+        '''
+        self.obj_ = obj
+
+    ##
+    # @param self The _StrongReference instance.
+    # @return The referenced object.
+    def __call__(self):
+        '''
+        Get the referenced object, as a weak reference does.
+        '''
+        return self.obj_
+
+class _WeakReference(weakref.ref):
+    '''
+    A weak reference that remembers its object's id(), to remove its identity when the object is freed (see InstanceIdentities).
+    '''
+    __slots__ = ('objId_',)
+
+    ##
+    # @param self The _WeakReference instance to construct.
+    # @param obj The referenced object.
+    # @param callback Called with the reference when the object is about to be freed.
+    def __init__(self, obj, callback):
+        '''
+        Constructor.
+        '''
+        weakref.ref.__init__(self, obj, callback)
+        self.objId_ = id(obj)
+
+class InstanceIdentities:
+    '''
+    Identifies instances without running their code (as str() or hashing them would): an identity is (id(obj), generation).
+    An id() is reused once its object is freed, so each id() keeps a weak reference to the last object seen with it:
+    if that object is gone, obj is a new one, and it gets a new generation. The identities of the freed objects
+    are removed by getIdentity(), so only the live objects are remembered.
+    It's used by one thread, but the objects are freed by any thread: the weak reference callbacks just queue
+    the dead references (deque.append() is atomic), and the thread using it removes their identities.
+    Objects that don't support weak references (e.g.: instances of classes with __slots__ and no __weakref__ slot,
+    or of some builtin types) are kept alive instead, until their identity is forgotten (see forget()).
+    At most MAX_STRONG_REFERENCES of them are kept alive: then, the oldest one is forgotten
+    (if it's seen again, it gets a new identity, as if it were another object).
+    '''
+    MAX_STRONG_REFERENCES = 4096
+
+    ##
+    # @param self The InstanceIdentities instance to construct.
+    def __init__(self):
+        '''
+        Constructor.
+        '''
+        #{ id(obj) -> (reference to obj, generation) }
+        self.references_ = {}
+        #{ id(obj) -> generation } for the objects kept alive, the oldest first
+        self.strongReferences_ = OrderedDict()
+        #_WeakReference's whose objects have been freed, queued by _referenceDied()
+        self.deadReferences_ = deque()
+        self.nextGeneration_ = 1
+
+    ##
+    # @param self The InstanceIdentities instance.
+    # @param obj An instance.
+    # @return obj's identity: a (id(obj), generation) tuple.
+    def getIdentity(self, obj):
+        '''
+        Get the identity of an object: the same while the object is alive, and never the same for another object.
+        '''
+        if self.deadReferences_:
+            self._removeDeadReferences()
+        objId = id(obj)
+        known = self.references_.get(objId)
+        if known is not None and known[0]() is obj:
+            return (objId, known[1])
+        generation = self.nextGeneration_
+        self.nextGeneration_ += 1
+        try:
+            reference = _WeakReference(obj, self._referenceDied)
+        except TypeError:
+            reference = _StrongReference(obj)
+            self.strongReferences_[objId] = generation
+        self.references_[objId] = (reference, generation)
+        if len(self.strongReferences_) > InstanceIdentities.MAX_STRONG_REFERENCES:
+            self.forget(self.strongReferences_.popitem(last = False))
+        return (objId, generation)
+
+    ##
+    # @param self The InstanceIdentities instance.
+    # @param reference The _WeakReference to an object being freed.
+    def _referenceDied(self, reference):
+        '''
+        Weak reference callback, run by the thread freeing the object: queue the reference, to remove its identity later.
+        '''
+        self.deadReferences_.append(reference)
+
+    ##
+    # @param self The InstanceIdentities instance.
+    def _removeDeadReferences(self):
+        '''
+        Remove the identities of the freed objects. The ones already forgotten (see forget()) are skipped:
+        their id() may have a newer reference.
+        '''
+        deadReferences = self.deadReferences_
+        while deadReferences:
+            reference = deadReferences.popleft()
+            known = self.references_.get(reference.objId_)
+            if known is not None and known[0] is reference:
+                del self.references_[reference.objId_]
+
+    ##
+    # @param self The InstanceIdentities instance.
+    # @param identity An identity returned by getIdentity().
+    def forget(self, identity):
+        '''
+        Forget an identity, releasing its object if it was kept alive. If the object is seen again, it gets a new identity.
+        '''
+        objId, generation = identity
+        known = self.references_.get(objId)
+        if known is not None and known[1] == generation:
+            del self.references_[objId]
+            if self.strongReferences_.get(objId) == generation:
+                del self.strongReferences_[objId]
@@ -0,0 +1,177 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Multiprocess capture: every child process dumps its own call graph, a shard (see annotator.Annotator.setChildProcessesDumpFile()).
+Load the shards as separate per-process programs, or merge them into one ProgramExecution.
+It may run as a script, to merge a dump file and its shards:
+    python process_shards.py <dump file> <merged dump file>
+'''
+from __future__ import with_statement
+import sys
+import types
+
+import file_utils
+from call_graph import LanguageType
+from call_graph import LanguageObject
+from call_graph import FunctionCall
+from call_graph import Argument
+from call_graph import ProgramExecution
+from serialization import CallGraphSerializer
+from serialization import asJsonString
+from serialization import fromJsonString
+
+##
+# @param dumpFileName File where the parent process call graph was dumped.
+# @return A list of ProgramExecution's: the parent process one, followed by its children shards (see file_utils.getShardDumpFileNames()).
+def loadProcessProgramExecutions(dumpFileName):
+    '''
+    Load the call graph of every process, as a separate program.
+    Their metadata tells which process made the calls, and its parent (see ProgramExecution.Metadata).
+    '''
+    programExecutions = []
+    for aDumpFileName in [dumpFileName] + file_utils.getShardDumpFileNames(dumpFileName):
+        with open(aDumpFileName, 'r') as dumpFile:
+            programExecutions.append( CallGraphSerializer().load(dumpFile) )
+    return programExecutions
+
+##
+# @param lo A LanguageObject.
+# @param newIds { old LanguageObject id -> merged LanguageObject id } for lo's process.
+# @return lo's declaration code, with the ids of its children replaced by the merged ones if it's a container.
+def _getMergedDeclarationCode(lo, newIds):
+    '''
+    The declaration code for a container (list, tuple or dict) has its children LanguageObject ids (see annotator.AnnotatorThread._declareObjectAndParents()):
+    they're replaced by the ids of the merged LanguageObject's.
+    '''
+    if lo.getLanguageType() != LanguageType.INSTANCE or lo.getDeclarationType() != LanguageObject.DECLARATION_TYPES.FIXED_VALUE:
+        return lo.getDeclarationCode()
+    obj = fromJsonString(lo.getDeclarationCode())
+    objType = type(obj)
+    if objType is types.ListType:
+        return asJsonString([newIds[childId] for childId in obj])
+    if objType is types.DictType:
+        #Json keys are strings
+        return asJsonString(dict([(newIds[int(key)], newIds[value]) for key, value in obj.iteritems()]))
+    return lo.getDeclarationCode()
+
+##
+# @param programExecutions List of ProgramExecution's, one for each process (see loadProcessProgramExecutions()).
+# @return A new ProgramExecution with the calls of every process.
+def mergeProgramExecutions(programExecutions):
+    '''
+    Merge the call graphs of many processes into one. The LanguageObject's, FunctionCall's and threads get new ids
+    (the ids are only unique in their process): the threads of each process are numbered after the previous process ones.
+    Modules and classes are declared once, but the instances are never shared between processes.
+    The ProgramExecution.Metadata.MERGED_PROCESSES metadata keeps every process metadata, and its new thread ids.
+    '''
+    assert programExecutions
+    merged = ProgramExecution( programExecutions[0].getLanguage() )
+    nextObjectId = 1
+    nextCallId = 1
+    nextThreadId = 1
+    #Modules and classes: { (languageType, declarationCode, merged parent id) -> merged LanguageObject }
+    sharedObjects = {}
+    mergedProcesses = []
+    droppedRootCalls = None
+    demotedFunctions = None
+    for aProgramExecution in programExecutions:
+        #{ old id -> merged LanguageObject }
+        newObjects = {}
+        #{ old id -> merged LanguageObject id }
+        newIds = {}
+        #Parents are always declared before (they have lower ids). Container children may not (a back-reference,
+        #see annotator.AnnotatorThread._declareContainer()): the instances get their ids first, and then they're declared.
+        instances = []
+        for loId, lo in sorted(aProgramExecution.getLanguageObjects().items()):
+            if lo.getLanguageType() == LanguageType.INSTANCE:
+                newIds[loId] = nextObjectId
+                nextObjectId += 1
+                instances.append(lo)
+                continue
+            parent = newObjects[lo.getParent().getId()] if lo.getParent() is not None else None
+            declarationCode = lo.getDeclarationCode()
+            sharedKey = (lo.getLanguageType(), declarationCode, parent.getId() if parent is not None else 0)
+            if sharedObjects.has_key(sharedKey):
+                newObjects[loId] = sharedObjects[sharedKey]
+                newIds[loId] = newObjects[loId].getId()
+                continue
+            newLo = LanguageObject(nextObjectId, lo.getLanguageType(), lo.getDeclarationType(), declarationCode, parent)
+            nextObjectId += 1
+            merged.addLanguageObject(newLo)
+            newObjects[loId] = newLo
+            newIds[loId] = newLo.getId()
+            sharedObjects[sharedKey] = newLo
+        for lo in instances:
+            parent = newObjects[lo.getParent().getId()] if lo.getParent() is not None else None
+            newLo = LanguageObject(newIds[lo.getId()], lo.getLanguageType(), lo.getDeclarationType(), _getMergedDeclarationCode(lo, newIds), parent)
+            merged.addLanguageObject(newLo)
+            newObjects[lo.getId()] = newLo
+
+        #{ old thread id -> merged thread id }
+        newThreadIds = {}
+        for aCall in aProgramExecution.getFunctionCalls():
+            threadId = newThreadIds.get(aCall.getThreadId())
+            if threadId is None:
+                threadId = newThreadIds[aCall.getThreadId()] = nextThreadId
+                nextThreadId += 1
+            argsList = [Argument(newObjects[anArgument.getLanguageObject().getId()], anArgument.getName(), anArgument.getArgumentType(), anArgument.isConst())
+                        for anArgument in aCall.getArgsList()]
+            returnedObject = aCall.getReturnedObject()
+            if returnedObject is not None:
+                returnedObject = newObjects[returnedObject.getId()]
+            mergedCall = FunctionCall(nextCallId, newObjects[aCall.getCallee().getId()], aCall.getFunctionName(), aCall.getMethodType(), argsList,
+                                      aCall.getLevel(), returnedObject, aCall.threwException(), aCall.getTotalTime(), threadId)
+            mergedCall.setSelfTime(aCall.getSelfTime())
+            mergedCall.setCpuTime(aCall.getCpuTime())
+            merged.addFunctionCall(mergedCall)
+            nextCallId += 1
+
+        metadata = aProgramExecution.getMetadata()
+        processInfo = dict(metadata)
+        processInfo['threadIds'] = sorted(newThreadIds.values())
+        mergedProcesses.append(processInfo)
+        if metadata.has_key(ProgramExecution.Metadata.DROPPED_ROOT_CALLS):
+            droppedRootCalls = (droppedRootCalls or 0) + metadata[ProgramExecution.Metadata.DROPPED_ROOT_CALLS]
+        if metadata.has_key(ProgramExecution.Metadata.DEMOTED_FUNCTIONS):
+            demotedFunctions = (demotedFunctions or []) + metadata[ProgramExecution.Metadata.DEMOTED_FUNCTIONS]
+
+    merged.setMetadata(ProgramExecution.Metadata.MERGED_PROCESSES, mergedProcesses)
+    #The merged call graph is incomplete if any process one is
+    if droppedRootCalls is not None:
+        merged.setMetadata(ProgramExecution.Metadata.DROPPED_ROOT_CALLS, droppedRootCalls)
+    if demotedFunctions is not None:
+        merged.setMetadata(ProgramExecution.Metadata.DEMOTED_FUNCTIONS, demotedFunctions)
+    return merged
+
+##
+# @param argv Command line arguments.
+# @return The process exit code.
+def main(argv):
+    '''
+    Merge a dump file and its shards into another dump file.
+    '''
+    if len(argv) != 3:
+        print 'Usage: process_shards.py <dump file> <merged dump file>'
+        return 1
+    dumpFileName, mergedDumpFileName = argv[1:]
+    merged = mergeProgramExecutions( loadProcessProgramExecutions(dumpFileName) )
+    with open(mergedDumpFileName, 'w') as jsonFileOut:
+        CallGraphSerializer().dump(merged, jsonFileOut)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,203 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+Samplers: they choose which root calls of an annotated function are captured (see Annotator.annotate()).
+A sampled root call is captured completely (nested calls included), so CodeGenerator can reproduce it.
+'''
+import time
+import types
+import zlib
+import marshal
+import itertools
+import threading
+
+class Sampler:
+    '''
+    Base class for the samplers. Every annotated function gets its own copy of the sampler
+    (see Annotator.annotate()), so the counters are kept per function.
+    '''
+    ##
+    # @param self The Sampler instance.
+    # @param args Arguments list of the root call.
+    # @param kwargs Named arguments of the root call.
+    # @return True if the root call must be captured.
+    def mustSample(self, args, kwargs):
+        '''
+        Tell whether a root call must be captured. It's called by the application threads, before calling the function.
+        '''
+        raise NotImplementedError()
+
+    ##
+    # @param self The Sampler instance.
+    # @return A new sampler with the same options, and its own state.
+    def clone(self):
+        '''
+        Get a new sampler with the same options, for another function.
+        '''
+        raise NotImplementedError()
+
+class EveryNthSampler(Sampler):
+    '''
+    Capture one of every n root calls: the first one, the (n+1)th one, etc.
+    '''
+    ##
+    # @param self The EveryNthSampler instance to construct.
+    # @param n Sampling period.
+    def __init__(self, n):
+        '''
+        Constructor.
+        '''
+        assert n > 0
+        self.n_ = n
+        #itertools.count is thread-safe: no lock needed
+        self.callsCounter_ = itertools.count()
+
+    ##
+    # @param self The EveryNthSampler instance.
+    # @param args Arguments list of the root call.
+    # @param kwargs Named arguments of the root call.
+    # @return True if the root call must be captured.
+    def mustSample(self, args, kwargs):
+        '''
+        Tell whether a root call must be captured.
+        '''
+        return self.callsCounter_.next() % self.n_ == 0
+
+    ##
+    # @param self The EveryNthSampler instance.
+    # @return A new EveryNthSampler with the same period.
+    def clone(self):
+        '''
+        Get a new sampler with the same period.
+        '''
+        return EveryNthSampler(self.n_)
+
+class RateLimitSampler(Sampler):
+    '''
+    Capture at most callsPerSecond root calls per second (token bucket, with a burst of callsPerSecond calls).
+    '''
+    ##
+    # @param self The RateLimitSampler instance to construct.
+    # @param callsPerSecond Maximum root calls per second to capture.
+    # @param clock Function that returns the current time in seconds (for the tests).
+    def __init__(self, callsPerSecond, clock = time.time):
+        '''
+        Constructor.
+        '''
+        assert callsPerSecond > 0
+        self.callsPerSecond_ = float(callsPerSecond)
+        self.clock_ = clock
+        self.tokens_ = self.callsPerSecond_
+        self.lastTime_ = clock()
+        self.lock_ = threading.Lock()
+
+    ##
+    # @param self The RateLimitSampler instance.
+    # @param args Arguments list of the root call.
+    # @param kwargs Named arguments of the root call.
+    # @return True if the root call must be captured.
+    def mustSample(self, args, kwargs):
+        '''
+        Tell whether a root call must be captured: if there's any token left.
+        '''
+        with self.lock_:
+            now = self.clock_()
+            self.tokens_ = min(self.callsPerSecond_, self.tokens_ + (now - self.lastTime_) * self.callsPerSecond_)
+            self.lastTime_ = now
+            if self.tokens_ < 1.0:
+                return False
+            self.tokens_ -= 1.0
+            return True
+
+    ##
+    # @param self The RateLimitSampler instance.
+    # @return A new RateLimitSampler with the same rate.
+    def clone(self):
+        '''
+        Get a new sampler with the same rate.
+        '''
+        return RateLimitSampler(self.callsPerSecond_, self.clock_)
+
+class ArgumentsHashSampler(Sampler):
+    '''
+    Capture the root calls whose arguments hash falls in one of every n buckets.
+    It's deterministic: calls with the same arguments are always captured, or never captured,
+    so a run may be sampled again the same way, in any process.
+    Only a stable projection of the arguments is hashed (see _getStableArgument()): native values by value,
+    but containers by their type and length, and any other object by its class name. So the calls whose arguments
+    differ only in the contents of a container, or in an instance state, fall in the same bucket.
+    '''
+    ##
+    # @param self The ArgumentsHashSampler instance to construct.
+    # @param n Number of buckets: about one of every n different arguments is captured.
+    def __init__(self, n):
+        '''
+        Constructor.
+        '''
+        assert n > 0
+        self.n_ = n
+
+    ##
+    # @param self The ArgumentsHashSampler instance.
+    # @param args Arguments list of the root call.
+    # @param kwargs Named arguments of the root call.
+    # @return True if the root call must be captured.
+    def mustSample(self, args, kwargs):
+        '''
+        Tell whether a root call must be captured.
+        '''
+        key = tuple([_getStableArgument(arg) for arg in args])
+        if kwargs:
+            key += tuple(sorted([(name, _getStableArgument(karg)) for name, karg in kwargs.iteritems()]))
+        #Not hash(): it may depend on the process (hash randomization)
+        return (zlib.crc32(marshal.dumps(key)) & 0xffffffff) % self.n_ == 0
+
+    ##
+    # @param self The ArgumentsHashSampler instance.
+    # @return A new ArgumentsHashSampler with the same buckets.
+    def clone(self):
+        '''
+        Get a new sampler with the same buckets.
+        '''
+        return ArgumentsHashSampler(self.n_)
+
+#Immutable native types (the same as annotator's): hashed by value
+_VALUE_TYPES = frozenset([types.NoneType, types.BooleanType, types.IntType, types.LongType, types.FloatType, types.ComplexType, types.StringType, types.UnicodeType])
+#Native containers: hashed by their type and length
+_CONTAINER_TYPES = frozenset([types.TupleType, types.ListType, types.DictType])
+
+##
+# @param arg Argument of a call.
+# @return A marshal-compliant value for arg, the same in any process.
+def _getStableArgument(arg):
+    '''
+    Get the projection of an argument that ArgumentsHashSampler hashes, in constant time (but for long strings),
+    without running the argument's code (as hash() or repr() would), and without its id() or address:
+        * Native values: themselves.
+        * Native containers: their type name and length.
+        * Modules and classes: their name.
+        * Any other object: its class module and name.
+    '''
+    argType = type(arg)
+    if argType in _VALUE_TYPES:
+        return arg
+    if argType in _CONTAINER_TYPES:
+        return (argType.__name__, len(arg))
+    if argType is types.ModuleType or argType is types.ClassType or isinstance(arg, type):
+        return (argType.__name__, arg.__name__)
+    argClass = getattr(arg, '__class__', argType)
+    return (argClass.__module__, argClass.__name__)
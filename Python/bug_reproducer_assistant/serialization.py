@@ -19,7 +19,7 @@ Module that serializes/deserializes a Call Graph into a Json database.
 It uses simplejson library.
 '''
 import types
-from cStringIO import StringIO
+import time
 import simplejson as json
 from call_graph import LanguageType
 from call_graph import LanguageObject
@@ -34,11 +34,11 @@ from call_graph import ProgramExecution
 # @return The Json representation for this object.
 def asJsonString(obj):
     '''
-    Get the Json representation for this object.
+    Get the Json representation for this object: compact and canonical (sorted keys).
+    The encoder uses its C speedups only when it encodes the whole object at once (json.dumps()),
+    without indentation.
     '''
-    io = StringIO()
-    json.dump(obj, io, sort_keys=True, indent=CallGraphSerializer.JSON.INDENT)
-    return io.getvalue()
+    return json.dumps(obj, sort_keys=True, separators=CallGraphSerializer.JSON.COMPACT_SEPARATORS)
 
 ##
 # @param str Json representation for an object.
@@ -50,6 +50,16 @@ def fromJsonString(str):
     return json.loads(str)
 
 
+##
+# @param obj LanguageObject, or None
+# @return Obj's LanguageObject id, or 0 if obj is None.         
+def _getOptionalObjectId( obj ):
+    '''
+    Return LanguageObject id, or 0 if obj is None.
+    '''
+    return 0 if obj is None else obj.getId()
+
+
 class CallGraphLoadException(Exception):
     '''
     Exception class for an error loading a Call Graph in memory.
@@ -80,8 +90,10 @@ class CallGraphSerializer:
         '''
         Json-related constants.
         '''
-        #For json pretty-printing
+        #For json pretty-printing (see CallGraphSerializer.dump())
         INDENT = 4
+        #For the compact encoding (see asJsonString())
+        COMPACT_SEPARATORS = (',', ':')
         
         #String constants
         #Global
@@ -110,6 +122,9 @@ class CallGraphSerializer:
         RETURNED_OBJECT = 'returnedObject'
         THREW_EXCEPTION = 'threwException'
         TOTAL_TIME = 'totalTime'
+        SELF_TIME = 'selfTime'
+        CPU_TIME = 'cpuTime'
+        THREAD_ID = 'threadId'
         ARGUMENTS = 'arguments'
         
         #ProgramExecution
@@ -117,17 +132,30 @@ class CallGraphSerializer:
         LANGUAGE_TYPES = 'languageTypes'
         LANGUAGE_OBJECTS = 'languageObjects'
         CALL_GRAPH = 'callGraph'
+        METADATA = 'metadata'
+        
+        #Streaming database (one Json record per line, see CallGraphStreamWriter)
+        RECORD = 'record'
+        HEADER = 'header'
+        LANGUAGE_OBJECT = 'languageObject'
+        FUNCTION_CALL = 'functionCall'
+        FUNCTION_RETURN = 'functionReturn'
+        #METADATA is also a record type
 
     ##
     # @param self The CallGraphSerializer instance.
     # @param aProgramExecution A program Call Graph to dump.
     # @param fp File object where the Json database will be dumped.
-    def dump(self, aProgramExecution, fp):
+    # @param prettyPrint If True, the database is indented, to be read by humans. Else (default), it's compact: just one line.
+    def dump(self, aProgramExecution, fp, prettyPrint = False):
         '''
         Dump a ProgramExecution in a Json database file.
         '''
         progExecMap = self.__dumpProgramExecutionAsJsonMap(aProgramExecution)
-        json.dump(progExecMap, fp, sort_keys=True, indent=CallGraphSerializer.JSON.INDENT)
+        if prettyPrint:
+            json.dump(progExecMap, fp, sort_keys=True, indent=CallGraphSerializer.JSON.INDENT)
+        else:
+            fp.write(asJsonString(progExecMap))
 
     ##
     # @param self The CallGraphSerializer instance.
@@ -136,29 +164,29 @@ class CallGraphSerializer:
     def load(self, fp):
         '''
         Load a ProgramExecution from a Json database file, and return it.
+        Both formats are accepted: the whole database as one Json object (see dump()),
+        and the streaming database, with one Json record per line (see CallGraphStreamWriter).
         '''
-        progExecMap = json.load(fp)
+        content = fp.read()
+        records = content.splitlines()
+        firstRecord = self.__loadFirstRecord(records[0]) if records else None
+        if self.__isStreamHeader(firstRecord):
+            return self.__loadProgramExecutionFromStream(records)
+        if firstRecord is not None and len(records) == 1:
+            #A compact database: its only line has already been loaded
+            progExecMap = firstRecord
+        else:
+            progExecMap = fromJsonString(content)
         return self.__loadProgramExecutionFromJsonMap(progExecMap)
 
     ##
     # @param self The CallGraphSerializer instance.
-    # @param aProgramExecution A program Call Graph to dump.
-    # @return A "Json-compliant" Python dict with the ProgramExecution data. Storing it in a Json file is straight-forward.
-    def __dumpProgramExecutionAsJsonMap(self, aProgramExecution):
+    # @param aProgramExecution A program Call Graph.
+    # @return A "Json-compliant" Python dict with the ProgramExecution language information.
+    def _programExecutionHeaderAsJsonMap(self, aProgramExecution):
         '''
-        Translate a ProgramExecution class to a "Json-compliant" format, i.e.:
-        a Python dict (simplejson forces the object to dump to be a native type, not a custom class)
-        with the same information.
+        Translate the ProgramExecution language and LanguageType's to a "Json-compliant" dict.
         '''
-        ##
-        # @param obj LanguageObject, or None
-        # @return Obj's LanguageObject id, or 0 if obj is None.         
-        def getOptionalObjectId( obj ):
-            '''
-            Return LanguageObject id, or 0 if obj is None.
-            '''
-            return 0 if obj is None else obj.getId()
-
         JSON = CallGraphSerializer.JSON
         progExecMap = {}
         progExecMap[JSON.LANGUAGE] = aProgramExecution.getLanguage()
@@ -168,20 +196,102 @@ class CallGraphSerializer:
         myLanguageTypes = aProgramExecution.getLanguageTypes()
         for lt in myLanguageTypes:
             ltArray.append( { JSON.ID: lt, JSON.NAME: LanguageType.asString( lt) } )
+        return progExecMap
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param o A LanguageObject.
+    # @return A "Json-compliant" Python dict with the LanguageObject data.
+    def _languageObjectAsJsonMap(self, o):
+        '''
+        Translate a LanguageObject to a "Json-compliant" dict.
+        '''
+        JSON = CallGraphSerializer.JSON
+        loMap = {}
+        loMap[JSON.ID] = o.getId()
+        loMap[JSON.LANGUAGE_TYPE_ID] = o.getLanguageType()
+        loMap[JSON.DECLARATION_TYPE] = o.getDeclarationType()
+        loMap[JSON.DECLARATION_CODE] = fromJsonString(o.getDeclarationCode())
+        loMap[JSON.PARENT_ID] = _getOptionalObjectId(o.getParent())
+        return loMap
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aCall A FunctionCall.
+    # @param withReturnInfo If False, the returned object and exception information is not included (the call has not returned yet).
+    # @return A "Json-compliant" Python dict with the FunctionCall data.
+    def _functionCallAsJsonMap(self, aCall, withReturnInfo = True):
+        '''
+        Translate a FunctionCall to a "Json-compliant" dict.
+        '''
+        JSON = CallGraphSerializer.JSON
+        callMap = {}
+        callMap[JSON.ID] = aCall.getId()
+        callMap[JSON.CALLEE_ID] = aCall.getCallee().getId()
+        callMap[JSON.FUNC_NAME] = aCall.getFunctionName()
+        callMap[JSON.METHOD_TYPE] = aCall.getMethodType()
+        callMap[JSON.LEVEL] = aCall.getLevel()
+        if withReturnInfo:
+            callMap.update(self._functionReturnAsJsonMap(aCall))
+        callMap[JSON.THREAD_ID] = aCall.getThreadId()
+        #Arguments
+        callMap[JSON.ARGUMENTS] = {}
+        argsList = []
+        kargsMap = {}
+        for anArgument in aCall.getArgsList():
+            theId = anArgument.getLanguageObject().getId()
+            theName = anArgument.getName()
+            if anArgument.getName() is None:
+                argsList.append(theId)
+            else:
+                kargsMap[theName] = theId
+        callMap[JSON.ARGUMENTS][JSON.ARGS] = argsList
+        callMap[JSON.ARGUMENTS][JSON.KARGS] = kargsMap
+        return callMap
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aCall A FunctionCall that has returned.
+    # @return A "Json-compliant" Python dict with the information known when the function returns.
+    def _functionReturnAsJsonMap(self, aCall):
+        '''
+        Translate the FunctionCall returned object and exception information to a "Json-compliant" dict.
+        '''
+        JSON = CallGraphSerializer.JSON
+        returnMap = {}
+        returnMap[JSON.RETURNED_OBJECT] = _getOptionalObjectId(aCall.getReturnedObject())
+        returnMap[JSON.THREW_EXCEPTION] = aCall.threwException()
+        totalTime = aCall.getTotalTime()
+        if totalTime:
+            returnMap[JSON.TOTAL_TIME] = totalTime
+        selfTime = aCall.getSelfTime()
+        if selfTime:
+            returnMap[JSON.SELF_TIME] = selfTime
+        cpuTime = aCall.getCpuTime()
+        if cpuTime:
+            returnMap[JSON.CPU_TIME] = cpuTime
+        return returnMap
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aProgramExecution A program Call Graph to dump.
+    # @return A "Json-compliant" Python dict with the ProgramExecution data. Storing it in a Json file is straight-forward.
+    def __dumpProgramExecutionAsJsonMap(self, aProgramExecution):
+        '''
+        Translate a ProgramExecution class to a "Json-compliant" format, i.e.:
+        a Python dict (simplejson forces the object to dump to be a native type, not a custom class)
+        with the same information.
+        '''
+        JSON = CallGraphSerializer.JSON
+        progExecMap = self._programExecutionHeaderAsJsonMap(aProgramExecution)
         
         langObjects = aProgramExecution.getLanguageObjects()
         progExecMap[JSON.LANGUAGE_OBJECTS] = []
         loArray = progExecMap[JSON.LANGUAGE_OBJECTS]
-        for oId, o in langObjects.items():
-            loMap = {}
+        #In id order: parents are declared before their children
+        for oId, o in sorted(langObjects.items()):
             assert oId == o.getId()
-            loMap[JSON.ID] = oId
-            loMap[JSON.LANGUAGE_TYPE_ID] = o.getLanguageType()
-            loMap[JSON.DECLARATION_TYPE] = o.getDeclarationType()
-            loMap[JSON.DECLARATION_CODE] = fromJsonString(o.getDeclarationCode())
-            parent = o.getParent()
-            loMap[JSON.PARENT_ID] = getOptionalObjectId(parent)
-            loArray.append(loMap)
+            loArray.append(self._languageObjectAsJsonMap(o))
 
         theCalls = aProgramExecution.getFunctionCalls()
         
@@ -189,34 +299,80 @@ class CallGraphSerializer:
         callGraph = progExecMap[JSON.CALL_GRAPH]
     
         for aCall in theCalls:
-            callMap = {}
-            callMap[JSON.ID] = aCall.getId()
-            callMap[JSON.CALLEE_ID] = aCall.getCallee().getId()
-            callMap[JSON.FUNC_NAME] = aCall.getFunctionName()
-            callMap[JSON.METHOD_TYPE] = aCall.getMethodType()
-            callMap[JSON.LEVEL] = aCall.getLevel()
-            callMap[JSON.RETURNED_OBJECT] = getOptionalObjectId(aCall.getReturnedObject())
-            callMap[JSON.THREW_EXCEPTION] = aCall.threwException()
-            totalTime = aCall.getTotalTime()
-            if totalTime:
-                callMap[JSON.TOTAL_TIME] = totalTime
-            #Arguments
-            callMap[JSON.ARGUMENTS] = {}
-            argsList = []
-            kargsMap = {}
-            for anArgument in aCall.getArgsList():
-                theId = anArgument.getLanguageObject().getId()
-                theName = anArgument.getName()
-                if anArgument.getName() is None:
-                    argsList.append(theId)
-                else:
-                    kargsMap[theName] = theId
-            callMap[JSON.ARGUMENTS][JSON.ARGS] = argsList
-            callMap[JSON.ARGUMENTS][JSON.KARGS] = kargsMap
-            callGraph.append(callMap)
+            callGraph.append(self._functionCallAsJsonMap(aCall))
+
+        #Only when there's any, so databases without metadata remain the same
+        metadata = aProgramExecution.getMetadata()
+        if metadata:
+            progExecMap[JSON.METADATA] = metadata
 
         return progExecMap
 
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param line First line of a Json database.
+    # @return The Python object loaded from the line, or None.
+    def __loadFirstRecord(self, line):
+        '''
+        Load the first line of a Json database file, if it's a whole Json object (else, return None).
+        '''
+        try:
+            return fromJsonString(line)
+        except ValueError:
+            #The first line of a pretty-printed database is not a whole Json object
+            return None
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param record The first line of a Json database file, loaded (see __loadFirstRecord()).
+    # @return True if the record is the header of a streaming database.
+    def __isStreamHeader(self, record):
+        '''
+        Tell whether a record is the header record of a streaming database (see CallGraphStreamWriter).
+        '''
+        JSON = CallGraphSerializer.JSON
+        return isinstance(record, dict) and record.get(JSON.RECORD) == JSON.HEADER
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param records Lines of a streaming database.
+    # @return A newly-created ProgramExecution instance that represents the call graph stored in the records.
+    def __loadProgramExecutionFromStream(self, records):
+        '''
+        Load a new ProgramExecution class from the records of a streaming database, in order.
+        The database may come from a program that crashed: the last record may be truncated
+        (it's ignored), and the calls without "functionReturn" record have no returned object.
+        '''
+        JSON = CallGraphSerializer.JSON
+        myProgramExecution = self.__createProgramExecution(fromJsonString(records[0]))
+        language = myProgramExecution.getLanguage()
+        #Calls that have not returned yet: { id -> FunctionCall }
+        enteredCalls = {}
+        lastLineNumber = len(records) - 1
+        for lineNumber in range(1, len(records)):
+            try:
+                record = fromJsonString(records[lineNumber])
+            except ValueError:
+                if lineNumber == lastLineNumber:
+                    break
+                raise CallGraphLoadException("Invalid record in line " + str(lineNumber + 1))
+            recordType = record[JSON.RECORD]
+            if recordType == JSON.LANGUAGE_OBJECT:
+                self.__loadLanguageObject(myProgramExecution, record)
+            elif recordType == JSON.FUNCTION_CALL:
+                aCall = self.__loadFunctionCall(myProgramExecution, record, language)
+                enteredCalls[aCall.getId()] = aCall
+            elif recordType == JSON.FUNCTION_RETURN:
+                aCall = enteredCalls.pop(record[JSON.ID])
+                aCall.setReturnedObject(self.__getLanguageObjectFromId(myProgramExecution, record[JSON.RETURNED_OBJECT]))
+                aCall.setThrewException(record[JSON.THREW_EXCEPTION])
+                self.__loadCallTimes(aCall, record)
+            elif recordType == JSON.METADATA:
+                self.__loadMetadata(myProgramExecution, record[JSON.METADATA])
+            else:
+                raise CallGraphLoadException("Invalid record type in line " + str(lineNumber + 1) + ": '" + recordType + "'")
+        return myProgramExecution
+
     ##
     # @param self The CallGraphSerializer instance.
     # @param progExecMap A Python dict with a call graph previously loaded from a Json database.
@@ -225,18 +381,53 @@ class CallGraphSerializer:
         '''
         Load a new ProgramExecution class from a "Json-compliant" dict.
         '''
-        ##
-        # @param aProgramExecution Program execution that holds the LanguageObject searched.
-        # @id Id for the LanguageObject being serched (or 0 for a "None" object).
-        # @return The LanguageObject searching for id, or None if id is 0.
-        def getLanguageObjectFromId(aProgramExecution, id ):
-            '''
-            Return the LanguageObject searching for id, or None if id is 0.
-            '''
-            return None if id is 0 else aProgramExecution.getLanguageObjects()[id]
+        JSON = CallGraphSerializer.JSON
+        myProgramExecution = self.__createProgramExecution(progExecMap)
+        language = myProgramExecution.getLanguage()
+        
+        langObjectsArray = progExecMap[JSON.LANGUAGE_OBJECTS]
+        for lo in langObjectsArray:
+            self.__loadLanguageObject(myProgramExecution, lo)
+
+        myCalls = progExecMap[JSON.CALL_GRAPH]
+        for callMap in myCalls:
+            self.__loadFunctionCall(myProgramExecution, callMap, language)
         
+        if progExecMap.has_key(JSON.METADATA):
+            self.__loadMetadata(myProgramExecution, progExecMap[JSON.METADATA])
+        return myProgramExecution
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aProgramExecution Program execution where the metadata is set.
+    # @param metadata A Python dict: { key -> value }.
+    def __loadMetadata(self, aProgramExecution, metadata):
+        '''
+        Set the metadata loaded from a database.
+        '''
+        for key, value in metadata.items():
+            aProgramExecution.setMetadata(key, value)
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aProgramExecution Program execution that holds the LanguageObject searched.
+    # @param id Id for the LanguageObject being serched (or 0 for a "None" object).
+    # @return The LanguageObject searching for id, or None if id is 0.
+    def __getLanguageObjectFromId(self, aProgramExecution, id ):
+        '''
+        Return the LanguageObject searching for id, or None if id is 0.
+        '''
+        return None if id is 0 else aProgramExecution.getLanguageObjects()[id]
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param progExecMap A Python dict with the language information (see _programExecutionHeaderAsJsonMap()).
+    # @return A newly-created ProgramExecution instance, without objects or calls.
+    def __createProgramExecution(self, progExecMap):
+        '''
+        Create a new ProgramExecution, verifying the LanguageType's stored in the database.
+        '''
         JSON = CallGraphSerializer.JSON
-        language = progExecMap[JSON.LANGUAGE]
         myProgramExecution = ProgramExecution(progExecMap[JSON.LANGUAGE])
         #LanguageType map is already loaded, verify it has the same values
         
@@ -249,46 +440,175 @@ class CallGraphSerializer:
             langTypes.append(ltId)
         if sorted(myProgramExecution.getLanguageTypes()) != sorted(langTypes):
             raise CallGraphLoadException("Invalid LanguageType's: " + str(langTypes))
-        
-        langObjectsArray = progExecMap[JSON.LANGUAGE_OBJECTS]
-        for lo in langObjectsArray:
-            parent = getLanguageObjectFromId(myProgramExecution, lo[JSON.PARENT_ID])
-            myLo = LanguageObject (lo[JSON.ID], lo[JSON.LANGUAGE_TYPE_ID], lo[JSON.DECLARATION_TYPE], asJsonString(lo[JSON.DECLARATION_CODE]), parent)
-            myProgramExecution.addLanguageObject(myLo)
+        return myProgramExecution
 
-        myCalls = progExecMap[JSON.CALL_GRAPH]
-        for callMap in myCalls:
-            callId = callMap[JSON.ID]
-            callee = getLanguageObjectFromId(myProgramExecution, callMap[JSON.CALLEE_ID])
-            funcName = callMap[JSON.FUNC_NAME]
-            methodType = callMap[JSON.METHOD_TYPE]
-            level = callMap[JSON.LEVEL]
-            returnedObject = getLanguageObjectFromId(myProgramExecution, callMap[JSON.RETURNED_OBJECT] if callMap.has_key(JSON.RETURNED_OBJECT) else 0)
-            threwException = callMap[JSON.THREW_EXCEPTION] if callMap.has_key(JSON.THREW_EXCEPTION) else False 
-            totalTime = callMap[JSON.TOTAL_TIME] if callMap.has_key(JSON.TOTAL_TIME) else None
-            
-            args = callMap[JSON.ARGUMENTS][JSON.ARGS]
-            argsList = []
-            
-            #TODO GERVA: UNIFICAR
-            if language == ProgramExecution.Languages.PYTHON:
-                for arg in args:
-                    argObj = Argument(getLanguageObjectFromId(myProgramExecution, arg))
-                    argsList.append(argObj)
-                kargsMap = callMap[JSON.ARGUMENTS][JSON.KARGS]
-                for argName, objId in kargsMap.items():
-                    argObj = Argument(getLanguageObjectFromId(myProgramExecution, objId), argName)
-                    argsList.append(argObj)
-            else:
-                assert language == ProgramExecution.Languages.C_PLUS_PLUS
-                for arg in args:
-                    argLoId = arg[JSON.ID]
-                    argValueType = arg[JSON.ARG_TYPE]
-                    argIsConst = arg[JSON.IS_CONST]
-                    argObj = Argument(getLanguageObjectFromId(myProgramExecution, argLoId), None, argValueType, argIsConst)
-                    argsList.append(argObj)
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aProgramExecution Program execution where the LanguageObject is added.
+    # @param lo A Python dict with a LanguageObject (see _languageObjectAsJsonMap()).
+    def __loadLanguageObject(self, aProgramExecution, lo):
+        '''
+        Load a LanguageObject from a "Json-compliant" dict, and add it to the ProgramExecution.
+        '''
+        JSON = CallGraphSerializer.JSON
+        parent = self.__getLanguageObjectFromId(aProgramExecution, lo[JSON.PARENT_ID])
+        myLo = LanguageObject (lo[JSON.ID], lo[JSON.LANGUAGE_TYPE_ID], lo[JSON.DECLARATION_TYPE], asJsonString(lo[JSON.DECLARATION_CODE]), parent)
+        aProgramExecution.addLanguageObject(myLo)
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aProgramExecution Program execution where the FunctionCall is added.
+    # @param callMap A Python dict with a FunctionCall (see _functionCallAsJsonMap()).
+    # @param language The ProgramExecution language.
+    # @return The newly-created FunctionCall.
+    def __loadFunctionCall(self, aProgramExecution, callMap, language):
+        '''
+        Load a FunctionCall from a "Json-compliant" dict, and add it to the ProgramExecution.
+        '''
+        JSON = CallGraphSerializer.JSON
+        callId = callMap[JSON.ID]
+        callee = self.__getLanguageObjectFromId(aProgramExecution, callMap[JSON.CALLEE_ID])
+        funcName = callMap[JSON.FUNC_NAME]
+        methodType = callMap[JSON.METHOD_TYPE]
+        level = callMap[JSON.LEVEL]
+        returnedObject = self.__getLanguageObjectFromId(aProgramExecution, callMap[JSON.RETURNED_OBJECT] if callMap.has_key(JSON.RETURNED_OBJECT) else 0)
+        threwException = callMap[JSON.THREW_EXCEPTION] if callMap.has_key(JSON.THREW_EXCEPTION) else False 
+        totalTime = callMap[JSON.TOTAL_TIME] if callMap.has_key(JSON.TOTAL_TIME) else None
+        threadId = callMap[JSON.THREAD_ID] if callMap.has_key(JSON.THREAD_ID) else 0
         
-            func = FunctionCall(callId, callee, funcName, methodType, argsList, level, returnedObject, threwException, totalTime)
-            myProgramExecution.addFunctionCall(func)
+        args = callMap[JSON.ARGUMENTS][JSON.ARGS]
+        argsList = []
         
-        return myProgramExecution
\ No newline at end of file
+        #TODO GERVA: UNIFICAR
+        if language == ProgramExecution.Languages.PYTHON:
+            for arg in args:
+                argObj = Argument(self.__getLanguageObjectFromId(aProgramExecution, arg))
+                argsList.append(argObj)
+            kargsMap = callMap[JSON.ARGUMENTS][JSON.KARGS]
+            for argName, objId in kargsMap.items():
+                argObj = Argument(self.__getLanguageObjectFromId(aProgramExecution, objId), argName)
+                argsList.append(argObj)
+        else:
+            assert language == ProgramExecution.Languages.C_PLUS_PLUS
+            for arg in args:
+                argLoId = arg[JSON.ID]
+                argValueType = arg[JSON.ARG_TYPE]
+                argIsConst = arg[JSON.IS_CONST]
+                argObj = Argument(self.__getLanguageObjectFromId(aProgramExecution, argLoId), None, argValueType, argIsConst)
+                argsList.append(argObj)
+    
+        func = FunctionCall(callId, callee, funcName, methodType, argsList, level, returnedObject, threwException, totalTime, threadId)
+        self.__loadCallTimes(func, callMap)
+        aProgramExecution.addFunctionCall(func)
+        return func
+
+    ##
+    # @param self The CallGraphSerializer instance.
+    # @param aCall A FunctionCall that has returned.
+    # @param returnMap "Json-compliant" dict with its return information (see _functionReturnAsJsonMap()).
+    def __loadCallTimes(self, aCall, returnMap):
+        '''
+        Load the FunctionCall times, if they were captured.
+        '''
+        JSON = CallGraphSerializer.JSON
+        if returnMap.has_key(JSON.TOTAL_TIME):
+            aCall.setTotalTime(returnMap[JSON.TOTAL_TIME])
+        if returnMap.has_key(JSON.SELF_TIME):
+            aCall.setSelfTime(returnMap[JSON.SELF_TIME])
+        if returnMap.has_key(JSON.CPU_TIME):
+            aCall.setCpuTime(returnMap[JSON.CPU_TIME])
+
+
+class CallGraphStreamWriter:
+    '''
+    Writes a call graph while the program runs, as a streaming Json database: one Json record per line.
+    The first record is the header (language information). Then, in the order they happen:
+        * "languageObject": a LanguageObject, before any record that refers to it.
+        * "functionCall": a FunctionCall, when the function is entered.
+        * "functionReturn": the returned object (or exception) for a previous "functionCall".
+    And, at the end, "metadata": the ProgramExecution metadata, if there's any.
+    Nothing has to be kept in memory until the end, and if the program crashes,
+    the records written so far are still a valid database (see CallGraphSerializer.load()).
+    Writes are buffered, and flushed every flushInterval seconds (and whenever flush() is called).
+    '''
+    #Default seconds between flushes
+    DEFAULT_FLUSH_INTERVAL = 1.0
+    
+    ##
+    # @param self The CallGraphStreamWriter instance to construct.
+    # @param aProgramExecution The ProgramExecution being captured (only its language information is written).
+    # @param fp File object where the records are written.
+    # @param flushInterval Maximum seconds a record may stay in the write buffer.
+    def __init__(self, aProgramExecution, fp, flushInterval = DEFAULT_FLUSH_INTERVAL):
+        '''
+        Constructor. It writes the header record.
+        '''
+        self.serializer_ = CallGraphSerializer()
+        self.fp_ = fp
+        self.flushInterval_ = flushInterval
+        self.lastFlushTime_ = time.time()
+        headerMap = self.serializer_._programExecutionHeaderAsJsonMap(aProgramExecution)
+        self.__writeRecord(CallGraphSerializer.JSON.HEADER, headerMap)
+
+    ##
+    # @param self The CallGraphStreamWriter instance.
+    # @param lo A newly declared LanguageObject.
+    def writeLanguageObject(self, lo):
+        '''
+        Write a "languageObject" record.
+        '''
+        self.__writeRecord(CallGraphSerializer.JSON.LANGUAGE_OBJECT, self.serializer_._languageObjectAsJsonMap(lo))
+
+    ##
+    # @param self The CallGraphStreamWriter instance.
+    # @param aCall A FunctionCall that has just been entered.
+    def writeFunctionCall(self, aCall):
+        '''
+        Write a "functionCall" record.
+        '''
+        self.__writeRecord(CallGraphSerializer.JSON.FUNCTION_CALL, self.serializer_._functionCallAsJsonMap(aCall, withReturnInfo = False))
+
+    ##
+    # @param self The CallGraphStreamWriter instance.
+    # @param aCall A FunctionCall that has just returned.
+    def writeFunctionReturn(self, aCall):
+        '''
+        Write a "functionReturn" record.
+        '''
+        returnMap = self.serializer_._functionReturnAsJsonMap(aCall)
+        returnMap[CallGraphSerializer.JSON.ID] = aCall.getId()
+        self.__writeRecord(CallGraphSerializer.JSON.FUNCTION_RETURN, returnMap)
+
+    ##
+    # @param self The CallGraphStreamWriter instance.
+    # @param aProgramExecution The ProgramExecution being captured.
+    def writeMetadata(self, aProgramExecution):
+        '''
+        Write a "metadata" record with the ProgramExecution metadata, if there's any. It's known at the end of the capture.
+        '''
+        metadata = aProgramExecution.getMetadata()
+        if metadata:
+            self.__writeRecord(CallGraphSerializer.JSON.METADATA, { CallGraphSerializer.JSON.METADATA: metadata })
+
+    ##
+    # @param self The CallGraphStreamWriter instance.
+    def flush(self):
+        '''
+        Flush the buffered records to the file.
+        '''
+        self.fp_.flush()
+        self.lastFlushTime_ = time.time()
+
+    ##
+    # @param self The CallGraphStreamWriter instance.
+    # @param recordType Record type (one of CallGraphSerializer.JSON streaming database record types).
+    # @param recordMap A "Json-compliant" dict with the record data.
+    def __writeRecord(self, recordType, recordMap):
+        '''
+        Write a record, in just one line.
+        '''
+        recordMap[CallGraphSerializer.JSON.RECORD] = recordType
+        self.fp_.write(asJsonString(recordMap))
+        self.fp_.write('\n')
+        if time.time() - self.lastFlushTime_ >= self.flushInterval_:
+            self.flush()
\ No newline at end of file
@@ -86,6 +86,9 @@ class ClassWithConstructor:
         return self.y
     def setY(self, y):
         self.y = y
+
+class DerivedClassWithConstructor(ClassWithConstructor):
+    pass
         
 class ClassWithStaticAndClassMethods:
     @staticmethod
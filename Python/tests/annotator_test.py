@@ -21,9 +21,18 @@ from cStringIO import StringIO
 import unittest
 
 import os
+import sys
+import hashlib
+import inspect
 import tempfile
+import threading
 import bug_reproducer_assistant.annotator
+import bug_reproducer_assistant.call_graph
+import bug_reproducer_assistant.clocks
 import bug_reproducer_assistant.code_generator
+import bug_reproducer_assistant.instance_identities
+import bug_reproducer_assistant.serialization
+import bug_reproducer_assistant.sampling
 import MyFunctions
 
 def myPrint( str ):
@@ -285,7 +294,813 @@ if __name__ == '__main__':
 
         self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, sourceType = bug_reproducer_assistant.code_generator.GeneratedSourceType.UNIT_TEST)
 
-    def __testAnnotatorFunction(self, codeToRun, changeAnnotatorCb, expectedStr, createObjectCb = None, sourceType = bug_reproducer_assistant.code_generator.GeneratedSourceType.MAIN_FILE):
+    def testCallSiteIsResolvedOnlyOnce(self):
+        def createObj():
+            return MyFunctions.ClassWithConstructor
+            
+        def annotate( a, cls ):
+            a.annotate( cls )
+        
+        inspectedClasses = []
+        def codeToRun( cls ):
+            #The class was inspected when wrapping its methods: calls must not inspect it again
+            originalClassifyClassAttrs = inspect.classify_class_attrs
+            def countingClassifyClassAttrs(aClass):
+                inspectedClasses.append(aClass)
+                return originalClassifyClassAttrs(aClass)
+            inspect.classify_class_attrs = countingClassifyClassAttrs
+            try:
+                foo = cls(1,2)
+                foo.getX()
+                foo.setX(5)
+            finally:
+                inspect.classify_class_attrs = originalClassifyClassAttrs
+
+        expectedStr = """import MyFunctions
+
+var0 = MyFunctions.ClassWithConstructor(1, 2)
+var0.getX()
+var0.setX(5)
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, createObj )
+        self.assertEqual( inspectedClasses, [] )
+
+    def testEventBuffersKeepCallsOrder(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+            a.annotate( MyFunctions,  "outerFunction" )
+            a.annotate( MyFunctions,  "subtract" )
+        def codeToRun():
+            MyFunctions.add(4,5)
+            MyFunctions.outerFunction()
+            MyFunctions.subtract(4,5)
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + "MyFunctions.add(4, 5)\nMyFunctions.outerFunction()\nMyFunctions.subtract(4, 5)\n"
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, eventBufferSize = 2 )
+
+    def testEventBuffersWithManyThreads(self):
+        THREADS_COUNT = 8
+        CALLS_PER_THREAD = 50
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+        def codeToRun():
+            def worker():
+                for i in range(CALLS_PER_THREAD):
+                    MyFunctions.add(i, 1)
+            threads = [threading.Thread(target = worker) for _ in range(THREADS_COUNT)]
+            for aThread in threads:
+                aThread.start()
+            for aThread in threads:
+                aThread.join()
+        
+        equivProgramStr = self.__generateEquivalentProgram( codeToRun, annotate, eventBufferSize = 16 )
+        lines = equivProgramStr.splitlines()
+        self.assertEqual( len([line for line in lines if line.startswith("#Thread ")]), THREADS_COUNT )
+        self.assertEqual( len([line for line in lines if line.startswith("MyFunctions.add(")]), THREADS_COUNT * CALLS_PER_THREAD )
+        #Every thread calls are complete
+        for i in range(CALLS_PER_THREAD):
+            self.assertEqual( lines.count("MyFunctions.add(%d, 1)" % i), THREADS_COUNT )
+
+    def testEventBuffersOfEndedThreads(self):
+        THREADS_COUNT = 8
+        registeredBuffers = []
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+        def codeToRun():
+            a = bug_reproducer_assistant.annotator.annotatorInstance()
+            for i in range(THREADS_COUNT):
+                aThread = threading.Thread(target = MyFunctions.add, args = (i, 1))
+                aThread.start()
+                aThread.join()
+            MyFunctions.add(THREADS_COUNT, 1)
+            registeredBuffers.append( len(a.threadEventBuffers_) )
+        
+        #The buffers of the ended threads are dropped, but their buffered events are not lost
+        equivProgramStr = self.__generateEquivalentProgram( codeToRun, annotate, eventBufferSize = 16 )
+        #The code runs again after the annotations finish: only the captured run counts
+        self.assertEqual( registeredBuffers[0], 1 )
+        lines = equivProgramStr.splitlines()
+        for i in range(THREADS_COUNT + 1):
+            self.assertEqual( lines.count("MyFunctions.add(%d, 1)" % i), 1 )
+
+    def testNestingLevelsArePerThread(self):
+        THREADS_COUNT = 8
+        CALLS_PER_THREAD = 50
+        def annotate( a ):
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun():
+            def worker():
+                for i in range(CALLS_PER_THREAD):
+                    MyFunctions.outerFunction()
+            threads = [threading.Thread(target = worker) for _ in range(THREADS_COUNT)]
+            for aThread in threads:
+                aThread.start()
+            for aThread in threads:
+                aThread.join()
+        
+        #Other threads calls must not change a thread levels: only the root calls are generated
+        equivProgramStr = self.__generateEquivalentProgram( codeToRun, annotate )
+        threadCalls = equivProgramStr.split("#Thread ")[1:]
+        self.assertEqual( len(threadCalls), THREADS_COUNT )
+        for aThreadCalls in threadCalls:
+            lines = aThreadCalls.splitlines()[1:]
+            self.assertEqual( lines, ["MyFunctions.outerFunction()"] * CALLS_PER_THREAD )
+
+    def testMaxCaptureDepth(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun():
+            MyFunctions.outerFunction()
+            MyFunctions.innerFunction()
+
+        #outerFunction calls innerFunction: that nested call is captured only without depth limit
+        for maxCaptureDepth, expectedCalls in [(0, [("outerFunction", 0), ("innerFunction", 1), ("innerFunction", 0)]),
+                                               (1, [("outerFunction", 0), ("innerFunction", 0)])]:
+            a = bug_reproducer_assistant.annotator.annotatorInstance()
+            a.resetForNewAnnotations()
+            annotate(a)
+            dumpFilePath = os.path.join(tempfile.gettempdir(), "call_graph.json")
+            with bug_reproducer_assistant.annotator.ProgramExecutionDumper(dumpFilePath, preserveOldDumpFiles = False, maxCaptureDepth = maxCaptureDepth):
+                codeToRun()
+            with open(dumpFilePath, 'r') as dumpFile:
+                aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+            functionCalls = [(aCall.getFunctionName(), aCall.getLevel()) for aCall in aProgramExecution.getFunctionCalls()]
+            self.assertEqual( functionCalls, expectedCalls )
+
+    def testStreamingDump(self):
+        def createObj():
+            return MyFunctions.MyClass()
+        def annotate( a, obj ):
+            a.annotate( obj )
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun( foo ):
+            foo.f1()
+            foo.f2(5)
+            foo.f3([5])
+            foo.f4({'x': 1, 'y': 2}, None)
+            MyFunctions.outerFunction()
+        
+        #The streaming database must generate the same program
+        expectedStr = self.__generateEquivalentProgram( codeToRun, annotate, createObj )
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, createObj, streaming = True )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            records = [bug_reproducer_assistant.serialization.fromJsonString(line) for line in dumpFile]
+        JSON = bug_reproducer_assistant.serialization.CallGraphSerializer.JSON
+        self.assertEqual( records[0][JSON.RECORD], JSON.HEADER )
+        recordTypes = [record[JSON.RECORD] for record in records]
+        self.assertEqual( recordTypes.count(JSON.FUNCTION_CALL), 6 )
+        self.assertEqual( recordTypes.count(JSON.FUNCTION_RETURN), 6 )
+        
+        #The streamed objects are not kept: the forgotten ones are declared again
+        AnnotatorThread = bug_reproducer_assistant.annotator.AnnotatorThread
+        generationSize = AnnotatorThread.STREAMED_OBJECTS_GENERATION_SIZE
+        AnnotatorThread.STREAMED_OBJECTS_GENERATION_SIZE = 2
+        try:
+            self.__generateEquivalentProgram( codeToRun, annotate, createObj, streaming = True )
+        finally:
+            AnnotatorThread.STREAMED_OBJECTS_GENERATION_SIZE = generationSize
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        self.assertTrue( len(aProgramExecution.getLanguageObjects()) > recordTypes.count(JSON.LANGUAGE_OBJECT) )
+
+    def testFlightRecorder(self):
+        CALLS_COUNT = 3000
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun():
+            for i in range(CALLS_COUNT):
+                MyFunctions.add(i, 1)
+            MyFunctions.outerFunction()
+        
+        #Only the last 3 root calls are kept
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + "MyFunctions.add(%d, 1)\nMyFunctions.add(%d, 1)\nMyFunctions.outerFunction()\n" % (CALLS_COUNT - 2, CALLS_COUNT - 1)
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, flightRecorderSize = 3 )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        self.assertEqual( len(aProgramExecution.getFunctionCalls()), 4 )
+        #The objects for evicted calls are collected
+        self.assertTrue( len(aProgramExecution.getLanguageObjects()) < CALLS_COUNT / 2 )
+
+    def testDumpNow(self):
+        def loadFunctionNames(dumpFilePath):
+            with open(dumpFilePath, 'r') as dumpFile:
+                aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+            return [aCall.getFunctionName() for aCall in aProgramExecution.getFunctionCalls()]
+        
+        dumpFilePath = os.path.join(tempfile.gettempdir(), "call_graph.json")
+        for dumperOptions, expectedCalls in [({}, ["add", "subtract"]), ({'flightRecorderSize': 1}, ["subtract"]), ({'prettyPrint': True}, ["add", "subtract"])]:
+            a = bug_reproducer_assistant.annotator.annotatorInstance()
+            a.resetForNewAnnotations()
+            a.annotate( MyFunctions,  "add" )
+            a.annotate( MyFunctions,  "subtract" )
+            with bug_reproducer_assistant.annotator.ProgramExecutionDumper(dumpFilePath, preserveOldDumpFiles = False, **dumperOptions) as bugReproducerAssistantDumper:
+                MyFunctions.add(4, 5)
+                bugReproducerAssistantDumper.dumpNow()
+                self.assertEqual( loadFunctionNames(dumpFilePath), ["add"] )
+                MyFunctions.subtract(4, 5)
+            self.assertEqual( loadFunctionNames(dumpFilePath), expectedCalls )
+            with open(dumpFilePath, 'r') as dumpFile:
+                self.assertEqual( len(dumpFile.readlines()) > 1, dumperOptions.get('prettyPrint', False) )
+
+    def testContainersAreDeclaredByContents(self):
+        ProgramExecution = bug_reproducer_assistant.annotator.ProgramExecution
+        annotatorThread = bug_reproducer_assistant.annotator.AnnotatorThread(ProgramExecution(ProgramExecution.Languages.PYTHON), None)
+        declare = annotatorThread._declareObjectAndParents
+        myList = [1, [2], {'x': (3, [4])}]
+        lo = declare(myList, False)
+        self.assertTrue( declare(myList, False) is lo )
+        self.assertTrue( declare([1, [2], {'x': (3, [4])}], False) is lo )
+        #Changes are detected, even inside inner containers
+        myList[2]['x'][1].append(5)
+        changedLo = declare(myList, False)
+        self.assertNotEqual( changedLo.getId(), lo.getId() )
+        myList[2]['x'][1].pop()
+        self.assertTrue( declare(myList, False) is lo )
+        
+        #1 == 1.0 == True, but they're different arguments
+        numbers = [1, {'x': 1}]
+        numbersLo = declare(numbers, False)
+        numbers[0] = True
+        self.assertNotEqual( declare(numbers, False).getId(), numbersLo.getId() )
+        numbers[0] = 1
+        numbers[1]['x'] = 1.0
+        self.assertNotEqual( declare(numbers, False).getId(), numbersLo.getId() )
+        #Other children are compared by identity, without calling their __eq__
+        class EqualToAnything(object):
+            def __eq__(self, other):
+                return True
+        withInstance = [EqualToAnything()]
+        withInstanceLo = declare(withInstance, False)
+        withInstance[0] = EqualToAnything()
+        self.assertNotEqual( declare(withInstance, False).getId(), withInstanceLo.getId() )
+        #The snapshots kept are bounded
+        for i in range(bug_reproducer_assistant.annotator.AnnotatorThread.MAX_CONTAINER_SNAPSHOTS + 1):
+            declare([i], False)
+        self.assertTrue( len(annotatorThread.containerSnapshots_) <= bug_reproducer_assistant.annotator.AnnotatorThread.MAX_CONTAINER_SNAPSHOTS )
+        
+        #An unchanged container is not walked again
+        bigList = range(1000)
+        declare(bigList, False)
+        declaredObjects = []
+        def countingDeclare(obj, isCallee):
+            declaredObjects.append(obj)
+            return declare(obj, isCallee)
+        annotatorThread._declareObjectAndParents = countingDeclare
+        countingDeclare(bigList, False)
+        self.assertEqual( len(declaredObjects), 1 )
+
+    def testContainersInsideThemselves(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "processList" )
+            a.annotate( MyFunctions,  "processDict" )
+        def codeToRun():
+            myList = [1]
+            myList.append(myList)
+            MyFunctions.processList(myList)
+            x = []
+            y = [x]
+            x.append(y)
+            MyFunctions.processList([x, y])
+            myDict = {'a': 1}
+            myDict['self'] = myDict
+            MyFunctions.processDict(myDict)
+        
+        #The back-references are set after the containers are declared
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """var0 = [1, None]
+var0[1] = var0
+MyFunctions.processList(var0)
+var4 = [None]
+var3 = [var4]
+var4[0] = var3
+var2 = [var3, var4]
+MyFunctions.processList(var2)
+var5 = {}
+var5[u'a'] = 1
+var5[u'self'] = var5
+MyFunctions.processDict(var5)
+"""
+        for capturePolicy in (bug_reproducer_assistant.annotator.CapturePolicy.REFERENCE, bug_reproducer_assistant.annotator.CapturePolicy.SNAPSHOT):
+            self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, capturePolicy = capturePolicy )
+
+    def testDeeplyNestedContainers(self):
+        ProgramExecution = bug_reproducer_assistant.annotator.ProgramExecution
+        annotatorThread = bug_reproducer_assistant.annotator.AnnotatorThread(ProgramExecution(ProgramExecution.Languages.PYTHON), None)
+        deepList = []
+        innerList = deepList
+        for _ in range(sys.getrecursionlimit() * 2):
+            innerList.append([])
+            innerList = innerList[0]
+        lo = annotatorThread._declareObjectAndParents(deepList, False)
+        self.assertTrue( annotatorThread._declareObjectAndParents(deepList, False) is lo )
+        innerList.append(1)
+        self.assertNotEqual( annotatorThread._declareObjectAndParents(deepList, False).getId(), lo.getId() )
+
+    def testCaptureLimits(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "processList" )
+            a.annotate( MyFunctions,  "mySubstring" )
+        bigNumbers = range(1000000, 1000090)
+        def codeToRun():
+            MyFunctions.processList(range(101))
+            MyFunctions.processList([1, [2, [3]]])
+            MyFunctions.mySubstring("x" * 51, 3)
+            MyFunctions.processList(bigNumbers)
+            MyFunctions.processList([4])
+        
+        getSummary = bug_reproducer_assistant.annotator._getSummary
+        expectedStr = """from bug_reproducer_assistant import dummy
+import MyFunctions
+
+MyFunctions.processList(dummy.Dummy('%s'))
+var3 = [2, dummy.Dummy('%s')]
+var1 = [1, var3]
+MyFunctions.processList(var1)
+MyFunctions.mySubstring(dummy.Dummy('%s'), 3)
+MyFunctions.processList(dummy.Dummy('%s'))
+var9 = [4]
+MyFunctions.processList(var9)
+""" % (getSummary(range(101)), getSummary([3]), getSummary("x" * 51), getSummary(bigNumbers))
+        captureLimits = bug_reproducer_assistant.annotator.CaptureLimits(maxContainerLength = 100, maxDepth = 2, maxStringBytes = 50, maxBytesPerCall = 300)
+        CP = bug_reproducer_assistant.annotator.CapturePolicy
+        for capturePolicy in (CP.REFERENCE, CP.SNAPSHOT):
+            self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, captureLimits = captureLimits, capturePolicy = capturePolicy )
+        self.assertEqual( getSummary([3]), 'list of 1 ints, sha1=' + hashlib.sha1(repr([3])).hexdigest() )
+        #The snapshot capture policy doesn't copy the containers over the limits
+        threadEventBuffer = bug_reproducer_assistant.annotator.ThreadEventBuffer()
+        longList = range(101)
+        self.assertTrue( threadEventBuffer.snapshot(longList, captureLimits) is longList )
+        deepList = [1, [2, [3]]]
+        snapshot = threadEventBuffer.snapshot(deepList, captureLimits)
+        self.assertFalse( snapshot is deepList )
+        self.assertTrue( snapshot[1][1] is deepList[1][1] )
+
+    def testSnapshotCapturePolicy(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "processList" )
+        def codeToRun():
+            myList = [1, [2]]
+            MyFunctions.processList(myList)
+            MyFunctions.processList(myList)
+            myList[1].append(3)
+            MyFunctions.processList(myList)
+            myList.append(4)
+            MyFunctions.processList(myList)
+            MyFunctions.processList([1, [2, 3], 4])
+        
+        #Every call gets the list contents at call time, even if it's changed before AnnotatorThread declares it
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """var2 = [2]
+var0 = [1, var2]
+MyFunctions.processList(var0)
+MyFunctions.processList(var0)
+var5 = [2, 3]
+var4 = [1, var5]
+MyFunctions.processList(var4)
+var7 = [1, var5, 4]
+MyFunctions.processList(var7)
+MyFunctions.processList(var7)
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, capturePolicy = bug_reproducer_assistant.annotator.CapturePolicy.SNAPSHOT )
+        
+        #The last snapshot is reused only if the contents have the same types too: 1 == 1.0 == True
+        threadEventBuffer = bug_reproducer_assistant.annotator.ThreadEventBuffer()
+        numbers = [1]
+        snapshot = threadEventBuffer.snapshot(numbers)
+        self.assertTrue( threadEventBuffer.snapshot(numbers) is snapshot )
+        for number in (True, 1.0):
+            numbers[0] = number
+            self.assertEqual( map(type, threadEventBuffer.snapshot(numbers)), [type(number)] )
+
+    def testQueueOverflowDropsRootCalls(self):
+        DROPPED_CALLS = 5
+        class Blocker(object):
+            #AnnotatorThread encodes it, and waits until it's released
+            def __init__(self):
+                self.released_ = threading.Event()
+            def encode(self):
+                self.released_.wait()
+                return 'Blocker'
+        blocker = Blocker()
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        a.registerEncoder( Blocker, Blocker.encode )
+        a.annotate( MyFunctions,  "add" )
+        a.annotate( MyFunctions,  "innerFunction" )
+        a.annotate( MyFunctions,  "outerFunction" )
+        dumpFilePath = os.path.join(tempfile.gettempdir(), "call_graph.json")
+        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(dumpFilePath, preserveOldDumpFiles = False, queueSize = 1,
+                                                                       overflowPolicy = bug_reproducer_assistant.annotator.OverflowPolicy.DROP):
+            #When this call ends, AnnotatorThread is blocked, and the queue is full
+            MyFunctions.add(blocker, 0)
+            for i in range(DROPPED_CALLS):
+                MyFunctions.outerFunction()
+            blocker.released_.set()
+            #Wait until AnnotatorThread processes every queued event
+            a.callGraphQueue_.join()
+            MyFunctions.add(1, 1)
+        with open(dumpFilePath, 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        #Dropped root calls are dropped with their nested calls
+        self.assertEqual( [aCall.getFunctionName() for aCall in aProgramExecution.getFunctionCalls()], ["add", "add"] )
+        self.assertEqual( aProgramExecution.getMetadata(), {aProgramExecution.Metadata.DROPPED_ROOT_CALLS: DROPPED_CALLS} )
+
+    def testSampling(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add", sampler = bug_reproducer_assistant.sampling.EveryNthSampler(3) )
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun():
+            for i in range(7):
+                MyFunctions.add(i, 1)
+                MyFunctions.outerFunction()
+        
+        #"add" has its own sampler, the others have the default one. A sampled call is captured with its nested calls
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """MyFunctions.add(0, 1)
+MyFunctions.outerFunction()
+MyFunctions.add(3, 1)
+MyFunctions.outerFunction()
+MyFunctions.add(6, 1)
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, sampler = bug_reproducer_assistant.sampling.EveryNthSampler(4) )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        self.assertEqual( [aCall.getFunctionName() for aCall in aProgramExecution.getFunctionCalls()],
+                          ["add", "outerFunction", "innerFunction", "add", "outerFunction", "innerFunction", "add"] )
+
+    def testSamplingWithUnsampledNestedCalls(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "outerFunction", sampler = bug_reproducer_assistant.sampling.EveryNthSampler(3) )
+            a.annotate( MyFunctions,  "innerFunction" )
+        def codeToRun():
+            for i in range(4):
+                MyFunctions.outerFunction()
+        
+        #The calls made by a root call not chosen by its sampler aren't captured as root calls
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """MyFunctions.outerFunction()
+MyFunctions.outerFunction()
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        self.assertEqual( [(aCall.getFunctionName(), aCall.getLevel()) for aCall in aProgramExecution.getFunctionCalls()],
+                          [("outerFunction", 0), ("innerFunction", 1), ("outerFunction", 0), ("innerFunction", 1)] )
+
+    def testCaptureOnFailure(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+            a.annotate( MyFunctions,  "func2" )
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun():
+            for i in range(2):
+                MyFunctions.add(i, 1)
+                MyFunctions.outerFunction()
+                try:
+                    MyFunctions.func2()
+                except MyFunctions.MyException:
+                    pass
+
+        #Only the root calls that raised are captured
+        expectedStr = '''import unittest
+import MyFunctions
+
+class UNIT_TEST_CASE(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def test_main(self):
+        self.assertRaises(MyFunctions.MyException, MyFunctions.func2)
+        self.assertRaises(MyFunctions.MyException, MyFunctions.func2)
+
+if __name__ == '__main__':
+    unittest.main()'''
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, sourceType = bug_reproducer_assistant.code_generator.GeneratedSourceType.UNIT_TEST, captureOnFailure = True )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        self.assertEqual( [aCall.getFunctionName() for aCall in aProgramExecution.getFunctionCalls()], ["func2", "func2"] )
+
+    def testCaptureSessions(self):
+        SESSIONS = 3
+        #{ i -> CaptureSession }, for the annotated run (codeToRun is run again when the functions are restored)
+        sessions = {}
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+            a.annotate( MyFunctions,  "subtract" )
+        def runSession( i ):
+            with bug_reproducer_assistant.annotator.CaptureSession() as session:
+                MyFunctions.add(i, 1)
+                MyFunctions.subtract(i, 1)
+            sessions.setdefault(i, session)
+        def codeToRun():
+            MyFunctions.add(0, 0)
+            threads = [threading.Thread(target = runSession, args = (i,)) for i in range(1, SESSIONS + 1)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            MyFunctions.subtract(0, 0)
+        
+        #The calls made inside sessions are captured only by them
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """MyFunctions.add(0, 0)
+MyFunctions.subtract(0, 0)
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr )
+        for i in range(1, SESSIONS + 1):
+            dumpFile = StringIO()
+            bug_reproducer_assistant.serialization.CallGraphSerializer().dump(sessions[i].getProgramExecution(), dumpFile)
+            dumpFile.seek(0)
+            myCodeGenerator = bug_reproducer_assistant.code_generator.CodeGenerator(dumpFile)
+            equiv_program_io = StringIO()
+            myCodeGenerator.generateEquivalentProgram(equiv_program_io)
+            self.assertEqual( equiv_program_io.getvalue(), AnnotatorTestCase.importMyFunctionsStr + "MyFunctions.add(%d, 1)\nMyFunctions.subtract(%d, 1)\n" % (i, i) )
+            #The sessions don't start their own AnnotatorThread: one thread runs all of them
+            self.assertTrue( sessions[i].session_.annotatorThread_.ident is None )
+
+    def testProfilerCaptureEngine(self):
+        #Taken before the annotations: the wrappers engine doesn't see the calls made through it
+        add = MyFunctions.add
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+            a.annotate( MyFunctions.ClassWithConstructor )
+            a.annotate( MyFunctions.ClassWithStaticAndClassMethods,  "static1", "classMethod1" )
+        def codeToRun():
+            add(4, 5)
+            foo = MyFunctions.ClassWithConstructor(1, 2)
+            foo.setX(5)
+            MyFunctions.ClassWithStaticAndClassMethods.static1(5)
+            MyFunctions.ClassWithStaticAndClassMethods.classMethod1(x = 5)
+        
+        #The arguments are read from the frames: the ones passed by name look like positional arguments
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """MyFunctions.add(4, 5)
+var2 = MyFunctions.ClassWithConstructor(1, 2)
+var2.setX(5)
+MyFunctions.ClassWithStaticAndClassMethods.static1(5)
+MyFunctions.ClassWithStaticAndClassMethods.classMethod1(5)
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, captureEngine = bug_reproducer_assistant.annotator.CaptureEngine.PROFILER )
+
+    def testProfilerCaptureEngineInheritedMethods(self):
+        def annotate( a ):
+            a.annotate( MyFunctions.ClassWithConstructor )
+            a.annotate( MyFunctions.DerivedClassWithConstructor )
+        def codeToRun():
+            foo = MyFunctions.DerivedClassWithConstructor(1, 2)
+            foo.setX(5)
+            bar = MyFunctions.ClassWithConstructor(3, 4)
+            bar.setX(6)
+        
+        #The same code objects are annotated for both classes: each call is captured for the receiver's class
+        expectedStr = AnnotatorTestCase.importMyFunctionsStr + """var0 = MyFunctions.DerivedClassWithConstructor(1, 2)
+var0.setX(5)
+var4 = MyFunctions.ClassWithConstructor(3, 4)
+var4.setX(6)
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, captureEngine = bug_reproducer_assistant.annotator.CaptureEngine.PROFILER )
+
+    def testProfilerCaptureEngineHookRemoval(self):
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        a.annotate( MyFunctions,  "add" )
+        a.setCaptureEngine( bug_reproducer_assistant.annotator.CaptureEngine.PROFILER )
+        a.startAnnotations()
+        profileFunctions = []
+        resume = threading.Event()
+        def threadCode():
+            MyFunctions.add(1, 2)
+            resume.wait()
+            #The first event after the annotations finished removes the hook
+            MyFunctions.add(3, 4)
+            profileFunctions.append( sys.getprofile() )
+        aThread = threading.Thread(target = threadCode)
+        aThread.start()
+        a.finishAnnotations()
+        resume.set()
+        aThread.join()
+        self.assertEqual( profileFunctions, [None] )
+
+    def testProfilerCaptureEngineCantCaptureOnFailure(self):
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        a.annotate( MyFunctions,  "add" )
+        a.setCaptureEngine( bug_reproducer_assistant.annotator.CaptureEngine.PROFILER )
+        a.setCaptureOnFailure( True )
+        self.assertRaises( AssertionError, a.startAnnotations )
+        a.setCaptureOnFailure( False )
+        a.startAnnotations()
+        a.finishAnnotations()
+
+    def testOverheadBudget(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+            #Any measurable overhead is over this budget, and it's checked after every captured call
+            a.setOverheadBudget(0.000001, demotionSampleRate = 2, checkInterval = 0)
+        def codeToRun():
+            for i in range(20):
+                MyFunctions.add(i, 1)
+        
+        equiv_program_str = self.__generateEquivalentProgram( codeToRun, annotate )
+        self.assertTrue( equiv_program_str.startswith(AnnotatorTestCase.importMyFunctionsStr + "#Incomplete capture: calls to MyFunctions.add were sampled (1 of every 2)\n") )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        demotions = aProgramExecution.getMetadata()[bug_reproducer_assistant.call_graph.ProgramExecution.Metadata.DEMOTED_FUNCTIONS]
+        self.assertEqual( demotions[0]['function'], "MyFunctions.add" )
+        self.assertEqual( demotions[0]['demotion'], bug_reproducer_assistant.annotator.Demotion.SAMPLED )
+        self.assertTrue( len(aProgramExecution.getFunctionCalls()) < 20 )
+
+    def testDemotionWithNonDemotedNestedCalls(self):
+        def annotate( a ):
+            #The budget is never checked: outerFunction is demoted by hand
+            a.setOverheadBudget(0.5, demotionSampleRate = 2, checkInterval = 3600)
+            a.annotate( MyFunctions,  "outerFunction" )
+            a.annotate( MyFunctions,  "innerFunction" )
+        def codeToRun():
+            overheadMonitor = bug_reproducer_assistant.annotator.annotatorInstance().overheadMonitor_
+            overheadMonitor._demote(overheadMonitor.functionOverheads_[0], 1.0)
+            for i in range(4):
+                MyFunctions.outerFunction()
+        
+        #The calls made by a skipped call aren't captured, even if their functions aren't demoted
+        equiv_program_str = self.__generateEquivalentProgram( codeToRun, annotate )
+        self.assertTrue( equiv_program_str.startswith(AnnotatorTestCase.importMyFunctionsStr + "#Incomplete capture: calls to MyFunctions.outerFunction were sampled (1 of every 2)\n") )
+        with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        self.assertEqual( [(aCall.getFunctionName(), aCall.getLevel()) for aCall in aProgramExecution.getFunctionCalls()],
+                          [("outerFunction", 0), ("innerFunction", 1), ("outerFunction", 0), ("innerFunction", 1)] )
+
+    def testCallTiming(self):
+        def annotate( a ):
+            a.annotate( MyFunctions,  "innerFunction" )
+            a.annotate( MyFunctions,  "outerFunction" )
+        def codeToRun():
+            MyFunctions.outerFunction()
+        
+        CE = bug_reproducer_assistant.annotator.CaptureEngine
+        for captureEngine in (CE.WRAPPERS, CE.PROFILER):
+            self.__generateEquivalentProgram( codeToRun, annotate, callTiming = bug_reproducer_assistant.annotator.CallTiming.WALL_AND_CPU, captureEngine = captureEngine )
+            with open(os.path.join(tempfile.gettempdir(), "call_graph.json"), 'r') as dumpFile:
+                aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+            outerCall, innerCall = aProgramExecution.getFunctionCalls()
+            self.assertTrue( 0 < innerCall.getTotalTime() < outerCall.getTotalTime() )
+            #The self time excludes the captured calls it made
+            self.assertEqual( innerCall.getSelfTime(), innerCall.getTotalTime() )
+            self.assertAlmostEqual( outerCall.getSelfTime(), outerCall.getTotalTime() - innerCall.getTotalTime() )
+            if bug_reproducer_assistant.clocks.threadCpuTime is not None:
+                self.assertTrue( outerCall.getCpuTime() > 0 )
+
+    def testRegisteredEncoder(self):
+        def createObj():
+            return MyFunctions.ClassWithDummyParameters
+            
+        def annotate( a, cls ):
+            a.annotate( cls )
+            a.registerEncoder( MyFunctions.NonAnnotatedClass, lambda obj: obj.key )
+            
+        def codeToRun( cls ):
+            p = MyFunctions.NonAnnotatedClass()
+            p.key = 7
+            foo = cls()
+            foo.f1(p)
+            foo.f1(MyFunctions.MyClass())
+        expectedStr = """from bug_reproducer_assistant import dummy
+import MyFunctions
+
+var0 = MyFunctions.ClassWithDummyParameters()
+var0.f1(7)
+var0.f1(dummy.Dummy('MyFunctions.MyClass'))
+"""
+        self.__testAnnotatorFunction( codeToRun, annotate, expectedStr, createObj )
+
+    def testObjectEncoders(self):
+        ObjectEncoders = bug_reproducer_assistant.annotator.ObjectEncoders
+        class Unencodable(object):
+            pass
+        class EncodedSubclass(Unencodable):
+            pass
+        encoders = ObjectEncoders()
+        self.assertEqual( encoders.getDeclarationCode(u'text'), '"text"' )
+        #A str that is not UTF-8 can't be dumped, but the next ones are tried
+        self.assertEqual( encoders.getDeclarationCode('\xff'), None )
+        self.assertEqual( encoders.getDeclarationCode('ok'), '"ok"' )
+        #The first instance that can't be dumped gives its class the DUMMY verdict
+        self.assertEqual( encoders.getDeclarationCode(Unencodable()), None )
+        self.assertTrue( encoders.classEncoders_[Unencodable] is ObjectEncoders.DUMMY )
+        
+        encoders.registerEncoder( Unencodable, lambda obj: 'encoded' )
+        encoders.registerEncoder( EncodedSubclass, ObjectEncoders.DUMMY )
+        self.assertEqual( encoders.getDeclarationCode(Unencodable()), '"encoded"' )
+        self.assertEqual( encoders.getDeclarationCode(EncodedSubclass()), None )
+        
+        #DUMMY is a verdict, not "no encoder found": a class JSON knows how to dump isn't dumped
+        class Secret(dict):
+            pass
+        encoders.registerEncoder( Secret, ObjectEncoders.DUMMY )
+        self.assertEqual( encoders.getDeclarationCode(Secret(password = 'hunter2')), None )
+        #The encoded objects must be scalars
+        class Pair(object):
+            pass
+        encoders.registerEncoder( Pair, lambda obj: [1, 'x'] )
+        self.assertEqual( encoders.getDeclarationCode(Pair()), None )
+        class Record(dict):
+            pass
+        self.assertEqual( encoders.getDeclarationCode(Record(key = 1)), None )
+        self.assertTrue( encoders.classEncoders_[Record] is ObjectEncoders.DUMMY )
+
+    def testRegisteredEncoderResults(self):
+        class Secret(dict):
+            pass
+        def annotate( a ):
+            a.annotate( MyFunctions, "myPrint" )
+            a.registerEncoder( Secret, bug_reproducer_assistant.annotator.ObjectEncoders.DUMMY )
+            a.registerEncoder( MyFunctions.NonAnnotatedClass, lambda obj: [obj.key, 'x'] )
+        def codeToRun():
+            MyFunctions.myPrint( Secret(password = 'hunter2') )
+            p = MyFunctions.NonAnnotatedClass()
+            p.key = 7
+            MyFunctions.myPrint( p )
+        equiv_program_str = self.__generateEquivalentProgram( codeToRun, annotate )
+        #Secret's module depends on how the tests are run
+        self.assertTrue( "MyFunctions.myPrint(dummy.Dummy('" + __name__ + ".Secret'))\n" in equiv_program_str )
+        self.assertTrue( equiv_program_str.endswith("MyFunctions.myPrint(dummy.Dummy('MyFunctions.NonAnnotatedClass'))\n") )
+        self.assertTrue( "hunter2" not in equiv_program_str )
+
+    def testInstanceIdentity(self):
+        class PrintsTheSame(object):
+            def __str__(self):
+                raise AssertionError("Instances must be identified without running their code")
+        class NoWeakReferences(object):
+            __slots__ = ('x',)
+        ProgramExecution = bug_reproducer_assistant.annotator.ProgramExecution
+        annotatorThread = bug_reproducer_assistant.annotator.AnnotatorThread(ProgramExecution(ProgramExecution.Languages.PYTHON), None)
+        first, second = PrintsTheSame(), PrintsTheSame()
+        firstLo = annotatorThread._declareObjectAndParents(first, False)
+        self.assertTrue( annotatorThread._declareObjectAndParents(first, False) is firstLo )
+        self.assertNotEqual( annotatorThread._declareObjectAndParents(second, False).getId(), firstLo.getId() )
+        
+        identities = bug_reproducer_assistant.instance_identities.InstanceIdentities()
+        freed = PrintsTheSame()
+        freedIdentity = identities.getIdentity(freed)
+        del freed
+        #The new object may reuse the freed one's id()
+        self.assertNotEqual( identities.getIdentity(PrintsTheSame()), freedIdentity )
+        unreferenceable = NoWeakReferences()
+        identity = identities.getIdentity(unreferenceable)
+        self.assertEqual( identities.getIdentity(unreferenceable), identity )
+        identities.forget(identity)
+        self.assertNotEqual( identities.getIdentity(unreferenceable), identity )
+
+    def testInstanceIdentitiesAreBounded(self):
+        class Referenceable(object):
+            pass
+        class NoWeakReferences(object):
+            __slots__ = ('x',)
+        InstanceIdentities = bug_reproducer_assistant.instance_identities.InstanceIdentities
+        identities = InstanceIdentities()
+        freed = [Referenceable() for _ in range(10)]
+        for obj in freed:
+            identities.getIdentity(obj)
+        del freed, obj
+        live = Referenceable()
+        liveIdentity = identities.getIdentity(live)
+        self.assertEqual( identities.references_.keys(), [liveIdentity[0]] )
+        
+        #An object freed after its identity is forgotten (e.g.: by another thread)
+        dying = Referenceable()
+        dyingIdentity = identities.getIdentity(dying)
+        dyingReference = identities.references_[dyingIdentity[0]][0]
+        identities.forget(dyingIdentity)
+        del dying
+        self.assertEqual( list(identities.deadReferences_), [dyingReference] )
+        self.assertEqual( identities.getIdentity(live), liveIdentity )
+        self.assertEqual( identities.references_.keys(), [liveIdentity[0]] )
+        self.assertEqual( len(identities.deadReferences_), 0 )
+        del live
+        
+        oldMaxStrongReferences = InstanceIdentities.MAX_STRONG_REFERENCES
+        InstanceIdentities.MAX_STRONG_REFERENCES = 3
+        try:
+            unreferenceables = [NoWeakReferences() for _ in range(5)]
+            oldestIdentity = identities.getIdentity(unreferenceables[0])
+            newestIdentities = [identities.getIdentity(obj) for obj in unreferenceables[1:]]
+            self.assertEqual( len(identities.strongReferences_), 3 )
+            self.assertEqual( len(identities.references_), 3 )
+            self.assertEqual( identities.getIdentity(unreferenceables[-1]), newestIdentities[-1] )
+            #The oldest one was forgotten: it's a new object now
+            self.assertNotEqual( identities.getIdentity(unreferenceables[0]), oldestIdentity )
+            self.assertEqual( len(identities.strongReferences_), 3 )
+        finally:
+            InstanceIdentities.MAX_STRONG_REFERENCES = oldMaxStrongReferences
+
+    def __testAnnotatorFunction(self, codeToRun, changeAnnotatorCb, expectedStr, createObjectCb = None, sourceType = bug_reproducer_assistant.code_generator.GeneratedSourceType.MAIN_FILE, **dumperOptions):
+        equiv_program_str = self.__generateEquivalentProgram(codeToRun, changeAnnotatorCb, createObjectCb, sourceType, **dumperOptions)
+        self.assertEqual( equiv_program_str, expectedStr )
+
+    def __generateEquivalentProgram(self, codeToRun, changeAnnotatorCb, createObjectCb = None, sourceType = bug_reproducer_assistant.code_generator.GeneratedSourceType.MAIN_FILE, **dumperOptions):
         a = bug_reproducer_assistant.annotator.annotatorInstance()
         a.resetForNewAnnotations()
         obj = None
@@ -296,7 +1111,7 @@ if __name__ == '__main__':
             changeAnnotatorCb(a)
 
         dumpFilePath = os.path.join(tempfile.gettempdir(), "call_graph.json")
-        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(dumpFilePath, preserveOldDumpFiles = False) as bugReproducerAssistantDumper:
+        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(dumpFilePath, preserveOldDumpFiles = False, **dumperOptions) as bugReproducerAssistantDumper:
             if not createObjectCb is None:
                 codeToRun(obj)
             else:
@@ -315,8 +1130,7 @@ if __name__ == '__main__':
             myCodeGenerator.generateEquivalentProgram(equiv_program_io, bug_reproducer_assistant.annotator.ProgramExecution.MIN_LEVEL, sourceType)
             equiv_program_str = equiv_program_io.getvalue()
             equiv_program_io.close()
-        
-        self.assertEqual( equiv_program_str, expectedStr )
+        return equiv_program_str
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -197,6 +197,31 @@ class CallGraphTestCase(unittest.TestCase):
         self.assertEquals(theCalls[0], aCall)
         self.assertEquals(theCalls[1], aCall2)
         self.assertEquals(theCalls[2], aCall3)
+        
+        #Calls without thread information belong to thread 0
+        self.assertEquals(myProgramExecution.getThreadIds(), [0])
+        self.assertEquals(myProgramExecution.getThreadFunctionCalls(0), theCalls)
+        
+    def testProgramExecutionThreads(self):
+        myProgramExecution = ProgramExecution("Python")
+        mod = LanguageObject(1, LanguageType.MODULE, LanguageObject.DECLARATION_TYPES.FIXED_VALUE, "mod1")
+        myProgramExecution.addLanguageObject(mod)
+        
+        MT = FunctionCall.MethodType
+        aCall = FunctionCall(1, mod, "fun", MT.METHOD, [], 0, threadId = 2)
+        aCall2 = FunctionCall(2, mod, "fun", MT.METHOD, [], 0, threadId = 1)
+        aCall3 = FunctionCall(3, mod, "inner", MT.METHOD, [], 1, threadId = 2)
+        myProgramExecution.addFunctionCall(aCall)
+        myProgramExecution.addFunctionCall(aCall2)
+        myProgramExecution.addFunctionCall(aCall3)
+        
+        self.assertEquals(aCall.getThreadId(), 2)
+        self.assertEquals(myProgramExecution.getFunctionCalls(), [aCall, aCall2, aCall3])
+        #Threads in order of first call
+        self.assertEquals(myProgramExecution.getThreadIds(), [2, 1])
+        self.assertEquals(myProgramExecution.getThreadFunctionCalls(2), [aCall, aCall3])
+        self.assertEquals(myProgramExecution.getThreadFunctionCalls(1), [aCall2])
+        self.assertEquals(myProgramExecution.getThreadFunctionCalls(3), [])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
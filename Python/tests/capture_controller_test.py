@@ -0,0 +1,98 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from __future__ import with_statement
+
+import os
+import time
+import signal
+import tempfile
+import bug_reproducer_assistant.serialization
+from bug_reproducer_assistant.capture_controller import CaptureController
+from bug_reproducer_assistant.import_hook import AnnotationSpec
+import MyFunctions
+
+import unittest
+
+class CaptureControllerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.dumpFilePath_ = os.path.join(tempfile.gettempdir(), "capture_controller_call_graph.json")
+        self.controlFilePath_ = os.path.join(tempfile.gettempdir(), "capture_controller.on")
+        if os.path.exists(self.controlFilePath_):
+            os.remove(self.controlFilePath_)
+        def annotate( a ):
+            a.annotate( MyFunctions,  "add" )
+        self.controller_ = CaptureController(annotate, self.dumpFilePath_, preserveOldDumpFiles = False)
+
+    def tearDown(self):
+        self.controller_.shutdown()
+        unittest.TestCase.tearDown(self)
+
+    def testStartAndStop(self):
+        originalAdd = MyFunctions.add
+        MyFunctions.add(1, 1)
+        self.controller_.startCapture()
+        self.assertNotEqual( MyFunctions.add, originalAdd )
+        MyFunctions.add(2, 2)
+        self.controller_.stopCapture()
+        #The original functions are in place again
+        self.assertEqual( MyFunctions.add, originalAdd )
+        MyFunctions.add(3, 3)
+        self.assertEqual( self.__getCapturedArguments(), [['2', '2']] )
+
+    def testAnnotationSpec(self):
+        self.controller_ = CaptureController(AnnotationSpec.parse("MyFunctions:sub*"), self.dumpFilePath_, preserveOldDumpFiles = False)
+        self.controller_.startCapture()
+        MyFunctions.add(1, 1)
+        MyFunctions.subtract(2, 1)
+        self.controller_.stopCapture()
+        self.assertEqual( self.__getCapturedArguments(), [['2', '1']] )
+
+    def testControlFile(self):
+        self.controller_.watchControlFile(self.controlFilePath_, pollInterval = 0.01)
+        open(self.controlFilePath_, 'w').close()
+        self.__waitUntilCapturing(True)
+        MyFunctions.add(2, 2)
+        os.remove(self.controlFilePath_)
+        self.__waitUntilCapturing(False)
+        self.assertEqual( self.__getCapturedArguments(), [['2', '2']] )
+
+    @unittest.skipUnless(hasattr(signal, 'SIGUSR1'), "SIGUSR1 and SIGUSR2 are not available")
+    def testSignals(self):
+        self.controller_.installSignalHandlers()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.__waitUntilCapturing(True)
+        MyFunctions.add(2, 2)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        self.__waitUntilCapturing(False)
+        self.assertEqual( self.__getCapturedArguments(), [['2', '2']] )
+
+    def __waitUntilCapturing(self, capturing):
+        for i in range(500):
+            if self.controller_.isCapturing() == capturing:
+                break
+            time.sleep(0.01)
+        self.assertEqual( self.controller_.isCapturing(), capturing )
+
+    def __getCapturedArguments(self):
+        with open(self.dumpFilePath_, 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        return [[anArgument.getLanguageObject().getDeclarationCode() for anArgument in aCall.getArgsList()] for aCall in aProgramExecution.getFunctionCalls()]
+
+if __name__ == '__main__':
+    unittest.main()
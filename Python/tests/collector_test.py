@@ -0,0 +1,190 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from __future__ import with_statement
+
+from cStringIO import StringIO
+import unittest
+
+import os
+import sys
+import tempfile
+import subprocess
+import bug_reproducer_assistant.annotator
+import bug_reproducer_assistant.code_generator
+import bug_reproducer_assistant.collector
+from bug_reproducer_assistant.collector import LocalCollector
+from bug_reproducer_assistant.event_records import encodeObject
+from bug_reproducer_assistant.event_records import MAX_ENCODED_DEPTH
+from bug_reproducer_assistant.event_records import ObjectTags
+from bug_reproducer_assistant.instance_identities import InstanceIdentities
+import MyFunctions
+
+class CollectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.dumpFilePath_ = os.path.join(tempfile.gettempdir(), "collector_call_graph.json")
+        self.collectorDumpFilePath_ = os.path.join(tempfile.gettempdir(), "collector_call_graph_collected.json")
+        self.socketPath_ = os.path.join(tempfile.gettempdir(), "collector_test.sock")
+        #The collector process preserves old dump files
+        if os.path.exists(self.collectorDumpFilePath_):
+            os.remove(self.collectorDumpFilePath_)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testLocalCollector(self):
+        def annotate( a ):
+            a.annotate( MyFunctions, "add", "func2" )
+            a.annotate( MyFunctions.MyClass )
+            a.annotate( MyFunctions.ClassWithStaticAndClassMethods, "classMethod1" )
+        def codeToRun():
+            MyFunctions.add(4, [1, "two", (3.0, None)])
+            myObj = MyFunctions.MyClass()
+            myObj.f2(5)
+            myObj.f4({'x': 1, 'y': True}, MyFunctions.MyClass())
+            myObj.f5(myObj, myObj.f1())
+            MyFunctions.ClassWithStaticAndClassMethods.classMethod1(u"x")
+            try:
+                MyFunctions.func2()
+            except MyFunctions.MyException:
+                pass
+        
+        #The collector builds the same call graph as an in-process capture
+        self.__capture( codeToRun, annotate )
+        expectedStr = self.__generateCode(self.dumpFilePath_)
+        aCollector = LocalCollector(self.socketPath_, self.collectorDumpFilePath_, preserveOldDumpFiles = False)
+        aCollector.start()
+        self.__capture( codeToRun, annotate, collectorAddress = self.socketPath_ )
+        aCollector.join()
+        equivProgramStr = self.__generateCode(self.collectorDumpFilePath_)
+        self.assertEqual( equivProgramStr, expectedStr )
+        self.assertTrue( "var7.f4(var9, dummy.Dummy('MyFunctions.MyClass'))" in equivProgramStr )
+        self.assertFalse( os.path.exists(self.socketPath_) )
+
+    def testDumpNow(self):
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        a.annotate( MyFunctions, "add" )
+        aCollector = LocalCollector(self.socketPath_, self.collectorDumpFilePath_, preserveOldDumpFiles = False)
+        aCollector.start()
+        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(self.dumpFilePath_, preserveOldDumpFiles = False, collectorAddress = self.socketPath_) as dumper:
+            MyFunctions.add(1, 2)
+            dumper.dumpNow()
+            MyFunctions.add(3, 4)
+        aCollector.join()
+        #The dump requested while capturing, and the collector's dump at the end
+        self.assertEqual( self.__generateCode(self.dumpFilePath_), "import MyFunctions\n\nMyFunctions.add(1, 2)\n" )
+        self.assertEqual( self.__generateCode(self.collectorDumpFilePath_), "import MyFunctions\n\nMyFunctions.add(1, 2)\nMyFunctions.add(3, 4)\n" )
+
+    def testDeepContainers(self):
+        deepList = []
+        for i in range(3000):
+            deepList = [deepList]
+        selfContaining = {'a': 1}
+        selfContaining['self'] = selfContaining
+        #Walked without recursion: the containers nested too deep are summarized
+        objectDecoder = bug_reproducer_assistant.collector.ObjectDecoder()
+        decoded = objectDecoder.decode(encodeObject(deepList, InstanceIdentities()))
+        for i in range(MAX_ENCODED_DEPTH):
+            self.assertEqual( type(decoded), list )
+            decoded = decoded[0]
+        self.assertEqual( str(decoded), "list nested deeper than " + str(MAX_ENCODED_DEPTH) + " levels" )
+        decoded = objectDecoder.decode(encodeObject((selfContaining, 2), InstanceIdentities()))
+        self.assertEqual( decoded[0]['a'], 1 )
+        self.assertEqual( str(decoded[0]['self']), "dict inside itself" )
+        
+        #Nothing is lost
+        aCollector = LocalCollector(self.socketPath_, self.collectorDumpFilePath_, preserveOldDumpFiles = False)
+        aCollector.start()
+        self.__capture( lambda: (MyFunctions.add(1, deepList), MyFunctions.add(2, 3)), lambda a: a.annotate( MyFunctions, "add" ), collectorAddress = self.socketPath_ )
+        aCollector.join()
+        self.assertEqual( len(aCollector.getProgramExecution().getFunctionCalls()), 2 )
+
+    def testCaptureLimits(self):
+        def annotate( a ):
+            a.annotate( MyFunctions, "processList", "mySubstring" )
+        def codeToRun():
+            MyFunctions.processList(range(101))
+            MyFunctions.processList([1, [2, [3]], "y" * 51])
+            MyFunctions.mySubstring("x" * 51, 3)
+        
+        #The captured process summarizes the objects over the limits: the collector gets the summaries
+        captureLimits = bug_reproducer_assistant.annotator.CaptureLimits(maxContainerLength = 100, maxDepth = 2, maxStringBytes = 50)
+        self.__capture( codeToRun, annotate, captureLimits = captureLimits )
+        expectedStr = self.__generateCode(self.dumpFilePath_)
+        self.assertTrue( "dummy.Dummy('list of 101 ints" in expectedStr )
+        aCollector = LocalCollector(self.socketPath_, self.collectorDumpFilePath_, preserveOldDumpFiles = False)
+        aCollector.start()
+        self.__capture( codeToRun, annotate, captureLimits = captureLimits, collectorAddress = self.socketPath_ )
+        aCollector.join()
+        self.assertEqual( self.__generateCode(self.collectorDumpFilePath_), expectedStr )
+        encoded = encodeObject(range(101), InstanceIdentities(), captureLimits)
+        self.assertEqual( encoded[:2], (ObjectTags.SUMMARY, bug_reproducer_assistant.annotator._getSummary(range(101))) )
+
+    def testRegisteredEncoder(self):
+        def annotate( a ):
+            a.annotate( MyFunctions, "add", "processList" )
+            a.registerEncoder( MyFunctions.NonAnnotatedClass, lambda obj: 7 )
+            a.registerEncoder( MyFunctions.ClassWithDummyParameters, lambda obj: [obj] )
+        def codeToRun():
+            MyFunctions.add(MyFunctions.NonAnnotatedClass(), 1)
+            MyFunctions.processList([MyFunctions.NonAnnotatedClass(), MyFunctions.ClassWithDummyParameters()])
+        
+        #The captured process runs the encoders: the collector gets the scalars they return
+        self.__capture( codeToRun, annotate )
+        expectedStr = self.__generateCode(self.dumpFilePath_)
+        self.assertTrue( "MyFunctions.add(7, 1)" in expectedStr )
+        self.assertTrue( "dummy.Dummy('MyFunctions.ClassWithDummyParameters')" in expectedStr )
+        aCollector = LocalCollector(self.socketPath_, self.collectorDumpFilePath_, preserveOldDumpFiles = False)
+        aCollector.start()
+        self.__capture( codeToRun, annotate, collectorAddress = self.socketPath_ )
+        aCollector.join()
+        self.assertEqual( self.__generateCode(self.collectorDumpFilePath_), expectedStr )
+
+    def testCollectorProcess(self):
+        collectorScript = os.path.splitext(bug_reproducer_assistant.collector.__file__)[0] + ".py"
+        collectorProcess = subprocess.Popen([sys.executable, collectorScript, "-", self.collectorDumpFilePath_], stdin = subprocess.PIPE)
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        a.annotate( MyFunctions, "add", "outerFunction", "innerFunction" )
+        a.setCollectorStream(collectorProcess.stdin)
+        try:
+            with a:
+                MyFunctions.add(4, 5)
+                MyFunctions.outerFunction()
+        finally:
+            collectorProcess.stdin.close()
+            self.assertEqual( collectorProcess.wait(), 0 )
+        self.assertEqual( self.__generateCode(self.collectorDumpFilePath_), "import MyFunctions\n\nMyFunctions.add(4, 5)\nMyFunctions.outerFunction()\n" )
+
+    def __capture(self, codeToRun, annotate, **dumperOptions):
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        annotate(a)
+        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(self.dumpFilePath_, preserveOldDumpFiles = False, **dumperOptions):
+            codeToRun()
+
+    def __generateCode(self, dumpFilePath):
+        with open(dumpFilePath, 'r') as dumpFile:
+            myCodeGenerator = bug_reproducer_assistant.code_generator.CodeGenerator(dumpFile)
+            equiv_program_io = StringIO()
+            myCodeGenerator.generateEquivalentProgram(equiv_program_io)
+            return equiv_program_io.getvalue()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from __future__ import with_statement
+
+import os
+import sys
+import tempfile
+import bug_reproducer_assistant.annotator
+import bug_reproducer_assistant.serialization
+from bug_reproducer_assistant.import_hook import AnnotationSpec
+from bug_reproducer_assistant.import_hook import AnnotationImportHook
+
+import unittest
+
+class ImportHookTestCase(unittest.TestCase):
+    SPEC_TEXT = """
+#Comments and empty lines are ignored
+HookedFunctions:add
+HookedFunctions:Counter.incr*
+"""
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        #Every test imports it again
+        sys.modules.pop('HookedFunctions', None)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testParseSpec(self):
+        spec = AnnotationSpec.parse(ImportHookTestCase.SPEC_TEXT + "myapp.*\n")
+        self.assertEqual( [(rule.getModulePattern(), rule.getClassPattern(), rule.getFunctionPattern()) for rule in spec.getRules()],
+                          [('HookedFunctions', None, 'add'), ('HookedFunctions', 'Counter', 'incr*'), ('myapp.*', None, '*'), ('myapp.*', '*', '*')] )
+        self.assertTrue( spec.matchesModule('myapp.models') )
+        self.assertFalse( spec.matchesModule('MyFunctions') )
+
+    def testModuleAnnotatedOnImport(self):
+        def codeToRun():
+            HookedFunctions.add(1, 2)
+            HookedFunctions.subtract(1, 2)
+            counter = HookedFunctions.Counter(1)
+            counter.increment(2)
+            counter.reset()
+        hook = self.__createHook()
+        try:
+            #Imported before the annotations start
+            import HookedFunctions
+            self.__capture(codeToRun)
+        finally:
+            hook.uninstall()
+        self.assertEqual( self.__getCapturedFunctionNames(), ['add', 'increment'] )
+        #The functions were restored
+        self.assertEqual( HookedFunctions.add.__name__, 'add' )
+
+    def testModuleImportedWhileCapturing(self):
+        def codeToRun():
+            import HookedFunctions
+            HookedFunctions.add(1, 2)
+            HookedFunctions.Counter(1).increment(2)
+        hook = self.__createHook()
+        try:
+            self.__capture(codeToRun)
+        finally:
+            hook.uninstall()
+        self.assertEqual( self.__getCapturedFunctionNames(), ['add', 'increment'] )
+        import HookedFunctions
+        self.assertEqual( HookedFunctions.Counter.increment.__name__, 'increment' )
+
+    def __createHook(self):
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        hook = AnnotationImportHook(AnnotationSpec.parse(ImportHookTestCase.SPEC_TEXT))
+        hook.install()
+        return hook
+
+    def __capture(self, codeToRun):
+        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(self.__getDumpFilePath(), preserveOldDumpFiles = False):
+            codeToRun()
+
+    def __getCapturedFunctionNames(self):
+        with open(self.__getDumpFilePath(), 'r') as dumpFile:
+            aProgramExecution = bug_reproducer_assistant.serialization.CallGraphSerializer().load(dumpFile)
+        return [aCall.getFunctionName() for aCall in aProgramExecution.getFunctionCalls()]
+
+    def __getDumpFilePath(self):
+        return os.path.join(tempfile.gettempdir(), "import_hook_call_graph.json")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from __future__ import with_statement
+
+from cStringIO import StringIO
+import unittest
+
+import os
+import atexit
+import tempfile
+import multiprocessing
+import bug_reproducer_assistant.annotator
+import bug_reproducer_assistant.code_generator
+import bug_reproducer_assistant.file_utils
+import bug_reproducer_assistant.serialization
+from bug_reproducer_assistant.call_graph import LanguageType
+from bug_reproducer_assistant.call_graph import ProgramExecution
+from bug_reproducer_assistant.process_shards import loadProcessProgramExecutions
+from bug_reproducer_assistant.process_shards import mergeProgramExecutions
+import MyFunctions
+
+def addInChildProcess(i):
+    MyFunctions.add(i, i)
+
+class ProcessShardsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.dumpFilePath_ = os.path.join(tempfile.gettempdir(), "process_shards_call_graph.json")
+        for shardFilePath in bug_reproducer_assistant.file_utils.getShardDumpFileNames(self.dumpFilePath_):
+            os.remove(shardFilePath)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testMultiprocessingChildren(self):
+        self.__capture( self.__startChildProcesses, childProcesses = True )
+        programExecutions = loadProcessProgramExecutions(self.dumpFilePath_)
+        self.assertEqual( len(programExecutions), 3 )
+        parentProcessId = os.getpid()
+        self.assertEqual( programExecutions[0].getMetadata()[ProgramExecution.Metadata.PROCESS_ID], parentProcessId )
+        childrenArgs = []
+        for aProgramExecution in programExecutions[1:]:
+            metadata = aProgramExecution.getMetadata()
+            self.assertEqual( metadata[ProgramExecution.Metadata.PARENT_PROCESS_ID], parentProcessId )
+            self.assertNotEqual( metadata[ProgramExecution.Metadata.PROCESS_ID], parentProcessId )
+            self.assertEqual( len(aProgramExecution.getFunctionCalls()), 1 )
+            childrenArgs.append( self.__generateCode(aProgramExecution).splitlines()[-1] )
+        self.assertEqual( sorted(childrenArgs), ["MyFunctions.add(2, 2)", "MyFunctions.add(3, 3)"] )
+        self.assertEqual( self.__generateCode(programExecutions[0]), "import MyFunctions\n\nMyFunctions.add(1, 1)\nMyFunctions.add(4, 4)\n" )
+
+    def testChildProcessesNotCaptured(self):
+        self.__capture( self.__startChildProcesses )
+        self.assertEqual( len(loadProcessProgramExecutions(self.dumpFilePath_)), 1 )
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "os.fork() is not available")
+    def testForkInsideAnnotatedFunction(self):
+        def codeToRun():
+            MyFunctions.processList([1, 2])
+        def forkingPrint( text ):
+            if text == "Entered processList":
+                processId = os.fork()
+                if processId == 0:
+                    #The child process: exit as the interpreter does, running the atexit functions
+                    try:
+                        MyFunctions.add(5, 5)
+                        atexit._run_exitfuncs()
+                    finally:
+                        os._exit(0)
+                os.waitpid(processId, 0)
+        oldPrint = MyFunctions.myPrint
+        MyFunctions.myPrint = forkingPrint
+        try:
+            self.__capture( codeToRun, childProcesses = True )
+        finally:
+            MyFunctions.myPrint = oldPrint
+        programExecutions = loadProcessProgramExecutions(self.dumpFilePath_)
+        self.assertEqual( len(programExecutions), 2 )
+        #processList() returns in both processes, but it was called by the parent
+        self.assertEqual( self.__generateCode(programExecutions[1]), "import MyFunctions\n\nMyFunctions.add(5, 5)\n" )
+        merged = mergeProgramExecutions(programExecutions)
+        self.assertEqual( self.__generateCode(merged), "import MyFunctions\n\n#Thread 1\nvar0 = [1, 2]\nMyFunctions.processList(var0)\n#Thread 2\nMyFunctions.add(5, 5)\n" )
+        mergedProcesses = merged.getMetadata()[ProgramExecution.Metadata.MERGED_PROCESSES]
+        self.assertEqual( [processInfo['threadIds'] for processInfo in mergedProcesses], [[1], [2]] )
+
+    def testMergeRemapsIds(self):
+        self.__capture( lambda: MyFunctions.processDict({'x': [1, 2]}) )
+        aProgramExecution = loadProcessProgramExecutions(self.dumpFilePath_)[0]
+        merged = mergeProgramExecutions([aProgramExecution, aProgramExecution])
+        self.assertEqual( len(merged.getFunctionCalls()), 2 )
+        self.assertEqual( len(set([aCall.getThreadId() for aCall in merged.getFunctionCalls()])), 2 )
+        #Modules and classes are declared once, the instances twice
+        sharedObjectsCount = len([lo for lo in aProgramExecution.getLanguageObjects().values() if lo.getLanguageType() != LanguageType.INSTANCE])
+        self.assertEqual( len(merged.getLanguageObjects()), 2 * len(aProgramExecution.getLanguageObjects()) - sharedObjectsCount )
+        self.assertEqual( self.__generateCode(merged), "import MyFunctions\n\n"
+                          "#Thread 1\nvar2 = [1, 2]\nvar0 = {}\nvar0[u'x'] = var2\nMyFunctions.processDict(var0)\n"
+                          "#Thread 2\nvar7 = [1, 2]\nvar5 = {}\nvar5[u'x'] = var7\nMyFunctions.processDict(var5)\n" )
+
+    def __startChildProcesses(self):
+        MyFunctions.add(1, 1)
+        children = [multiprocessing.Process(target = addInChildProcess, args = (i,)) for i in (2, 3)]
+        for aChild in children:
+            aChild.start()
+        for aChild in children:
+            aChild.join()
+            self.assertEqual( aChild.exitcode, 0 )
+        MyFunctions.add(4, 4)
+
+    def __capture(self, codeToRun, **dumperOptions):
+        a = bug_reproducer_assistant.annotator.annotatorInstance()
+        a.resetForNewAnnotations()
+        a.annotate( MyFunctions, "add", "processList", "processDict" )
+        with bug_reproducer_assistant.annotator.ProgramExecutionDumper(self.dumpFilePath_, preserveOldDumpFiles = False, **dumperOptions):
+            codeToRun()
+
+    def __generateCode(self, aProgramExecution):
+        dumpFile = StringIO()
+        bug_reproducer_assistant.serialization.CallGraphSerializer().dump(aProgramExecution, dumpFile)
+        dumpFile.seek(0)
+        myCodeGenerator = bug_reproducer_assistant.code_generator.CodeGenerator(dumpFile)
+        equiv_program_io = StringIO()
+        myCodeGenerator.generateEquivalentProgram(equiv_program_io)
+        return equiv_program_io.getvalue()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# This file is part of Bug-reproducer Assistant
+# The tool has been designed and developed by Gervasio Andres Calderon Fernandez, of Core Security Technologies
+# 
+# Copyright (c) 2011, Core Security Technologies
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#  1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#  2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials
+# provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE 
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from __future__ import with_statement
+
+from bug_reproducer_assistant.sampling import EveryNthSampler
+from bug_reproducer_assistant.sampling import RateLimitSampler
+from bug_reproducer_assistant.sampling import ArgumentsHashSampler
+
+import unittest
+
+class SamplingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+
+    def testEveryNthSampler(self):
+        sampler = EveryNthSampler(3)
+        self.assertEqual( [sampler.mustSample((), {}) for i in range(7)], [True, False, False, True, False, False, True] )
+        #Clones have their own counters
+        clonedSampler = sampler.clone()
+        self.assertEqual( [clonedSampler.mustSample((), {}) for i in range(4)], [True, False, False, True] )
+
+    def testRateLimitSampler(self):
+        now = [100.0]
+        sampler = RateLimitSampler(2, lambda: now[0])
+        #A burst of 2 calls, then 2 calls per second
+        self.assertEqual( [sampler.mustSample((), {}) for i in range(3)], [True, True, False] )
+        now[0] += 0.5
+        self.assertEqual( [sampler.mustSample((), {}) for i in range(2)], [True, False] )
+        now[0] += 10
+        self.assertEqual( [sampler.mustSample((), {}) for i in range(3)], [True, True, False] )
+
+    def testArgumentsHashSampler(self):
+        sampler = ArgumentsHashSampler(4)
+        calls = [((i, 'x'), {'aList': [i]}) for i in range(100)]
+        sampled = [sampler.mustSample(args, kwargs) for args, kwargs in calls]
+        #Deterministic, whatever the sampler instance
+        self.assertEqual( sampled, [sampler.clone().mustSample(args, kwargs) for args, kwargs in calls] )
+        self.assertTrue( 0 < sampled.count(True) < len(calls) )
+        #Instances are hashed by their class, without running their code
+        class Unhashable(object):
+            def __hash__(self):
+                raise TypeError()
+            def __repr__(self):
+                raise AssertionError("The arguments must not be run")
+        self.assertEqual( [sampler.mustSample((Unhashable(),), {}) for i in range(10)], [sampler.mustSample((Unhashable(),), {})] * 10 )
+
+if __name__ == '__main__':
+    unittest.main()
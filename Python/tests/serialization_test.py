@@ -32,6 +32,7 @@ from bug_reproducer_assistant.call_graph import FunctionCall
 from bug_reproducer_assistant.call_graph import DuplicatedLanguageObjectIdException
 from bug_reproducer_assistant.call_graph import ProgramExecution
 from bug_reproducer_assistant.serialization import CallGraphSerializer
+from bug_reproducer_assistant.serialization import CallGraphStreamWriter
 from bug_reproducer_assistant.serialization import asJsonString
 
 import unittest
@@ -50,14 +51,60 @@ class CallGraphTestCase(unittest.TestCase):
         
         fileName = os.path.join(tempfile.gettempdir(), "call_graph.json")
         
-        with open(fileName, "w") as fp:
-            aSerializer.dump( myProgramExecution, fp)
+        for prettyPrint in (False, True):
+            with open(fileName, "w") as fp:
+                aSerializer.dump( myProgramExecution, fp, prettyPrint)
+            
+            with open(fileName, "r") as fp:
+                self.assertEqual( len(fp.readlines()) > 1, prettyPrint )
+                fp.seek(0)
+                loadedProgramExecution = aSerializer.load(fp)
             
+            self.__compareProgramExecutions__(myProgramExecution, loadedProgramExecution)
+
+    def testStreamSerialization(self):
+        myProgramExecution = self.__createSampleProgramExecution__()
+        fileName = os.path.join(tempfile.gettempdir(), "call_graph.json")
+        
+        with open(fileName, "w") as fp:
+            self.__writeStream__(myProgramExecution, fp)
         with open(fileName, "r") as fp:
-            loadedProgramExecution = aSerializer.load(fp)
+            loadedProgramExecution = CallGraphSerializer().load(fp)
         
         self.__compareProgramExecutions__(myProgramExecution, loadedProgramExecution)
 
+    def testTruncatedStream(self):
+        myProgramExecution = self.__createSampleProgramExecution__()
+        fileName = os.path.join(tempfile.gettempdir(), "call_graph.json")
+        
+        #A crash in the middle of the last call: its return record is partially written
+        with open(fileName, "w") as fp:
+            self.__writeStream__(myProgramExecution, fp)
+        with open(fileName, "r") as fp:
+            records = fp.readlines()
+        lastReturn = max([i for i in range(len(records)) if '"functionReturn"' in records[i]])
+        with open(fileName, "w") as fp:
+            fp.write(''.join(records[:lastReturn]) + records[lastReturn][:10])
+        with open(fileName, "r") as fp:
+            loadedProgramExecution = CallGraphSerializer().load(fp)
+        
+        loadedCalls = loadedProgramExecution.getFunctionCalls()
+        self.assertEqual( len(loadedCalls), 2 )
+        self.assertEqual( loadedCalls[0].getReturnedObject().getId(), 4 )
+        self.assertEqual( loadedCalls[1].getReturnedObject(), None )
+        self.assertEqual( loadedCalls[1].threwException(), False )
+
+    def __writeStream__(self, aProgramExecution, fp):
+        #Write the records in the order the annotator would
+        writer = CallGraphStreamWriter(aProgramExecution, fp)
+        for _, lo in sorted(aProgramExecution.getLanguageObjects().items()):
+            writer.writeLanguageObject(lo)
+        for aCall in aProgramExecution.getFunctionCalls():
+            writer.writeFunctionCall(aCall)
+            writer.writeFunctionReturn(aCall)
+        writer.writeMetadata(aProgramExecution)
+        writer.flush()
+
     def __createSampleProgramExecution__(self):
         myProgramExecution = ProgramExecution("Python")
         
@@ -80,10 +127,11 @@ class CallGraphTestCase(unittest.TestCase):
         
         MT = FunctionCall.MethodType
         aCall3 = FunctionCall(3, obj3, "__init__", MT.CONSTRUCTOR, argsList, 2, obj2)
-        aCall4 = FunctionCall(4, obj3, "obj_fun", MT.METHOD, argsList, 1, obj3, True)
+        aCall4 = FunctionCall(4, obj3, "obj_fun", MT.METHOD, argsList, 1, obj3, True, threadId = 7)
         
         myProgramExecution.addFunctionCall(aCall3)
         myProgramExecution.addFunctionCall(aCall4)
+        myProgramExecution.setMetadata(ProgramExecution.Metadata.DROPPED_ROOT_CALLS, 3)
         
         return myProgramExecution
     
@@ -95,6 +143,7 @@ class CallGraphTestCase(unittest.TestCase):
     def __compareProgramExecutions__(self, programExec1, programExec2):
         #Compare languages
         self.assertEquals(programExec1.getLanguage(), programExec2.getLanguage())
+        self.assertEquals(programExec1.getMetadata(), programExec2.getMetadata())
 
         #Compare LanguageObjects
         langObjects1 = programExec1.getLanguageObjects()
@@ -145,6 +194,7 @@ class CallGraphTestCase(unittest.TestCase):
             self.__compareLanguageObjects(call1.getReturnedObject(), call2.getReturnedObject())
             self.assertEqual(call1.threwException(), call2.threwException())
             self.assertEqual(call1.getTotalTime(), call2.getTotalTime())
+            self.assertEqual(call1.getThreadId(), call2.getThreadId())
 
     def __compareLanguageObjects(self, langObject1, langObject2):
             bothNone = langObject1 is None and langObject2 is None